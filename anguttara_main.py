@@ -5,11 +5,21 @@ Uses functional programming paradigms with pure functions where possible.
 """
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
 import chardet, re, html, os, os.path
+from functools import partial
 from urllib.parse import urljoin, urlparse
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Union
 from cobraprint import col
+from http_cache import cached_get
+from charset_sniffer import decode_html
+from rate_limiter import mount_rate_limiter
+from chapter_pool import builder_options, JOBS
+from build_graph import memo_chapters
+from chapter_normalizer import join_parts, normalize_part
+from footnotes import find_notes, render_notes, Note
+import fast_extract, sutta_ir
+from orphan_tags import strip_unclosed
 from tqdm import tqdm
 from ebooklib import epub
 from time import time
@@ -44,16 +54,16 @@ def create_session() -> requests.Session:
     """Create configured requests session."""
     session = requests.Session()
     session.headers.update({'User-Agent': USER_AGENT})
-    return session
+    return mount_rate_limiter(session)
 
 def fetch_page_content(session: requests.Session, url: str) -> str:
     """Fetch and decode page content with proper encoding."""
     try:
-        response = session.get(url, timeout=20)
-        response.raise_for_status()
-        content = response.content.decode(ENCODING)
+        # Conditional GET, served from the local copy when unchanged
+        content = decode_html(cached_get(session, url), ENCODING)
         return content
-    except Exception as e:
+    # Retried under the fetch policy first; the url is on the dead-letter list by now
+    except requests.exceptions.RequestException as e:
         print(f"Error fetching {url}: {e}")
         return ""
 
@@ -101,8 +111,11 @@ def clean_text_for_html(text: str) -> str:
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-def extract_sutta_content(soup: BeautifulSoup) -> str:
-    """Extract and format sutta content as clean HTML."""
+def sutta_content_parts(soup: BeautifulSoup) -> List[Union[Tag, str]]:
+    """
+    Content of the sutta as a list of parts: tags of the page, or markup strings.
+    chapter_normalizer writes them out as the chapter.
+    """
     # Add root URL to hrefs referring to other subpages
     refs = soup.find_all('a')
     for r in refs:
@@ -115,7 +128,7 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
     all_td_tags = soup.find_all('td', {'style': 'text-align: justify', 'valign': 'top'})
     content_td = all_td_tags[-1] if all_td_tags else None
     if not content_td:
-        return "<p>Content not found</p>"
+        return ["<p>Content not found</p>"]
 
     # Start building clean HTML
     html_parts = []
@@ -131,7 +144,7 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
             fnt = kid.find('font')
             if fnt:
                 fnt['size'] = '4'
-            html_parts.append(str(kid))
+            html_parts.append(kid)
             continue
         if kid.name == 'font' and kid.find_all('a') and not toc_processed:
             # Create a new font tag to wrap TOC
@@ -163,7 +176,7 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
                     new_div.append(a_tag)
                     font_tag.append(new_div)
                     # font_tag.append(soup.new_tag('br'))
-            html_parts.append(str(font_tag))
+            html_parts.append(font_tag)
             toc_processed = True
             continue
         if kid.name == 'b':
@@ -171,7 +184,7 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
             fnt = kid.find('font')
             if fnt:
                 fnt['size'] = '4'
-            html_parts.append(str(kid))
+            html_parts.append(kid)
         elif kid.name == 'font' and not kid.find_all('a'):
             continue  # Skip standalone font tags not part of TOC
         elif kid.name == 'p':
@@ -190,54 +203,26 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
                 if fnt and fnt.get('size') in ['4', '5', '6']:
                     kid.name = 'h3'
                     fnt['size'] = '3'
-            html_parts.append(str(kid))
+            html_parts.append(kid)
         elif kid.name == 'div':
             kid.name = 'p'
-            html_parts.append(str(kid))
+            html_parts.append(kid)
         elif kid.name != 'br':
-            html_parts.append(str(kid))
+            html_parts.append(kid)
 
     # Adding the back notes
-    table_cells = soup.find_all('td')
-    note_start = note_end = 0
-    for i, cell in enumerate(table_cells):
-        if cell.get('style') == 'text-align: justify' and cell.get('valign') == 'top':
-            note_start = i + 1
-        if '<td class="bottom" colspan="4" height="2">' in str(cell):
-            note_end = i
-
-    all_notes = table_cells[note_start:note_end]
-    for i, note in enumerate(all_notes):
-        if i % 3 == 0:
-            return_link = note.a['href'] if note.a else ''
-            continue
-        elif i % 3 == 1:
-            note_no = note.get_text()
-            continue
-        elif i % 3 == 2:
-            note.name = 'p'
-            if return_link:
-                return_tag = soup.new_tag('a')
-                return_tag['href'] = return_link
-                return_tag['style'] = "color: #996600; font-size: 2; font-family: Times New Roman, Times, serif"
-                return_tag.string = note_no
-                font_tag = note.find('font', color="#999966")
-                if font_tag:
-                    first_text = font_tag.find(string=True, recursive=False)
-                    if first_text:
-                        first_text.insert_before(return_tag)
-                        try:
-                            return_tag.insert_after(' ')
-                        except:
-                            pass
-            html_parts.append(str(note))
+    html_parts.extend(render_notes(soup, find_notes(soup)))
 
     if not html_parts:
         text_content = content_td.get_text()
         paragraphs = [p.strip() for p in text_content.split('\n\n') if p.strip()]
         html_parts = [f"<p>{html.escape(p)}</p>" for p in paragraphs[:10]]
 
-    return '\n'.join(html_parts)
+    return html_parts
+
+def extract_sutta_content(soup: BeautifulSoup) -> str:
+    """Extract and format sutta content as clean HTML."""
+    return '\n'.join(str(part) for part in sutta_content_parts(soup))
 
 def create_css() -> str:
     """Generate CSS styles for the EPUB."""
@@ -310,7 +295,37 @@ def sutta_title_html(pali_title, russ_title, sutta_number) -> str:
     <br>
     """
 
-def create_epub(output_filename: str = "anguttara_nikaya.epub") -> None:
+def read_page(path: str, fast: bool = False):
+    """The parsed page: a BeautifulSoup, or an lxml tree for the fast path."""
+    with open(path, 'r', encoding='utf-8') as f:
+        page = strip_unclosed(f.read())
+    return fast_extract.parse_page(page) if fast else BeautifulSoup(page, 'lxml')
+
+def extractors(fast: bool = False):
+    """extract_sutta_info and sutta_content_parts, or their lxml versions in fast_extract."""
+    if fast:
+        return fast_extract.extract_sutta_info, fast_extract.sutta_content_parts
+    return extract_sutta_info, sutta_content_parts
+
+def extract_page(path: str, fast: bool = False) -> Tuple[Dict[str, str], List[Union[Tag, str]], List[Note]]:
+    """(sutta info, content parts, footnotes) of a saved page, for sutta_ir."""
+    info_of, content_parts_of = extractors(fast)
+    page = read_page(path, fast)
+    notes = fast_extract.find_notes(page) if fast else find_notes(page)
+    sutta_info = info_of(page)
+    return sutta_info, content_parts_of(page), notes
+
+def build_chapter(directory: str, html_files: List[str], fast: bool = False) -> Tuple[str, str]:
+    """
+    (pali title, chapter html) of a sutta saved in one or more parts, made from their IR;
+    runs in the process pool of create_epub.
+    """
+    suttas = [sutta_ir.load(f'{directory}/{html_file}', partial(extract_page, fast=fast)) for html_file in html_files]
+    first = suttas[0]
+    title_html = sutta_title_html(first.pali_title, first.russ_title, first.sutta_number)
+    return first.pali_title, join_parts([normalize_part(title_html)] + [markup for sutta in suttas for markup in sutta.chapter_parts()])
+
+def create_epub(output_filename: str = "anguttara_nikaya.epub", jobs: int = JOBS, fast: bool = False) -> None:
     directory = 'Ангуттара Никая grouped'
     os.makedirs(directory, exist_ok=True)
     htmls = os.listdir(directory)
@@ -381,35 +396,14 @@ def create_epub(output_filename: str = "anguttara_nikaya.epub") -> None:
 
     # This section needs to be adapted to the structure of Anguttara nikaya
 
-    for sutta_num in sorted(sutta_groups.keys(), key=int):
-        html_files = sorted(sutta_groups[sutta_num])
-        combined_html = []
-        first_file = html_files[0]
-        # Fix regex for unclosed <p> tags
-        pattern = r'<p(?:\s+[^>]*)?>(?!(?:(?!<p|</p>).)*</p>)'
-        with open(f'{directory}/{first_file}', 'r', encoding='utf-8') as f:
-            content = f.read()
-            content = re.sub(pattern, '', content, flags=re.DOTALL)
-            soup = BeautifulSoup(content, 'lxml')
-        sutta_info = extract_sutta_info(soup)
-        pali_title = sutta_info['pali_title']
-        russian_title = sutta_info['russ_title']
-        sutta_number = sutta_info['sutta_number']
+    sutta_nums = sorted(sutta_groups.keys(), key=int)
+    built = memo_chapters(partial(build_chapter, directory, fast=fast), [sorted(sutta_groups[num]) for num in sutta_nums],
+                          lambda files: [f'{directory}/{name}' for name in files], jobs,
+                          version=sutta_ir.version(partial(extract_page, fast=fast)), params=f'fast={fast}')
+    for sutta_num, (pali_title, content) in zip(sutta_nums, built):
         toc_title = f"{sutta_num}. {pali_title}"
-
-        for html_file in tqdm(html_files, desc=f"Processing sutta {sutta_num}:", ascii=True, colour="green"):
-            with open(f'{directory}/{html_file}', 'r', encoding='utf-8') as f:
-                content = f.read()
-                content = re.sub(pattern, '', content, flags=re.DOTALL)
-                soup = BeautifulSoup(content, 'lxml')
-            pre_html = extract_sutta_content(soup)
-            almost_html = clean_text_content(pre_html)
-            main_html = clean_text_for_html(almost_html)
-            combined_html.append(main_html)
-        full_html = sutta_title_html(pali_title, russian_title, sutta_number) + '\n'.join(combined_html)
-        sub_soup = BeautifulSoup(full_html, 'lxml')
         chapter = epub.EpubHtml(title=toc_title, file_name=f'sutta_{sutta_num}.xhtml', lang='ru')
-        chapter.content = str(sub_soup)
+        chapter.content = content
         chapter.add_item(style_css)
         book.add_item(chapter)
         chapters.append(chapter)
@@ -427,6 +421,7 @@ def create_epub(output_filename: str = "anguttara_nikaya.epub") -> None:
 
 if __name__ == "__main__":
     output_filename = 'Ангуттара Никая.epub'
-    create_epub(output_filename)
+    options = builder_options('Build the Anguttara Nikaya EPUB.')
+    create_epub(output_filename, options.jobs, options.fast)
 
     # Ангуттара Никая с ударениями.epub
\ No newline at end of file
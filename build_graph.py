@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Memoized build graph of the nikaya pipeline:
+raw pages -> grouped files -> stressed files -> chapters -> EPUB.
+Every artifact is recorded under a key made of the hashes of its inputs and of the code
+that makes it, and is only rebuilt when that key changes: an edited sutta page rebuilds
+its group, its stressed file and its chapter, and the book is re-zipped.
+
+    python3 build_graph.py AN [--no-stress] [--jobs N] [--fast]   # bring a collection up to date
+    python3 build_graph.py --status                                # recorded artifacts per directory
+"""
+
+import argparse, ast, hashlib, importlib, importlib.util, json, os, os.path
+from collections import Counter
+from datetime import datetime, timezone
+from functools import partial
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+from cobraprint import col
+from chapter_pool import build_chapters, JOBS
+from tqdm import tqdm
+
+# Configuration
+STATE_FILE = 'build_state.json'
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+CHAPTER_DIR = '.build/chapters'
+CHUNK_SIZE = 64 * 1024
+
+# collection -> (helper module with the grouping stage, raw page directory, (book module, book directory, EPUB file name))
+PIPELINES = {
+    'AN': ('anguttara_help', 'Ангуттара Никая', ('anguttara_main', 'Ангуттара Никая grouped', 'Ангуттара Никая.epub')),
+    'SN': ('samyutta_help', 'Саньютта Никая', None),
+    'DN': (None, 'Дигха Никая', ('digha_main_grok_3', 'Дигха Никая с ударениями', 'Дигха Никая с ударениями_.epub')),
+}
+
+Task = TypeVar('Task')
+Result = TypeVar('Result')
+
+_hashes: Dict[Tuple[str, int, int], str] = {}
+_imports: Dict[str, List[str]] = {}      # sha256 of a source file -> the project modules it imports
+
+
+def file_hash(path: str) -> str:
+    """sha256 of the file; remembered for as long as the file's size and mtime stay the same."""
+    stat = os.stat(path)
+    stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _hashes.get(stamp)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+        digest = _hashes[stamp] = sha.hexdigest()
+    return digest
+
+def project_imports(path: str) -> List[str]:
+    """Source files of the project modules imported by the file (anywhere in it, also inside functions)."""
+    digest = file_hash(path)
+    paths = _imports.get(digest)
+    if paths is None:
+        with open(path, 'rb') as f:
+            source = f.read()
+        try:
+            tree = ast.parse(source, path)
+        except SyntaxError:
+            # Written for a newer Python; the module's own hash still counts
+            tree = ast.Module(body=[], type_ignores=[])
+        names = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.update(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names.add(node.module.split('.')[0])
+        paths = _imports[digest] = sorted(
+            os.path.join(PROJECT_DIR, name + '.py') for name in names
+            if os.path.isfile(os.path.join(PROJECT_DIR, name + '.py')))
+    return paths
+
+def code_version(*sources) -> str:
+    """
+    Version of the code making an artifact: the hash of the source files of the given
+    functions or module names and of all the project modules they import, directly or not.
+    Modules are not imported, so their dependencies need not be installed.
+    """
+    pending = []
+    for source in sources:
+        source = getattr(source, 'func', source)     # functools.partial
+        if isinstance(source, str):
+            pending.append(importlib.util.find_spec(source).origin)
+        else:
+            pending.append(importlib.import_module(source.__module__).__file__)
+    seen = set()
+    while pending:
+        path = os.path.abspath(pending.pop())
+        if path not in seen:
+            seen.add(path)
+            pending.extend(project_imports(path))
+    sha = hashlib.sha256()
+    for path in sorted(seen):
+        sha.update(f'{os.path.basename(path)}\0{file_hash(path)}\0'.encode())
+    return sha.hexdigest()[:16]
+
+def artifact_key(version: str, inputs: Sequence[str], params: str = '') -> str:
+    """Key of an artifact: its code version, parameters and the names and hashes of its inputs."""
+    sha = hashlib.sha256(f'{version}\0{params}'.encode())
+    for path in inputs:
+        sha.update(f'\0{os.path.basename(path)}\0{file_hash(path)}'.encode())
+    return sha.hexdigest()
+
+class BuildState:
+    """Key and content hash of every built artifact, kept in a JSON file (written by save())."""
+
+    def __init__(self, path: str = STATE_FILE):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def save(self) -> None:
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, self.path)
+
+    def fresh(self, target: str, key: str) -> bool:
+        """The target was built from this key and has not been touched since."""
+        entry = self.entries.get(target)
+        return (entry is not None and entry['key'] == key and os.path.isfile(target)
+                and file_hash(target) == entry['hash'])
+
+    def record(self, target: str, key: str) -> None:
+        self.entries[target] = {'key': key, 'hash': file_hash(target),
+                                'built_at': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+
+class Graph:
+    def __init__(self, state: Optional[BuildState] = None):
+        self.state = state if state is not None else BuildState()
+        self.built: Counter = Counter()
+        self.kept: Counter = Counter()
+
+    def target(self, stage: str, target: str, inputs: Sequence[str], recipe: Callable[[], object],
+               version: str, params: str = '') -> bool:
+        """
+        Run recipe() to make the target unless it is fresh; returns True if it was rebuilt.
+        A recipe returning False could not make the target, which is then not recorded.
+        """
+        key = artifact_key(version, inputs, params)
+        if self.state.fresh(target, key):
+            self.kept[stage] += 1
+            return False
+        if recipe() is False or not os.path.isfile(target):
+            print(f"{col.RED}Failed to build {target}{col.END}")
+            return False
+        self.state.record(target, key)
+        self.built[stage] += 1
+        return True
+
+    def report(self) -> None:
+        for stage in dict.fromkeys(list(self.built) + list(self.kept)):
+            print(f'{col.GREY}{stage}:{col.END} {col.GREEN}{self.built[stage]}{col.END} rebuilt, {col.GREY}{self.kept[stage]} up to date{col.END}')
+
+def _chapter_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], key + '.json')
+
+def memo_chapters(worker: Callable[[Task], Result], tasks: List[Task], inputs: Callable[[Task], List[str]],
+                  jobs: int = JOBS, desc: str = "Building chapters:", cache_dir: str = CHAPTER_DIR,
+                  version: Optional[str] = None, params: str = '') -> List[Result]:
+    """
+    chapter_pool.build_chapters, with every result kept under the key of the task's input files,
+    the parameters and the code making the chapters (by default the worker's, with all it imports);
+    only the chapters whose key changed are built again.
+    """
+    if version is None:
+        version = code_version(worker)
+    keys = [artifact_key(version, inputs(task), params) for task in tasks]
+    results: List[Optional[Result]] = []
+    for key in keys:
+        path = _chapter_path(key, cache_dir)
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                results.append(tuple(json.load(f)))
+        else:
+            results.append(None)
+
+    stale = [i for i, result in enumerate(results) if result is None]
+    for i, result in zip(stale, build_chapters(worker, [tasks[i] for i in stale], jobs, desc)):
+        path = _chapter_path(keys[i], cache_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+        results[i] = result
+    if tasks:
+        print(f'{col.GREY}Chapters:{col.END} {col.GREEN}{len(stale)}{col.END} built, {col.GREY}{len(tasks) - len(stale)} reused{col.END}')
+    return results
+
+def stress_file(file_path: str) -> bool:
+    """Stress one grouped file anew; False if the stressed text came back incomplete."""
+    from stress_adder_grok2 import stress_adder     # selenium is only needed once something is to be stressed
+    directory, filename = os.path.split(file_path)
+    stale = os.path.join(directory + ' с ударениями', filename)
+    # stress_adder keeps an existing output file
+    if os.path.isfile(stale):
+        os.remove(stale)
+    return not stress_adder(file_path)['shorter']
+
+def html_files(directory: str) -> List[str]:
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.html'))
+
+def build_collection(collection: str, stress: bool = True, jobs: int = JOBS, graph: Optional[Graph] = None,
+                     fast: bool = False) -> Graph:
+    """Bring the grouped files, stressed files and EPUB of a collection up to date."""
+    helper_name, raw_dir, book = PIPELINES[collection]
+    if graph is None:
+        graph = Graph()
+
+    # the state is written once, also when a stage fails halfway
+    try:
+        if helper_name:
+            helper = importlib.import_module(helper_name)
+            grouped_dir = raw_dir + ' grouped'
+            os.makedirs(grouped_dir, exist_ok=True)
+            version = code_version(helper.build_group)
+            grouped = []
+            for save_name, group_files in tqdm(helper.group_plan(helper.sutta_files(raw_dir)), desc="Grouping:", ascii=True, colour='cyan'):
+                target = os.path.join(grouped_dir, save_name)
+                recipe = partial(helper.build_group, raw_dir, grouped_dir, save_name, group_files)
+                graph.target('grouped', target, [os.path.join(raw_dir, name) for name in group_files],
+                             lambda: recipe() is not None, version)
+                grouped.append(target)
+
+            if stress:
+                version = code_version('stress_adder_grok2')
+                for file_path in tqdm(grouped, desc="Stressing:", ascii=True, colour='green'):
+                    directory, filename = os.path.split(file_path)
+                    graph.target('stressed', os.path.join(directory + ' с ударениями', filename), [file_path],
+                                 partial(stress_file, file_path), version)
+
+        if book:
+            module_name, book_dir, output_filename = book
+            builder = importlib.import_module(module_name)
+            graph.target('epub', os.path.join('Russ_suttas', output_filename), html_files(book_dir),
+                         partial(builder.create_epub, output_filename, jobs, fast), code_version(module_name), f'fast={fast}')
+        else:
+            print(f'{col.GREY}No EPUB builder for {collection} yet.{col.END}')
+    finally:
+        graph.state.save()
+
+    graph.report()
+    return graph
+
+def status(state_file: str = STATE_FILE) -> None:
+    counts = Counter(os.path.dirname(target) for target in BuildState(state_file).entries)
+    for directory, count in sorted(counts.items()):
+        print(f'{col.GREEN}{directory}{col.END}: {count} artifacts')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bring a collection up to date, rebuilding only what changed.')
+    parser.add_argument('collection', nargs='?', choices=sorted(PIPELINES))
+    parser.add_argument('--no-stress', action='store_true', help='leave out the (online) stress stage')
+    parser.add_argument('--jobs', '-j', type=int, default=JOBS)
+    parser.add_argument('--fast', action='store_true', help='extract the pages with lxml (fast_extract)')
+    parser.add_argument('--status', action='store_true')
+    args = parser.parse_args()
+
+    if args.status or not args.collection:
+        status()
+    else:
+        print(col.SEP)
+        build_collection(args.collection, not args.no_stress, args.jobs, fast=args.fast)
+        print(col.SEP)
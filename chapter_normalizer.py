@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Single-pass chapter normalizer for the create_epub builders.
+The content parts of a sutta page (tags of the parsed page, or small markup strings such as the
+title table) are serialized once, straight into the final chapter markup: whitespace is collapsed,
+null bytes, replacement characters and Word's <o:p> tags are dropped on the way. This replaces
+the str() of every fragment, the two whole-string re.sub passes and the second parse and
+serialization of the chapter.
+
+    python3 chapter_normalizer.py [directory]    # benchmark on the Majjhima pages
+"""
+
+import re, time
+from html import escape
+from typing import Callable, Iterable, List, Tuple, Union
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag
+from bs4.element import CData, Declaration, Doctype, ProcessingInstruction
+from lxml import etree
+from cobraprint import col
+
+# Configuration
+BENCH_DIR = 'Маджхима Никая с ударениями'
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+DROPPED_TAGS = {'o:p'}      # the tags go, their content stays
+MULTI_VALUED = {'class', 'rel', 'rev', 'accept-charset', 'headers', 'accesskey', 'dropzone'}
+# open element -> start tags closing it, as the lxml (libxml2) parser does when a page is parsed again;
+# this is what splits the <p> in <p> that the builders make by renaming tags
+BLOCK_TAGS = {'p', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'ul', 'ol', 'dl', 'li', 'blockquote',
+              'pre', 'hr', 'tr', 'td', 'center', 'form', 'address'}
+AUTO_CLOSE = {
+    'p': BLOCK_TAGS,
+    'h1': {'p', 'table', 'li', 'form'}, 'h2': {'p', 'table', 'li', 'form'}, 'h3': {'p', 'table', 'li', 'form'},
+    'h4': {'p', 'table', 'li', 'form'}, 'h5': {'p', 'table', 'li', 'form'}, 'h6': {'p', 'table', 'li', 'form'},
+    'b': {'p', 'td', 'center'}, 'i': {'p', 'td', 'center'}, 'font': {'td', 'center'},
+    'span': {'td'}, 'a': {'a', 'table', 'td'}, 'li': {'li'}, 'td': {'tr', 'td'}, 'tr': {'tr'},
+}
+
+WHITESPACE = re.compile(r'\s+')
+JUNK = str.maketrans('', '', '\x00\ufffd')
+
+Part = Union[Tag, etree._Element, str]
+
+
+def _attribute(name: str, value) -> str:
+    if isinstance(value, list):     # multi-valued attributes such as class
+        value = ' '.join(value)
+    value = escape(WHITESPACE.sub(' ', value.translate(JUNK)), quote=False)
+    # Quoted the way bs4 does: single quotes around a value with double quotes only
+    if '"' in value and "'" not in value:
+        return f" {name}='{value}'"
+    return f' {name}="{value.replace(chr(34), "&quot;")}"'
+
+def _lxml_attributes(node: etree._Element) -> Iterable[Tuple[str, str]]:
+    # The multi-valued attributes are split on whitespace by bs4
+    for name, value in node.attrib.items():
+        yield name, ' '.join(value.split()) if name in MULTI_VALUED else value
+
+class _Writer:
+    """Collects the output; a run of whitespace is written once even when it spans several text nodes."""
+
+    def __init__(self):
+        self.out: List[str] = []
+        self.space = True       # the output ends in whitespace (true at the start, so leading space is dropped)
+        self.open: List[list] = []     # [name, still open] of the elements written and not yet closed
+        self.dropped_end = False       # the last thing met was an end tag left out
+
+    def text(self, text: str) -> None:
+        text = WHITESPACE.sub(' ', text)
+        if self.space and text.startswith(' '):
+            text = text[1:]
+        if text:
+            self.out.append(text)
+            self.space = text.endswith(' ')
+            self.dropped_end = False
+
+    def markup(self, markup: str) -> None:
+        self.out.append(markup)
+        self.space = False
+        self.dropped_end = False
+
+    def start(self, name: str) -> None:
+        """Close the innermost elements that the start tag of name closes."""
+        while self.open and name in AUTO_CLOSE.get(self.open[-1][0], ()):
+            element = self.open.pop()
+            element[1] = False
+            self.markup(f'</{element[0]}>')
+
+    def element(self, name: str, attrs: Iterable[Tuple[str, str]], empty: bool, children: Callable[[], None]) -> None:
+        if name in DROPPED_TAGS:
+            children()
+            return
+        attrs = ''.join(_attribute(key, value) for key, value in sorted(attrs))
+        self.start(name)
+        if name in VOID_TAGS and empty:
+            self.markup(f'<{name}{attrs}/>')
+            return
+        self.markup(f'<{name}{attrs}>')
+        element = [name, True]
+        self.open.append(element)
+        children()
+        # An element closed early by a start tag inside it gets no end tag of its own
+        if element[1]:
+            self.open.pop()
+            self.markup(f'</{name}>')
+        else:
+            self.dropped_end = True
+
+    def node(self, node) -> None:
+        if isinstance(node, Tag):
+            self.element(node.name, node.attrs.items(), not node.contents,
+                         lambda: self.nodes(node.contents))
+        elif isinstance(node, Comment):
+            self.markup(f'<!--{node}-->')
+        elif isinstance(node, (Doctype, Declaration, ProcessingInstruction)):
+            pass
+        elif isinstance(node, CData):
+            self.text(escape(str(node).translate(JUNK), quote=False))
+        elif isinstance(node, NavigableString):
+            self.text(escape(str(node).translate(JUNK), quote=False))
+        elif isinstance(node, etree._Element):
+            self.lxml_node(node)
+        else:
+            # A markup string (a small one such as the title table) is parsed and written like the tags
+            self.nodes(BeautifulSoup(node, 'html.parser').contents)
+
+    def nodes(self, nodes: Iterable) -> None:
+        for node in nodes:
+            self.node(node)
+
+    def lxml_node(self, node: etree._Element) -> None:
+        """An element of an lxml tree (the fast_extract path), without its tail."""
+        if node.tag is etree.Comment:
+            self.markup(f'<!--{node.text or ""}-->')
+        elif isinstance(node.tag, str):
+            self.element(node.tag, _lxml_attributes(node), not node.text and not len(node),
+                         lambda: self.lxml_children(node))
+
+    def lxml_children(self, node: etree._Element) -> None:
+        if node.text:
+            self.text(escape(node.text.translate(JUNK), quote=False))
+        for child in node:
+            self.lxml_node(child)
+            if child.tail:
+                self.text(escape(child.tail.translate(JUNK), quote=False))
+
+def normalize_part(part: Part) -> str:
+    """Markup of one part of a chapter, as normalize_chapter writes it."""
+    writer = _Writer()
+    writer.node(part)
+    out = writer.out
+    # Trailing whitespace used to be stripped before the re-parse, so a space before a dropped end tag stays
+    if out and out[-1].endswith(' ') and not writer.dropped_end:
+        out[-1] = out[-1][:-1]
+    return ''.join(out)
+
+def join_parts(markups: Iterable[str]) -> str:
+    """The chapter made of parts written by normalize_part (kept in the sutta IR, for one)."""
+    out: List[str] = []
+    for i, markup in enumerate(markups):
+        # The parts used to be joined with newlines
+        if i and out and not out[-1].endswith(' '):
+            out.append(' ')
+        if markup:
+            out.append(markup)
+    # A part never starts with whitespace, so a lone space is a separator with nothing after it
+    if out and out[-1] == ' ':
+        out.pop()
+    return '<html><body>' + ''.join(out) + '</body></html>'
+
+def normalize_chapter(parts: Iterable[Part]) -> str:
+    """
+    Final markup of a chapter made of the given parts.
+    Tags (of a bs4 or an lxml tree) are serialized from the tree; plain strings are taken as markup.
+    """
+    return join_parts(normalize_part(part) for part in parts)
+
+def benchmark(directory: str = BENCH_DIR) -> None:
+    """Old and new chapter normalization of the Majjhima pages: time per chapter and identical EPUB markup."""
+    import os
+    from ebooklib import epub
+    import majjhima_main as builder
+
+    book = epub.EpubBook()
+    old_time = new_time = 0.0
+    same = 0
+    files = sorted(name for name in os.listdir(directory) if name.endswith('.html'))
+    for name in files:
+        with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+            page = f.read()
+
+        soup = BeautifulSoup(page, 'lxml')
+        start = time.perf_counter()
+        info = builder.extract_sutta_info(soup)
+        html = builder.sutta_title_html(info['pali_title'], info['russ_title'], info['sutta_number']) + builder.extract_sutta_content(soup)
+        old = str(BeautifulSoup(builder.clean_text_for_html(builder.clean_text_content(html)), 'lxml'))
+        old_time += time.perf_counter() - start
+
+        soup = BeautifulSoup(page, 'lxml')
+        start = time.perf_counter()
+        info = builder.extract_sutta_info(soup)
+        new = normalize_chapter([builder.sutta_title_html(info['pali_title'], info['russ_title'], info['sutta_number'])]
+                                + builder.sutta_content_parts(soup))
+        new_time += time.perf_counter() - start
+
+        # The chapters as ebooklib writes them into the book
+        chapters = []
+        for content in (old, new):
+            chapter = epub.EpubHtml(title=name, file_name='chapter.xhtml', lang='ru')
+            chapter.book = book
+            chapter.content = content
+            chapters.append(chapter.get_content())
+        same += chapters[0] == chapters[1]
+
+    count = len(files) or 1
+    print(f'{col.SEP}{col.GREY}{len(files)} chapters of {col.GREEN}{directory}{col.END}')
+    print(f'  extract + clean + re-parse: {col.RED}{old_time / count * 1000:.1f} ms{col.END} per chapter')
+    print(f'  single-pass normalizer:     {col.GREEN}{new_time / count * 1000:.1f} ms{col.END} per chapter ({old_time / (new_time or 1e-9):.1f}x)')
+    print(f'  identical EPUB markup:      {col.GREEN}{same}{col.END}/{len(files)}{col.SEP}')
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*sys.argv[1:2])
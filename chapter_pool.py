@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Process pool for the chapter work of the create_epub builders.
+Reading, parsing and cleaning the sutta pages is CPU-bound, so the chapters are built
+in worker processes; the results come back in the order of the tasks, which keeps the
+assembled book the same whatever the number of jobs.
+"""
+
+import argparse, os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, List, Optional, TypeVar
+from tqdm import tqdm
+
+# Configuration
+JOBS = os.cpu_count() or 1
+
+Task = TypeVar('Task')
+Result = TypeVar('Result')
+
+
+def build_chapters(worker: Callable[[Task], Result], tasks: Iterable[Task], jobs: int = JOBS,
+                   desc: str = "Building chapters:") -> List[Result]:
+    """
+    worker(task) for every task, in jobs processes; the results are in task order.
+    The worker must be picklable: a module-level function, or a functools.partial of one.
+    With jobs=1 everything runs in this process.
+    """
+    tasks = list(tasks)
+    progress = dict(total=len(tasks), desc=desc, ascii=True, colour='green')
+    if jobs <= 1 or len(tasks) <= 1:
+        return list(tqdm(map(worker, tasks), **progress))
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+        return list(tqdm(pool.map(worker, tasks), **progress))
+
+def builder_options(description: str, args: Optional[List[str]] = None) -> argparse.Namespace:
+    """The --jobs and --fast options of a builder's command line (or of args)."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--jobs', '-j', type=int, default=JOBS, help=f'worker processes (default {JOBS})')
+    parser.add_argument('--fast', action='store_true', help='extract the pages with lxml (fast_extract) instead of BeautifulSoup')
+    return parser.parse_args(args)
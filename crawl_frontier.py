@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Crawl frontier for the nikaya link discovery.
+Expands a nikaya index page and all of its nipata / samyutta index pages
+concurrently, normalizes and dedupes the sutta links and keeps the resulting
+link graph on disk, so that later runs start without touching the network.
+"""
+
+import requests
+import json, os, os.path, re
+from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urldefrag
+from typing import Dict, List, Optional
+from cobraprint import col
+from download_engine import fetch_page, MAX_WORKERS
+from tqdm import tqdm
+
+# Configuration
+BASE_URL = "https://theravada.ru/Teaching/Canon/Suttanta/"
+GRAPH_FILE = 'link_graph.json'
+
+AN_LINK_PATTERN = r'(anguttara-|an)[0-9]+'
+SN_LINK_PATTERN = r'(samyutta-|sn)[0-9]+'
+
+
+def normalize_link(href: str, base: str = BASE_URL) -> str:
+    """Absolute url without fragment; old '/Canon/Texts/' links are moved under '/Canon/Suttanta/'."""
+    url = urldefrag(urljoin(base, href))[0]
+    return re.sub(r'/Canon/Texts/', '/Canon/Suttanta/Texts/', url)
+
+def extract_links(page_cont: str, pattern: str, base: str = BASE_URL) -> List[str]:
+    """Normalized, deduplicated .htm links of the page matching the pattern, in page order."""
+    soup = BeautifulSoup(page_cont, 'lxml')
+    hrefs = [link.get('href') for link in soup.find_all('a')]
+    links = [normalize_link(href, base) for href in hrefs if href and href.endswith('.htm') and re.search(pattern, href)]
+    return list(dict.fromkeys(links))
+
+def fetch_links(url: str, pattern: str, base: str = BASE_URL) -> Optional[List[str]]:
+    """Fetch an index page and return its sutta links, or None if the page is unreachable."""
+    try:
+        page_cont = fetch_page(url)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        return None
+    return extract_links(page_cont, pattern, base)
+
+def page_links(url: str, pattern: str, base: str = BASE_URL) -> List[str]:
+    """Sutta links of an index page; an unreachable page yields no links."""
+    return fetch_links(url, pattern, base) or []
+
+def load_graph(graph_file: str = GRAPH_FILE) -> Dict[str, dict]:
+    if not os.path.isfile(graph_file):
+        return {}
+    with open(graph_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_graph(graph: Dict[str, dict], graph_file: str = GRAPH_FILE) -> None:
+    tmp_file = graph_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(graph, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_file, graph_file)
+
+def expand(root_url: str, pattern: str, base: str = BASE_URL, workers: int = MAX_WORKERS) -> dict:
+    """
+    Fetch the root index and all the index pages it links to concurrently.
+    Returns {'index': [index urls], 'children': {index url: [sutta urls]}}.
+    """
+    index = fetch_links(root_url, pattern, base)
+    if index is None:
+        return {'index': [], 'children': {}, 'complete': False}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(tqdm(pool.map(lambda url: fetch_links(url, pattern, base), index),
+                            total=len(index), desc="Processing links:", ascii=True, colour='cyan'))
+
+    # Each sutta belongs to the first index page listing it; links between the index pages are dropped
+    seen = set(index) | {root_url}
+    children = {}
+    for url, links in zip(index, results):
+        children[url] = [link for link in links or [] if link not in seen]
+        seen.update(children[url])
+
+    return {'index': index, 'children': children, 'complete': None not in results}
+
+def crawl(root_url: str, pattern: str, base: str = BASE_URL, refresh: bool = False,
+          graph_file: str = GRAPH_FILE) -> List[List[str]]:
+    """
+    Grand list of sutta links of a nikaya, one sublist per index page.
+    The link graph is read from graph_file unless refresh is set or it has no entry for root_url.
+    """
+    graph = load_graph(graph_file)
+    entry = graph.get(root_url)
+    if refresh or not entry:
+        entry = expand(root_url, pattern, base)
+        if entry.pop('complete'):
+            graph[root_url] = entry
+            save_graph(graph, graph_file)
+        else:
+            print(f'{col.SEP}{col.RED}Some index pages could not be fetched{col.END}, the link graph has not been saved.{col.SEP}')
+
+    return [entry['children'][url] for url in entry['index']]
@@ -5,6 +5,7 @@ import chardet, re, html, os
 from urllib.parse import urljoin
 from typing import List, Dict, Tuple, Optional
 from cobraprint import col
+from charset_sniffer import decode_html
 from tqdm import tqdm
 from ebooklib import epub
 from time import time
@@ -33,8 +34,7 @@ def fetch_page_content(session: requests.Session, url: str) -> str:
         response = session.get(url, timeout=20)
         response.raise_for_status()
         
-        # Decode with windows-1251
-        content = response.content.decode(ENCODING)
+        content = decode_html(response.content, ENCODING)
         # with open("Russ_suttas/theravada.su_table1508.html", 'w', encoding='utf-8') as f:
         #     f.write(content)
         
@@ -3,6 +3,9 @@ from bs4 import BeautifulSoup
 from ebooklib import epub
 from sutta_list import sutta_list
 from tqdm import tqdm
+from theravada_su_client import TheravadaSuClient
+
+client = TheravadaSuClient()
 
 def get_form_details(url):
     """
@@ -10,35 +13,8 @@ def get_form_details(url):
     form_build_id, form_id, and action URL.
     """
     print(f"Fetching URL: {url}")
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise ValueError(f"Failed to fetch {url}: HTTP {response.status_code}")
-    
-    soup = BeautifulSoup(response.text, 'html.parser')
-    form = soup.find('form')
-    if not form:
-        raise ValueError(f"No form found on {url}")
-    
-    columns = {}
-    for inp in form.find_all('input', attrs={'type': 'checkbox', 'name': lambda n: n and n.startswith('col_')}):
-        label_elem = inp.find_next_sibling('label')
-        if label_elem:
-            label = label_elem.text.strip()
-            columns[label] = inp['name']
-    
-    form_build_id_input = form.find('input', attrs={'name': 'form_build_id'})
-    if not form_build_id_input:
-        raise ValueError(f"No input with name 'form_build_id' found on {url}")
-    form_build_id = form_build_id_input['value']
-    
-    form_id_input = form.find('input', attrs={'name': 'form_id'})
-    if not form_id_input:
-        raise ValueError(f"No input with name 'form_id' found on {url}")
-    form_id = form_id_input['value']
-    
-    action = 'https://tipitaka.theravada.su' + form['action'] if form['action'].startswith('/') else form['action']
-    
-    return columns, form_build_id, form_id, action
+    form = client.form_details(url)
+    return form.columns, form.form_build_id, form.form_id, form.action
 
 def fetch_sutta_content(url, russian_label="Сыркин А.Я., 2020 - русский", 
                         pref_eng_label="Морис Уолш - english", 
@@ -48,73 +24,10 @@ def fetch_sutta_content(url, russian_label="Сыркин А.Я., 2020 - русс
     Extract chapter title and interleaved Russian-English paragraphs.
     """
     try:
-        columns, form_build_id, form_id, action = get_form_details(url)
+        return client.fetch_sutta(url, russian_label, pref_eng_label, fall_eng_label)
     except ValueError as e:
         print(f"Error in get_form_details for {url}: {e}")
         raise
-    
-    selected = []
-    if russian_label in columns:
-        selected.append(columns[russian_label])
-    else:
-        print(f"Warning: Russian translation '{russian_label}' not available on {url}")
-        return None, None  # Skip this sutta
-    
-    eng_selected = None
-    if pref_eng_label in columns:
-        selected.append(columns[pref_eng_label])
-        eng_selected = pref_eng_label
-    elif fall_eng_label in columns:
-        selected.append(columns[fall_eng_label])
-        eng_selected = fall_eng_label
-    
-    post_data = {col: 'on' for col in selected}
-    post_data['form_build_id'] = form_build_id
-    post_data['form_id'] = form_id
-    post_data['op'] = 'Обновить'
-    
-    response = requests.post(action, data=post_data)
-    if response.status_code != 200:
-        print(f"Warning: Failed to post form for {url}: HTTP {response.status_code}")
-        return None, None
-    
-    soup = BeautifulSoup(response.text, 'html.parser')
-    
-    # Extract chapter title
-    chapter_p = soup.find('p', class_='chapter')
-    if not chapter_p:
-        print(f"Warning: No chapter title found on {url}")
-        return None, None
-    full_title = chapter_p.text.strip()
-    
-    # Parse table content
-    table = soup.find('table', class_='table table-striped')
-    if not table:
-        print(f"Warning: No content table found on {url}")
-        return None, None
-    
-    content_html = ''
-    tbody = table.find('tbody')
-    if tbody:
-        for tr in tbody.find_all('tr'):
-            tds = tr.find_all('td')
-            if not tds:
-                continue
-            
-            # Handle potential subheadings (colspan)
-            if len(tds) == 1 and tds[0].has_attr('colspan'):
-                content_html += f'<h2>{tds[0].text.strip()}</h2>'
-            else:
-                # Assume first td is Russian, second (if exists) is English
-                rus_text = tds[0].text.strip() if len(tds) > 0 else ''
-                eng_text = tds[1].text.strip() if len(tds) > 1 else ''
-                
-                if rus_text:
-                    content_html += f'<p>{rus_text}</p>'
-                if eng_text:
-                    content_html += f'<p>{eng_text}</p>'
-    
-    return full_title, content_html
 
 def extract_toc_entry(full_title):
     """
@@ -161,12 +74,12 @@ def create_epub(sutta_links, cover_path="Russ_suttas/Digha_cover.jpg", output_pa
     )
     book.add_item(title_page)
     
-    # Fetch all suttas and collect chapters and TOC entries
+    # Fetch all suttas concurrently, then collect chapters and TOC entries in the original order
+    fetched = client.fetch_suttas(sutta_links)
     chapters = []
     toc_entries = []
-    for i, link in enumerate(tqdm(sutta_links, desc="Processing chapters:", ascii=True, colour='green'), start=1):
+    for i, (link, (full_title, content_html)) in enumerate(zip(sutta_links, fetched), start=1):
         try:
-            full_title, content_html = fetch_sutta_content(link)
             if full_title is None or content_html is None:
                 print(f"Skipping sutta {link} due to fetch errors")
                 continue
@@ -10,6 +10,14 @@ import chardet, re, html, os, os.path
 from urllib.parse import urljoin, urlparse
 from typing import List, Dict, Optional
 from cobraprint import col
+from http_cache import cached_get
+from charset_sniffer import decode_html
+from rate_limiter import mount_rate_limiter
+from download_engine import download_pages, tqdm_progress
+from download_manifest import Manifest
+from url_prober import further_parts
+from crawl_frontier import page_links
+from orphan_tags import strip_unclosed
 from tqdm import tqdm
 from ebooklib import epub
 from time import time
@@ -30,19 +38,17 @@ def create_session() -> requests.Session:
     """Create configured requests session."""
     session = requests.Session()
     session.headers.update({'User-Agent': USER_AGENT})
-    return session
+    return mount_rate_limiter(session)
 
 
 def fetch_page_content(session: requests.Session, url: str) -> str:
     """Fetch and decode page content with proper encoding."""
     try:
-        response = session.get(url, timeout=20)
-        response.raise_for_status()
-        
-        # Decode with windows-1251
-        content = response.content.decode(ENCODING)
+        # Conditional GET, served from the local copy when unchanged
+        content = decode_html(cached_get(session, url), ENCODING)
         return content
-    except Exception as e:
+    # Retried under the fetch policy first; the url is on the dead-letter list by now
+    except requests.exceptions.RequestException as e:
         print(f"Error fetching {url}: {e}")
         return ""
 
@@ -61,48 +67,19 @@ def check_url(session, url):
 
 # Fetching the list of links to sutta subpages
 def list_maker(url):
-    session = create_session()
-    page_cont = fetch_page_content(session, url)
-
-    soup = BeautifulSoup(page_cont, 'lxml')
-    links = soup.find_all('a')
-    hrefs = [urljoin(BASE_URL, link.get('href')) for link in links if link.get('href') and link.get('href').endswith('.htm') and re.search(r'dn[0-9]+', link.get('href'))]
-
-    return hrefs
+    # An unreachable index page is reported and yields no links
+    return page_links(url, r'dn[0-9]+', BASE_URL)
 
-def sublist(hrefs):
+def sublist(hrefs, refresh=False):
     subls = [item for item in hrefs if re.search(r'-01-', item)]
-    result = [item.replace('-01-', '-02-') for item in subls]
-    add_ls = []
-    index = 2
-    session = create_session()
-    for link in tqdm(result, desc='Finding links:', ascii=True, colour='yellow'):
-        next_link = link.replace(f'-0{str(index)}-', f'-0{str(index+1)}-')
-
-        while check_url(session, next_link):
-            add_ls.append(next_link)
-            index += 1
-            next_link = next_link.replace(f'-0{str(index)}-', f'-0{str(index+1)}-')
-        index = 2
-    result.extend(add_ls)
+    # Part counts are probed with HEAD requests, all suttas at once, and cached in part_counts.json
+    result = further_parts(subls, refresh)
 
     return result
 
 def subpage_download(hrefs, skip=True):
     dir = 'Дигха Никая'
-    os.makedirs( dir, exist_ok=True)
-
-    for link in tqdm(hrefs, desc="Downloading subpages:", ascii=True, colour='blue'):
-        
-        parsed_link = urlparse(link)
-        link_path = parsed_link.path
-        subpage_name = os.path.basename(link_path) + 'l'
-        if skip and subpage_name in os.listdir(dir): continue
-        resp = requests.get(link, headers=headers, stream=True)
-        resp.encoding = 'windows-1251'
-        with open(f'{dir}/{subpage_name}', 'w', encoding='utf-8') as f:
-            content = resp.text.replace('windows-1251', 'utf-8')
-            f.write(content)
+    download_pages(hrefs, dir, skip, progress=tqdm_progress("Downloading subpages:", 'blue'))
 
     print(f'{col.SEP}Sutta pages succesfully downloaded and saved at {col.GREEN}{dir}.{col.SEP}')
 
@@ -156,7 +133,7 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
     return html_parts
 
 def html_list(dir):
-    htmls = os.listdir(dir)
+    htmls = Manifest().intact_files(dir)
     htmls.sort(key=lambda x: float(re.search(r'dn.+[.]html$', x).group()[2:-5]))
 
     return htmls
@@ -172,8 +149,7 @@ if __name__ == "__main__":
         cont = f.read()
 
     # Removing the nonsencical unclose <p> at the beginning
-    pattern = r'<p(?:\s+[^>]*)?>(?!(?:(?!<p|</p>).)*</p>)'
-    clean_cont = re.sub(pattern, '', cont, flags=re.DOTALL)
+    clean_cont = strip_unclosed(cont)
 
     soup = BeautifulSoup(clean_cont, 'lxml')
 
@@ -10,6 +10,11 @@ import chardet, re, html, os, os.path
 from urllib.parse import urljoin, urlparse
 from typing import List, Dict, Optional
 from cobraprint import col
+from http_cache import cached_get
+from charset_sniffer import decode_html
+from rate_limiter import mount_rate_limiter
+from download_engine import is_saved, save_page
+from download_manifest import Manifest
 from tqdm import tqdm
 from ebooklib import epub
 from time import time
@@ -30,19 +35,17 @@ def create_session() -> requests.Session:
     """Create configured requests session."""
     session = requests.Session()
     session.headers.update({'User-Agent': USER_AGENT})
-    return session
+    return mount_rate_limiter(session)
 
 
 def fetch_page_content(session: requests.Session, url: str) -> str:
     """Fetch and decode page content with proper encoding."""
     try:
-        response = session.get(url, timeout=20)
-        response.raise_for_status()
-        
-        # Decode with windows-1251
-        content = response.content.decode(ENCODING)
+        # Conditional GET, served from the local copy when unchanged
+        content = decode_html(cached_get(session, url), ENCODING)
         return content
-    except Exception as e:
+    # Retried under the fetch policy first; the url is on the dead-letter list by now
+    except requests.exceptions.RequestException as e:
         print(f"Error fetching {url}: {e}")
         return ""
     
@@ -265,7 +268,8 @@ def sutta_title_html(pali_title, russ_title, sutta_number) -> str:
 def create_epub(output_filename: str = "digha_nikaya.epub") -> None:
     directory = 'Дигха Никая'
     os.makedirs(directory, exist_ok=True)
-    htmls = os.listdir(directory)
+    manifest = Manifest()
+    htmls = manifest.intact_files(directory)
     htmls.sort(key=lambda x: float(re.search(r'dn.+[.]html$', x).group()[2:-5]))
 
     start_time = time()
@@ -352,14 +356,11 @@ def create_epub(output_filename: str = "digha_nikaya.epub") -> None:
                 if num != 155:
                     url = hrefs[num - 1]
                     subpage_name = re.search('mn.+?htm$', url).group()
-                    if f"{subpage_name}l" not in os.listdir(directory):
-                        resp = requests.get(url, headers=headers, stream=True)
-                        resp.encoding = 'windows-1251'
-                        with open(f'{directory}/{subpage_name}l', 'w', encoding='utf-8') as f:
-                            f.write(resp.text)
-                        soup = BeautifulSoup(resp.text, 'lxml')
+                    subpage_path = f'{directory}/{subpage_name}l'
+                    if not is_saved(url, subpage_path, manifest):
+                        soup = BeautifulSoup(save_page(url, subpage_path, manifest), 'lxml')
                     else:
-                        with open(f'{directory}/{subpage_name}l', 'r', encoding='utf-8') as f:
+                        with open(subpage_path, 'r', encoding='utf-8') as f:
                             cont = f.read()
                         soup = BeautifulSoup(cont, 'lxml')
                 else:
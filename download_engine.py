@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Shared concurrent download engine for the sutta page helpers.
+Pages are fetched by a bounded thread pool over pooled keep-alive sessions,
+with a cap on the number of simultaneous requests sent to any single host.
+"""
+
+import requests
+import os, os.path, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+from typing import Callable, Dict, Iterable, List, Optional
+from cobraprint import col
+from download_manifest import Manifest
+from http_cache import default_cache, write_atomic, CachedPage
+from fetch_policy import default_policy
+from charset_sniffer import decode_html
+from page_store import PageStore, StoredPage, default_store
+from rate_limiter import mount_rate_limiter, metrics_line
+from tqdm import tqdm
+
+# Configuration
+ENCODING = 'windows-1251'
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36'
+MAX_WORKERS = 8
+PER_HOST_LIMIT = 4
+
+headers = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36',
+    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5'
+    }
+
+# progress(done, total, url)
+ProgressCallback = Callable[[int, int, str], None]
+
+_local = threading.local()
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+_host_slots_lock = threading.Lock()
+
+
+def create_pooled_session(pool_size: int = MAX_WORKERS) -> requests.Session:
+    """
+    Create a session whose connection pool keeps connections alive between requests.
+    Every request of the session waits for the per-host rate limit first.
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+    session.headers.update({'User-Agent': USER_AGENT})
+    return mount_rate_limiter(session, pool_size)
+
+def thread_session() -> requests.Session:
+    """Return the pooled session of the calling thread, creating it on first use."""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = create_pooled_session()
+    return session
+
+@contextmanager
+def host_slot(url: str, per_host: int = PER_HOST_LIMIT):
+    """Hold one of the limited request slots of the url's host."""
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(per_host)
+    with slot:
+        yield
+
+def page_file_name(link: str) -> str:
+    """'.../an1_1-10-sv.htm' -> 'an1_1-10-sv.html', '.../дигха-hикая/%D0%B4%D0%BD1' -> 'дн1.html'"""
+    name = unquote(os.path.basename(urlparse(link).path.rstrip('/')))
+    if name.endswith('.htm'):
+        return name + 'l'
+    return name if name.endswith('.html') else name + '.html'
+
+def fetch_raw(url: str, per_host: int = PER_HOST_LIMIT) -> CachedPage:
+    """
+    Fetch a single page through the calling thread's session, undecoded.
+    Retried under the fetch policy; the host slot is only held while a request is in flight.
+    """
+    def attempt() -> CachedPage:
+        with host_slot(url, per_host):
+            return default_cache().get(thread_session(), url)
+
+    return default_policy().call(url, attempt)
+
+def fetch_page(url: str, encoding: str = ENCODING, per_host: int = PER_HOST_LIMIT) -> str:
+    """
+    Fetch a single page and decode it.
+    The encoding is sniffed; the given one is only the fallback for pages that do not tell.
+    """
+    return decode_html(fetch_raw(url, per_host).content, encoding)
+
+def is_saved(link: str, path: str, manifest: Manifest) -> bool:
+    """The page is on disk intact; files saved before the manifest existed only have their existence to go by."""
+    return manifest.is_complete(link) or (manifest.get(link) is None and os.path.isfile(path))
+
+def write_page(link: str, path: str, page: StoredPage, manifest: Manifest, encoding: str = ENCODING) -> str:
+    """Save a stored page as utf-8 html, replacing the file atomically; returns the decoded page."""
+    data = page.utf8_html(encoding)
+    write_atomic(path, data)
+    manifest.record(link, path, data, 200)
+    return page.decode(encoding)
+
+def save_page(link: str, path: str, manifest: Manifest, encoding: str = ENCODING,
+              per_host: int = PER_HOST_LIMIT, store: Optional[PageStore] = None) -> str:
+    """
+    Download a page, keep its original bytes in the page store and save it as utf-8 html.
+    The outcome is recorded in the manifest. Returns the decoded page.
+    """
+    if store is None:
+        store = default_store()
+    try:
+        raw = fetch_raw(link, per_host)
+    except requests.exceptions.RequestException as e:
+        manifest.record(link, path, None, e.response.status_code if e.response is not None else 0)
+        raise
+    # The HTTP cache keeps the bodies in the default store; another store gets a copy
+    if store is not default_cache().store:
+        store.put(link, raw.content, raw.headers)
+    return write_page(link, path, store.get(link), manifest, encoding)
+
+def rebuild_pages(links: Iterable[str], save_dir: str, store: Optional[PageStore] = None,
+                  manifest: Optional[Manifest] = None, encoding: str = ENCODING) -> int:
+    """
+    Write the html files of the stored pages into save_dir again, decoding and cleaning them
+    from the original bytes without any network traffic. Returns the number of files written.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    if store is None:
+        store = default_store()
+    if manifest is None:
+        manifest = Manifest()
+    written = 0
+    for link in links:
+        page = store.get(link)
+        if page is None:
+            continue
+        write_page(link, os.path.join(save_dir, page_file_name(link)), page, manifest, encoding)
+        written += 1
+    return written
+
+def tqdm_progress(desc: str = "Downloading suttas:", colour: str = 'green') -> ProgressCallback:
+    """Progress callback drawing the usual tqdm bar; the bar is created on the first call."""
+    bar = None
+
+    def progress(done: int, total: int, url: str) -> None:
+        nonlocal bar
+        if bar is None:
+            bar = tqdm(total=total, desc=desc, ascii=True, colour=colour)
+        bar.set_postfix_str(metrics_line(url), refresh=False)
+        bar.update(1)
+        if done == total:
+            bar.close()
+
+    return progress
+
+def download_pages(links: Iterable[str], save_dir: str, skip: bool = True, encoding: str = ENCODING,
+                   workers: int = MAX_WORKERS, per_host: int = PER_HOST_LIMIT,
+                   progress: Optional[ProgressCallback] = None,
+                   manifest: Optional[Manifest] = None, store: Optional[PageStore] = None) -> List[str]:
+    """
+    Download the given sutta pages concurrently into save_dir as utf-8 html files.
+    Every attempt is recorded in the manifest, so an interrupted run resumes with
+    exactly the pages that are missing, failed or damaged; with skip set, pages already
+    in the page store are rewritten from there instead of being downloaded again.
+    Returns the names of the saved files; failed links are reported at the end.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    if manifest is None:
+        manifest = Manifest()
+    if store is None:
+        store = default_store()
+    pending = []
+    restored = []
+    for link in dict.fromkeys(links):
+        name = page_file_name(link)
+        if skip and is_saved(link, os.path.join(save_dir, name), manifest):
+            continue
+        if skip and link in store:
+            restored.append(link)
+        else:
+            pending.append((link, name))
+    rebuild_pages(restored, save_dir, store, manifest, encoding)
+    if progress is None:
+        progress = tqdm_progress()
+
+    def download(link: str, name: str) -> str:
+        save_page(link, os.path.join(save_dir, name), manifest, encoding, per_host, store)
+        return name
+
+    saved = [page_file_name(link) for link in restored]
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(download, link, name): link for link, name in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            link = futures[future]
+            try:
+                saved.append(future.result())
+            except requests.exceptions.RequestException as e:
+                failed.append((link, e))
+            progress(done, len(pending), link)
+
+    if failed:
+        print(f'{col.SEP}{col.RED}{len(failed)}{col.END} pages could not be downloaded:')
+        for link, e in failed:
+            print(f'{col.GREY}{link}{col.END}: {e}')
+
+    return saved
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Append-only download manifest.
+Every download attempt is recorded as one JSON line (url, local file, byte size, modification
+time, content hash, HTTP status and fetch time); the last line for a url wins.
+"""
+
+import json, os, os.path, threading, hashlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+MANIFEST_FILE = 'download_manifest.jsonl'
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def file_matches(entry: dict) -> bool:
+    """
+    True if the file of a manifest entry has the recorded size and sha256.
+    A file with the recorded size and modification time is taken as intact without hashing it.
+    """
+    try:
+        stat = os.stat(entry['file'])
+        if stat.st_size != entry['size']:
+            return False
+        if entry.get('mtime_ns') == stat.st_mtime_ns:
+            return True
+        with open(entry['file'], 'rb') as f:
+            return content_hash(f.read()) == entry['sha256']
+    except OSError:
+        return False
+
+class Manifest:
+    """In-memory index of the manifest file, kept in sync by appending new entries."""
+
+    def __init__(self, path: str = MANIFEST_FILE):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A run killed in the middle of a write leaves a partial last line
+                        continue
+                    self.entries[entry['url']] = entry
+
+    def get(self, url: str) -> Optional[dict]:
+        return self.entries.get(url)
+
+    def is_complete(self, url: str) -> bool:
+        """True if the url was downloaded successfully and its file is still intact on disk."""
+        entry = self.entries.get(url)
+        if not entry or entry['status'] != 200:
+            return False
+        return file_matches(entry)
+
+    def intact_files(self, directory: str) -> List[str]:
+        """
+        Names of the files in directory fit for processing: files of failed downloads and
+        files not matching their recorded size and hash are left out.
+        Files the manifest knows nothing about (saved by the earlier versions) are kept.
+        """
+        by_file = {os.path.normpath(entry['file']): entry for entry in self.entries.values()}
+        names = []
+        for name in os.listdir(directory):
+            entry = by_file.get(os.path.normpath(os.path.join(directory, name)))
+            if entry is None or (entry['status'] == 200 and file_matches(entry)):
+                names.append(name)
+        return names
+
+    def record(self, url: str, file: str, data: Optional[bytes], status: int) -> dict:
+        """Append the outcome of one download, after its file is written; data is None for a failed attempt."""
+        entry = {
+            'url': url,
+            'file': file,
+            'size': len(data) if data is not None else 0,
+            'mtime_ns': os.stat(file).st_mtime_ns if data is not None and os.path.isfile(file) else 0,
+            'sha256': content_hash(data) if data is not None else '',
+            'status': status,
+            'fetched_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.entries[url] = entry
+        return entry
+
+    def failed(self) -> Dict[str, dict]:
+        """Entries whose last attempt did not succeed."""
+        return {url: entry for url, entry in self.entries.items() if entry['status'] != 200}
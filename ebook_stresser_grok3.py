@@ -2,6 +2,7 @@ import ebooklib, os
 from ebooklib import epub
 from ebooklib.epub import Link, Section
 from cobraprint import col
+from rate_limiter import throttle
 import time
 import logging
 import re
@@ -222,6 +223,7 @@ def stress_adder(file_path):
             for attempt in range(retry_attempts):
                 try:
                     # Navigate to website
+                    throttle("https://russiangram.com/")
                     driver.get("https://russiangram.com/")
                     input_field = WebDriverWait(driver, 30).until(
                         EC.presence_of_element_located((By.ID, "MainContent_UserSentenceTextbox"))
@@ -279,6 +281,7 @@ def stress_adder(file_path):
                     logging.error(f"Attempt {attempt + 1} failed for section: {section_to_upload[:100]}... Error: {str(e)}")
                     if attempt < retry_attempts - 1:
                         time.sleep(retry_delay)
+                        throttle("https://russiangram.com/")
                         driver.get("https://russiangram.com/")
                     else:
                         print(f"{col.RED}All retries failed for section. Adding to failed sections.{col.END}")
@@ -307,6 +310,7 @@ def stress_adder(file_path):
             driver = None
             try:
                 driver = webdriver.Chrome(options=options)
+                throttle("https://russiangram.com/")
                 driver.get("https://russiangram.com/")
                 input_field = WebDriverWait(driver, 30).until(
                     EC.presence_of_element_located((By.ID, "MainContent_UserSentenceTextbox"))
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+lxml fast path of the sutta page extraction of the EPUB builders.
+extract_sutta_info and the sutta_content_parts variants do what the BeautifulSoup functions
+of the builders do, on an lxml.html tree: the page is parsed by the same libxml2 parser,
+without building the bs4 object tree on top, and the parts go to
+chapter_normalizer.normalize_chapter as they are. The builders use it with --fast.
+
+    python3 fast_extract.py [MN DN AN]    # check both paths give the same pages, and time them
+"""
+
+import contextlib, copy, html, io, os, os.path, re, time
+from functools import partial
+from typing import Dict, List, Optional, Union
+from bs4 import NavigableString
+from lxml import etree
+from lxml import html as lxml_html
+from cobraprint import col
+from footnotes import Note, BACK_LINK_STYLE, NOTE_TEXT_COLOUR
+
+# Configuration
+TEXTS_URL = 'https://theravada.ru/Teaching/Canon/Suttanta/Texts/'
+
+# collection -> (builder module, directory of its pages)
+COLLECTIONS = {
+    'MN': ('majjhima_main', 'Маджхима Никая с ударениями'),
+    'DN': ('digha_main_grok_3', 'Дигха Никая с ударениями'),
+    'AN': ('anguttara_main', 'Ангуттара Никая grouped'),
+}
+
+# Text between the elements is given as a NavigableString, which normalize_chapter writes as text;
+# a plain string is taken as markup, as in the BeautifulSoup path
+Part = Union[etree._Element, str]
+
+ASCII_SPACES = ' \n\t\x0c\r'
+
+
+def parse_page(page: str) -> etree._Element:
+    return lxml_html.document_fromstring(page)
+
+# bs4 idioms on lxml elements
+
+def name(node) -> Optional[str]:
+    """Tag name, None for text and comments (like bs4's .name)."""
+    return node.tag if isinstance(node, etree._Element) and isinstance(node.tag, str) else None
+
+def find_all(node: etree._Element, tag: str, **attrs: str) -> List[etree._Element]:
+    """The descendants with the tag and the attribute values, in document order."""
+    return [element for element in node.iterdescendants(tag)
+            if all(element.get(key) == value for key, value in attrs.items())]
+
+def find(node: etree._Element, tag: str, **attrs: str) -> Optional[etree._Element]:
+    for element in node.iterdescendants(tag):
+        if all(element.get(key) == value for key, value in attrs.items()):
+            return element
+    return None
+
+def bs4_string(text: str) -> str:
+    """The text as bs4 keeps it: a string of ASCII whitespace only becomes a single newline or space."""
+    if text.strip(ASCII_SPACES):
+        return text
+    return '\n' if '\n' in text else ' '
+
+def get_text(node: etree._Element) -> str:
+    return ''.join(bs4_string(text) for text in node.itertext())
+
+def contents(node: etree._Element) -> List[Part]:
+    """The children of the node with the text between them, like bs4's .contents."""
+    children: List[Part] = [NavigableString(bs4_string(node.text))] if node.text else []
+    for child in node:
+        children.append(child)
+        if child.tail:
+            children.append(NavigableString(bs4_string(child.tail)))
+    return children
+
+def _add_text(node: etree._Element, previous: Optional[etree._Element], text: str) -> None:
+    if previous is None:
+        node.text = (node.text or '') + text
+    else:
+        previous.tail = (previous.tail or '') + text
+
+def extract(node: etree._Element) -> etree._Element:
+    """Take the element out of the tree; the text after it stays where it was (lxml moves it with the element)."""
+    parent = node.getparent()
+    if node.tail:
+        _add_text(parent, node.getprevious(), node.tail)
+        node.tail = None
+    parent.remove(node)
+    return node
+
+def detached_copy(node: Optional[etree._Element]) -> Union[etree._Element, str]:
+    if node is None:
+        return 'None'       # str(None), as the BeautifulSoup path concatenates it
+    node = copy.deepcopy(node)
+    node.tail = None
+    return node
+
+def fix_links(root: etree._Element, base: str = TEXTS_URL) -> None:
+    """Root url for all hrefs referring to other subpages."""
+    for link in root.iter('a'):
+        href = link.get('href')
+        if href and href.endswith('.htm'):
+            link.set('href', base + href)
+
+def content_cells(root: etree._Element) -> List[etree._Element]:
+    return [cell for cell in root.iter('td') if cell.get('style') == 'text-align: justify' and cell.get('valign') == 'top']
+
+# Pages
+
+def extract_sutta_info(root: etree._Element, number_label: str = 'ДН', translator: bool = False) -> Dict[str, str]:
+    """Sutta title and number; the translator too (Digha pages) if translator is set."""
+    title_elem = find(root, 'font', size='5')
+    if title_elem is None: title_elem = find(root, 'font', size='6')
+
+    title = get_text(title_elem).strip() if title_elem is not None else "Untitled"
+    title = title.replace('\n', "")
+    if title != "Untitled" and ": " in title:
+        title_list = title.split(': ')
+        if len(title_list) == 2:
+            [pali_title, russ_title] = title_list
+            russ_title = re.sub(number_label + r'\s[0-9]+', '', russ_title)
+        else:
+            [pali_title, russ_title] = [title, title]
+    else:
+        [pali_title, russ_title] = [title, title]
+
+    sutta_num = ""
+    if title_elem is not None:
+        # bs4's find_next: the first one after the start tag, inside the element or after it
+        number_elem = title_elem.xpath('(descendant::font[@size="3"] | following::font[@size="3"])[1]')
+        if number_elem:
+            sutta_num = get_text(number_elem[0]).strip()
+
+    info = {
+        'pali_title': pali_title,
+        'russ_title': russ_title,
+        'sutta_number': sutta_num,
+    }
+    if translator:
+        transl_elem = None
+        for elm in find_all(root, 'div', align='right'):
+            if 'Перевод' in re.sub(r'\s+', ' ', get_text(elm)).strip():
+                transl_elem = elm
+                break
+        if transl_elem is not None:
+            info['translator'] = re.search(r'Перевод.+(?=источник)', re.sub(r'\s+', ' ', get_text(transl_elem)).strip(), re.DOTALL).group()
+        else:
+            info['translator'] = 'Перевод: см. сайт www.theravada.ru'
+    return info
+
+def find_notes(root: etree._Element) -> List[Note]:
+    """footnotes.find_notes on an lxml tree."""
+    cells: List[etree._Element] = []
+    end = 0
+    for cell in root.iter('td'):
+        if cell.get('style') == 'text-align: justify' and cell.get('valign') == 'top':
+            cells, end = [], 0
+            continue
+        if (cell.get('class', '').split() == ['bottom'] and cell.get('colspan') == '4' and cell.get('height') == '2'
+                and len(cell.attrib) == 3):
+            end = len(cells)
+        cells.append(cell)
+    del cells[end:]
+
+    notes = []
+    for i in range(0, len(cells) - 2, 3):
+        back, number, body = cells[i:i + 3]
+        link = find(back, 'a')
+        notes.append(Note(get_text(number), link.get('href') if link is not None else '', body))
+    return notes
+
+def note_paragraph(note: Note) -> etree._Element:
+    """footnotes.note_paragraph on an lxml tree."""
+    paragraph = note.body
+    paragraph.tag = 'p'
+    if not note.back_link:
+        return paragraph
+    font_tag = find(paragraph, 'font', color=NOTE_TEXT_COLOUR)
+    if font_tag is None:
+        return paragraph
+    link = etree.Element('a', href=note.back_link, style=BACK_LINK_STYLE)
+    link.text = note.number
+    # Before the first string directly in the font tag (comments count, as in bs4)
+    if font_tag.text:
+        link.tail = ' ' + font_tag.text
+        font_tag.text = None
+        font_tag.insert(0, link)
+        return paragraph
+    for i, child in enumerate(font_tag):
+        if child.tag is etree.Comment:
+            link.tail = ' '
+            font_tag.insert(i, link)
+            break
+        if child.tail:
+            link.tail = ' ' + child.tail
+            child.tail = None
+            font_tag.insert(i + 1, link)
+            break
+    return paragraph
+
+def _fallback_parts(content_td: etree._Element) -> List[Part]:
+    paragraphs = [p.strip() for p in get_text(content_td).split('\n\n') if p.strip()]
+    return [f"<p>{html.escape(p)}</p>" for p in paragraphs[:10]]
+
+def sutta_content_parts(root: etree._Element, drop_tables: bool = False) -> List[Part]:
+    """
+    sutta_content_parts of the Anguttara and Digha builders on an lxml tree;
+    drop_tables leaves out the tables of the content cell, as the Digha builder does.
+    """
+    fix_links(root)
+    cells = content_cells(root)
+    content_td = cells[-1] if cells else None
+    if content_td is None:
+        return ["<p>Content not found</p>"]
+
+    html_parts: List[Part] = []
+    td_children = contents(content_td)
+    if drop_tables:
+        td_children = [tag for tag in td_children if name(tag) != 'table']
+    if td_children:
+        first = td_children[0]
+        if isinstance(first, str) and len(first.strip()) <= 1 or \
+                name(first) is None and len((first.text or '').strip()) <= 1:
+            td_children.pop(0)
+
+    toc_processed = False
+    for kid in td_children:
+        kid_name = name(kid)
+        if kid_name == 'b' and get_text(kid).strip() == "Содержание:":
+            kid.tag = 'h3'
+            fnt = find(kid, 'font')
+            if fnt is not None:
+                fnt.set('size', '4')
+            html_parts.append(kid)
+            continue
+        if kid_name == 'font' and find(kid, 'a') is not None and not toc_processed:
+            font_tag = etree.Element('font', size="2", face="Arial, Helvetica, sans-serif", color="#999966")
+            for a_tag in list(kid.iterdescendants('a', 'br')):
+                if a_tag.tag == 'br':
+                    extract(a_tag)
+                    continue
+                link = a_tag.get('href')
+                if link:
+                    ref_label = re.search(r'#[a-z][0-9]+$', link)
+                    if ref_label:
+                        a_tag.set('href', ref_label.group())
+                text = get_text(a_tag).strip()
+                if text:
+                    match = re.match(r'(\d+(\.\d+)*)', text)
+                    nesting_level = len(match.group(0).split('.')) if match else 1
+                    new_div = etree.SubElement(font_tag, 'div')
+                    if nesting_level == 2:
+                        new_div.set('style', 'margin-top: 10px; text-indent: 1em;')
+                    elif nesting_level == 3:
+                        new_div.set('style', 'margin-bottom: 0px; text-indent: 2em;')
+                    else:
+                        new_div.set('style', 'margin-top: 10px; text-indent: 0em;')
+                    if find(a_tag, 'b') is not None:
+                        a_tag.set('style', 'font-weight: bold; margin-bottom: 10px;')
+                    new_div.append(extract(a_tag))
+            html_parts.append(font_tag)
+            toc_processed = True
+            continue
+        if kid_name == 'b':
+            kid.tag = 'h3'
+            fnt = find(kid, 'font')
+            if fnt is not None:
+                fnt.set('size', '4')
+            html_parts.append(kid)
+        elif kid_name == 'font' and find(kid, 'a') is None:
+            continue
+        elif kid_name == 'p':
+            if kid.get('align') == 'center':
+                kid.tag = 'h3'
+                fnt = find(kid, 'font')
+                if fnt is not None:
+                    fnt.set('size', '4')
+            elif find(kid, 'i') is not None:
+                kid.tag = 'h4'
+                fnt = find(kid, 'font')
+                if fnt is not None:
+                    fnt.set('size', '4')
+            else:
+                fnt = find(kid, 'font')
+                if fnt is not None and fnt.get('size') in ['4', '5', '6']:
+                    kid.tag = 'h3'
+                    fnt.set('size', '3')
+            html_parts.append(kid)
+        elif kid_name == 'div':
+            kid.tag = 'p'
+            html_parts.append(kid)
+        elif kid_name != 'br':
+            html_parts.append(kid)
+
+    html_parts.extend(note_paragraph(note) for note in find_notes(root))
+    return html_parts or _fallback_parts(content_td)
+
+def majjhima_content_parts(root: etree._Element) -> List[Part]:
+    """sutta_content_parts of the Majjhima builder on an lxml tree."""
+    fix_links(root)
+    content_td = find(root, 'td', style='text-align: justify', valign='top')
+    if content_td is None:
+        return ["<p>Content not found</p>"]
+
+    html_parts: List[Part] = []
+
+    first_subheading = find(content_td, 'b')
+    if first_subheading is not None and 'Содержание' in get_text(first_subheading):
+        first_subheading.tag = 'h3'
+        fnt = find(first_subheading, 'font')
+        if fnt is not None:
+            fnt.set('size', '3')
+            html_parts.append(first_subheading)
+        else:
+            fnt = first_subheading.getparent()
+            fnt.set('size', '3')
+            html_parts.append(fnt)
+        for font in find_all(content_td, 'font')[1:]:
+            if font.attrib['size'] == '5' or font.attrib['size'] == '6':
+                break
+            elif font.getparent().tag == 'a':
+                font.tag = 'p'
+                html_parts.append(font.getparent())
+            else:
+                font.tag = 'p'
+                html_parts.append(font)
+
+    divs_a = [div for div in content_td.iterdescendants('div') if 'a' in div.get('class', '').split()]
+
+    first_letter = find(content_td, 'font', size='5')
+    rest_par = find(content_td, 'font', size='2')
+    wrong_div = find(rest_par, 'div')
+    if wrong_div is not None:
+        extract(wrong_div)
+    first_par = etree.Element('p')
+    for node in (first_letter, rest_par):
+        node = detached_copy(node)
+        if isinstance(node, str):
+            _add_text(first_par, first_par[-1] if len(first_par) else None, node)
+        else:
+            first_par.append(node)
+    html_parts.append(first_par)
+
+    for div in divs_a:
+        if find(div, 'b') is not None:
+            div.tag = 'h3'
+            div.set('class', 'b')
+            fnt = find(div, 'font')
+            fnt.set('size', '3' if find(div, 'i') is None else '2')
+            br = find(div, 'br')
+            if br is not None:
+                par_next = br.xpath('following::div[1]')
+                if par_next:
+                    br_after = find(par_next[0], 'br')
+                    if br_after is not None:
+                        extract(br_after)
+        else:
+            div.tag = 'p'
+        html_parts.append(div)
+
+    html_parts.extend(note_paragraph(note) for note in find_notes(root))
+    return html_parts or _fallback_parts(content_td)
+
+# Equivalence harness
+
+def compare(collections: List[str]) -> None:
+    """
+    Extract every checked-in page both ways, bypassing the IR cache: same IR (and so the same
+    chapter markup), and the time of each path.
+    """
+    import importlib, sutta_ir
+    for collection in collections or list(COLLECTIONS):
+        module_name, directory = COLLECTIONS[collection]
+        builder = importlib.import_module(module_name)
+        files = sorted(name for name in os.listdir(directory) if name.endswith('.html'))
+        times = [0.0, 0.0]
+        same = 0
+        for file_name in files:
+            suttas = []
+            for fast in (False, True):
+                start = time.perf_counter()
+                # The builders print as they go
+                with contextlib.redirect_stdout(io.StringIO()):
+                    suttas.append(sutta_ir.extract(os.path.join(directory, file_name), partial(builder.extract_page, fast=fast)))
+                times[fast] += time.perf_counter() - start
+            if suttas[0] == suttas[1]:
+                same += 1
+            else:
+                print(f'{col.RED}Pages differ for {file_name}{col.END}')
+
+        count = len(files) or 1
+        print(f'{col.SEP}{col.GREY}{collection}: {len(files)} pages of {col.GREEN}{directory}{col.END}')
+        print(f'  BeautifulSoup: {col.RED}{times[0] / count * 1000:.1f} ms{col.END} per page')
+        print(f'  lxml:          {col.GREEN}{times[1] / count * 1000:.1f} ms{col.END} per page ({times[0] / (times[1] or 1e-9):.1f}x)')
+        print(f'  same page:     {col.GREEN}{same}{col.END}/{len(files)}{col.SEP}')
+
+if __name__ == '__main__':
+    import sys
+    compare(sys.argv[1:])
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Fetch policy shared by all network stages.
+Failures are classified as transient (timeouts, dropped connections, 5xx, 429) or
+permanent (other 4xx, bad urls). Transient ones are retried with jittered exponential
+backoff; a host failing again and again trips its circuit breaker: its requests wait out the
+cooldown while a single trial request finds out whether it has recovered, and the other hosts
+keep their throughput meanwhile. Urls whose retries are used up go to the dead-letter list.
+
+    python3 fetch_policy.py     # show the dead-letter list
+"""
+
+import requests
+import json, os, os.path, random, threading, time
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from typing import Callable, Dict, Optional, TypeVar
+from cobraprint import col
+
+# Configuration
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5          # seconds before the first retry, doubled for every further one
+BACKOFF_CAP = 30.0
+BREAKER_THRESHOLD = 5       # consecutive transient failures that open a host's circuit
+BREAKER_COOLDOWN = 60.0     # seconds an open circuit holds requests back before a trial one
+TRIAL_POLL = 1.0            # seconds between looks at the outcome of the trial request
+MAX_CIRCUIT_WAIT = 5 * BREAKER_COOLDOWN     # a request held back longer gives up (without a dead letter)
+DEAD_LETTER_FILE = 'dead_letters.json'
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+T = TypeVar('T')
+
+
+class FetchError(requests.exceptions.RequestException):
+    """A fetch that the policy gave up on; `kind` is 'transient', 'permanent' or 'circuit-open'."""
+    kind = 'transient'
+
+    def __init__(self, url: str, cause: Exception, attempts: int):
+        super().__init__(f"{cause} ({self.kind}, {attempts} attempt{'' if attempts == 1 else 's'})",
+                         response=getattr(cause, 'response', None))
+        self.url = url
+        self.cause = cause
+        self.attempts = attempts
+
+class TransientError(FetchError):
+    kind = 'transient'
+
+class PermanentError(FetchError):
+    kind = 'permanent'
+
+class CircuitOpenError(FetchError):
+    kind = 'circuit-open'
+
+
+def classify(e: Exception) -> str:
+    """'transient' for failures worth retrying, 'permanent' for the rest."""
+    if isinstance(e, (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+                      requests.exceptions.InvalidSchema, requests.exceptions.TooManyRedirects)):
+        return 'permanent'
+    response = getattr(e, 'response', None)
+    if response is not None and response.status_code >= 400 and response.status_code not in RETRY_STATUSES:
+        return 'permanent'
+    return 'transient'
+
+def backoff_delay(attempt: int, response: Optional[requests.Response] = None) -> float:
+    """Full-jitter exponential backoff; a Retry-After header in seconds takes precedence."""
+    retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+    if retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_CAP)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+class CircuitBreaker:
+    """Per-host circuit: closed -> open after `threshold` failures in a row -> one trial request after `cooldown`."""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """0 if a request may go now, otherwise the seconds to wait before asking again."""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            if self.trial:
+                # The trial request is in flight; its outcome closes or reopens the circuit
+                return min(TRIAL_POLL, self.cooldown)
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining <= 0:
+                self.trial = True       # half-open: let a single request through
+                return 0.0
+            return remaining
+
+    def allow(self) -> bool:
+        return self.wait_time() == 0
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def abandon(self) -> None:
+        """The request ended without telling whether the host works; a trial request frees its slot."""
+        with self._lock:
+            self.trial = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+class DeadLetters:
+    """Urls that failed for good, kept in a JSON file; a later success takes the url off the list."""
+
+    def __init__(self, path: str = DEAD_LETTER_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: Dict[str, dict] = {}
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def _save(self) -> None:
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, self.path)
+
+    def add(self, error: FetchError) -> None:
+        with self._lock:
+            self.entries[error.url] = {
+                'kind': error.kind,
+                'error': str(error.cause),
+                'status': error.response.status_code if error.response is not None else None,
+                'attempts': error.attempts,
+                'failed_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            }
+            self._save()
+
+    def discard(self, url: str) -> None:
+        with self._lock:
+            if self.entries.pop(url, None) is not None:
+                self._save()
+
+class FetchPolicy:
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, dead_letters: Optional[DeadLetters] = None,
+                 sleep: Callable[[float], None] = time.sleep, max_circuit_wait: float = MAX_CIRCUIT_WAIT):
+        self.max_attempts = max_attempts
+        self.max_circuit_wait = max_circuit_wait
+        self.dead_letters = dead_letters if dead_letters is not None else DeadLetters()
+        self.sleep = sleep
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._breakers_lock = threading.Lock()
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        host = urlparse(url).netloc
+        with self._breakers_lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker()
+            return breaker
+
+    def wait_for_circuit(self, url: str, breaker: CircuitBreaker, attempt: int) -> None:
+        """
+        Hold the request back while the host's circuit is open. CircuitOpenError is raised if it stays
+        open longer than max_circuit_wait; the url has not failed, so it gets no dead letter.
+        """
+        waited = 0.0
+        while True:
+            delay = breaker.wait_time()
+            if delay == 0:
+                return
+            if waited >= self.max_circuit_wait:
+                raise CircuitOpenError(url, RuntimeError(f"circuit open for {urlparse(url).netloc}"), attempt)
+            self.sleep(delay)
+            waited += delay
+
+    def call(self, url: str, fetch: Callable[..., T], *args, **kwargs) -> T:
+        """
+        fetch(*args, **kwargs) under the policy; url names the resource for the breaker and the dead letters.
+        While the host's circuit is open the attempts wait, they are not used up.
+        Raises TransientError, PermanentError or CircuitOpenError (all RequestExceptions) once it gives up.
+        """
+        breaker = self.breaker(url)
+        for attempt in range(self.max_attempts):
+            self.wait_for_circuit(url, breaker, attempt)
+            try:
+                result = fetch(*args, **kwargs)
+            except requests.exceptions.RequestException as e:
+                kind = classify(e)
+                if kind == 'permanent':
+                    # The host answered; it is the url that is wrong
+                    breaker.success()
+                    error = PermanentError(url, e, attempt + 1)
+                    self.dead_letters.add(error)
+                    raise error from e
+                breaker.failure()
+                if attempt + 1 == self.max_attempts:
+                    error = TransientError(url, e, attempt + 1)
+                    self.dead_letters.add(error)
+                    raise error from e
+                self.sleep(backoff_delay(attempt, getattr(e, 'response', None)))
+                continue
+            except BaseException:
+                breaker.abandon()
+                raise
+            breaker.success()
+            self.dead_letters.discard(url)
+            return result
+
+_default_policy: Optional[FetchPolicy] = None
+_default_policy_lock = threading.Lock()
+
+def default_policy() -> FetchPolicy:
+    global _default_policy
+    with _default_policy_lock:
+        if _default_policy is None:
+            _default_policy = FetchPolicy()
+    return _default_policy
+
+if __name__ == '__main__':
+    entries = DeadLetters().entries
+    for url, entry in sorted(entries.items(), key=lambda item: item[1]['failed_at']):
+        print(f"{col.GREY}{entry['failed_at']}{col.END} {col.RED}{entry['kind']}{col.END} {url}: {entry['error']}")
+    print(f'{col.SEP}{col.RED}{len(entries)}{col.END} urls in {col.GREEN}{DEAD_LETTER_FILE}{col.END}.{col.SEP}')
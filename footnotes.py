@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Footnotes of a sutta page.
+The notes sit in the table rows between the main content cell and the closing
+<td class="bottom" colspan="4" height="2">, three cells per note: the arrow back to the
+text, the note number and the note body. find_notes picks them out in one walk over the
+cells, by their attributes, and returns them as a list of Note; render_notes writes them
+as the paragraphs the builders put at the end of a chapter, or as EPUB3 footnotes.
+"""
+
+from typing import List, NamedTuple, Union
+from bs4 import BeautifulSoup, Tag
+from lxml import etree
+
+# Configuration
+BACK_LINK_STYLE = "color: #996600; font-size: 2; font-family: Times New Roman, Times, serif"
+NOTE_TEXT_COLOUR = '#999966'
+
+
+class Note(NamedTuple):
+    number: str         # as printed on the page
+    back_link: str      # href of the arrow back to the reference in the text ('' if there is none)
+    body: Union[Tag, etree._Element]    # the cell with the text of the note (lxml on the fast_extract path)
+
+
+def is_content_cell(cell: Tag) -> bool:
+    return cell.get('style') == 'text-align: justify' and cell.get('valign') == 'top'
+
+def is_notes_end(cell: Tag) -> bool:
+    return (cell.get('class') == ['bottom'] and cell.get('colspan') == '4' and cell.get('height') == '2'
+            and len(cell.attrs) == 3)
+
+def find_notes(soup: BeautifulSoup) -> List[Note]:
+    """The notes of the page, in order; the cells after the last content cell, up to the last end marker."""
+    cells: List[Tag] = []
+    end = 0
+    for cell in soup.find_all('td'):
+        if is_content_cell(cell):
+            cells, end = [], 0
+            continue
+        if is_notes_end(cell):
+            end = len(cells)
+        cells.append(cell)
+    del cells[end:]
+
+    notes = []
+    for i in range(0, len(cells) - 2, 3):
+        back, number, body = cells[i:i + 3]
+        notes.append(Note(number.get_text(), back.a['href'] if back.a else '', body))
+    return notes
+
+def note_paragraph(soup: BeautifulSoup, note: Note) -> Tag:
+    """The note's cell turned into a paragraph, its text opening with the number linked back to the text."""
+    paragraph = note.body
+    paragraph.name = 'p'
+    if note.back_link:
+        font_tag = paragraph.find('font', color=NOTE_TEXT_COLOUR)
+        first_text = font_tag.find(string=True, recursive=False) if font_tag else None
+        if first_text:
+            first_text.insert_before(back_link(soup, note))
+            first_text.insert_before(' ')
+    return paragraph
+
+def note_aside(soup: BeautifulSoup, note: Note) -> Tag:
+    """
+    The note as an EPUB3 footnote: an <aside epub:type="footnote"> under the id the reference
+    in the text points to (the page's <a name="linkN">), with the number linked back to the text.
+    """
+    aside = soup.new_tag('aside')
+    aside['epub:type'] = 'footnote'
+    anchor = note.body.find('a', attrs={'name': True})
+    if anchor:
+        aside['id'] = anchor['name']
+        anchor.decompose()
+    paragraph = soup.new_tag('p')
+    if note.back_link:
+        paragraph.append(back_link(soup, note))
+        paragraph.append(' ')
+    else:
+        paragraph.append(note.number + ' ')
+    paragraph.extend(list(note.body.contents))
+    aside.append(paragraph)
+    return aside
+
+def back_link(soup: BeautifulSoup, note: Note) -> Tag:
+    link = soup.new_tag('a')
+    link['href'] = note.back_link
+    link['style'] = BACK_LINK_STYLE
+    link.string = note.number
+    return link
+
+def render_notes(soup: BeautifulSoup, notes: List[Note], epub3: bool = False) -> List[Tag]:
+    """
+    The notes as chapter parts. With epub3 they become footnotes, and the references to them
+    in the text are marked as noterefs, so that reading systems can show them as pop-ups.
+    """
+    if not epub3:
+        return [note_paragraph(soup, note) for note in notes]
+    asides = [note_aside(soup, note) for note in notes]
+    ids = {aside['id'] for aside in asides if aside.has_attr('id')}
+    for link in soup.find_all('a', href=True):
+        if link['href'].startswith('#') and link['href'][1:] in ids:
+            link['epub:type'] = 'noteref'
+    return asides
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+On-disk HTTP cache with conditional revalidation.
+The ETag / Last-Modified validators of every fetched page are kept in the cache directory
+and its body in the page store, and later fetches send If-None-Match / If-Modified-Since
+so that an unchanged page costs a 304 instead of a full download.
+Bodies are streamed in chunks into a '.part' file that goes into the page store only
+once its length matches Content-Length; a download cut short is resumed with a Range
+request on the next attempt.
+"""
+
+import requests
+import json, os, os.path, re, hashlib, tempfile
+from typing import NamedTuple, Optional
+from fetch_policy import default_policy
+from page_store import PageStore, default_store
+
+CACHE_DIR = '.http_cache'
+CHUNK_SIZE = 64 * 1024
+
+
+class CachedPage(NamedTuple):
+    content: bytes
+    status: int         # status of the network response (304 when served from the cache)
+    changed: bool       # False if the page is byte-identical to the cached copy
+    headers: dict       # headers of the response that delivered the body
+
+
+class IncompleteDownload(requests.exceptions.RequestException):
+    """The connection closed before the announced number of bytes arrived."""
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write the file through a temporary file of its own, so that concurrent writers of the same path do not collide."""
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                     suffix='.tmp', delete=False) as f:
+        f.write(data)
+    try:
+        os.chmod(f.name, 0o644)     # the temporary file is private
+        os.replace(f.name, path)
+    except OSError:
+        os.remove(f.name)
+        raise
+
+def _full_headers(response: requests.Response, size: int) -> dict:
+    """Headers of the response as if it had delivered the whole body (a 206 only delivered its tail)."""
+    headers = dict(response.headers)
+    if response.status_code == 206:
+        headers.pop('Content-Range', None)
+        headers['Content-Length'] = str(size)
+    return headers
+
+def _expected_size(response: requests.Response) -> Optional[int]:
+    """Full size of the body: the total of Content-Range for a 206, otherwise Content-Length."""
+    if response.status_code == 206:
+        match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match else None
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+class HttpCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, store: Optional[PageStore] = None):
+        self.cache_dir = cache_dir
+        self.store = store if store is not None else default_store()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url: str):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.json', base + '.body'
+
+    def meta(self, url: str) -> Optional[dict]:
+        meta_path, body_path = self._paths(url)
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if os.path.isfile(body_path):
+            # A body cached by the earlier versions moves into the page store
+            with open(body_path, 'rb') as f:
+                self.store.put(url, f.read(), meta.get('headers') or {})
+            os.remove(body_path)
+        return meta
+
+    def body(self, url: str) -> Optional[bytes]:
+        page = self.store.get(url)
+        return page.content if page is not None else None
+
+    def _store(self, url: str, response: requests.Response, part_path: str) -> bytes:
+        """Move a complete part file into the page store and write its validators; returns the body."""
+        meta_path = self._paths(url)[0]
+        with open(part_path, 'rb') as f:
+            content = f.read()
+        headers = _full_headers(response, len(content))
+        meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_type': response.headers.get('Content-Type'),
+            'headers': headers,
+            'size': len(content),
+            'sha1': hashlib.sha1(content).hexdigest(),
+        }
+        self.store.put(url, content, headers)
+        os.remove(part_path)
+        write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        return content
+
+    def get(self, session: requests.Session, url: str, timeout: int = 20) -> CachedPage:
+        """
+        GET the url, revalidating the cached copy if there is one.
+        A part file left by an interrupted download is continued with a Range request;
+        IncompleteDownload is raised (keeping the part file) if the body comes up short.
+        """
+        meta_path, body_path = self._paths(url)
+        part_path = body_path[:-len('.body')] + '.part'
+        validator_path = part_path + '.json'
+        meta = self.meta(url)
+        cached = None
+        if meta:
+            cached = self.body(url)
+            if cached is None or hashlib.sha1(cached).hexdigest() != meta['sha1']:
+                # The stored copy is missing or not the one validated, fetch the page anew
+                meta = cached = None
+
+        request_headers = {'Accept-Encoding': 'identity'}   # Range and Content-Length count raw bytes
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        if offset:
+            request_headers['Range'] = f'bytes={offset}-'
+            if os.path.isfile(validator_path):
+                with open(validator_path, 'r', encoding='utf-8') as f:
+                    validator = json.load(f).get('validator')
+                if validator:
+                    # The server sends the whole page instead if it has changed meanwhile
+                    request_headers['If-Range'] = validator
+        elif meta:
+            if meta['etag']:
+                request_headers['If-None-Match'] = meta['etag']
+            if meta['last_modified']:
+                request_headers['If-Modified-Since'] = meta['last_modified']
+
+        with session.get(url, headers=request_headers, timeout=timeout, stream=True) as response:
+            if response.status_code == 304 and meta:
+                return CachedPage(cached, 304, False, meta.get('headers', {}))
+            if response.status_code == 416:
+                # The part file does not fit the page any more
+                os.remove(part_path)
+                return self.get(session, url, timeout)
+            response.raise_for_status()
+
+            if response.status_code != 206:
+                offset = 0
+                validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                write_atomic(validator_path, json.dumps({'validator': validator}).encode('utf-8'))
+            expected = _expected_size(response)
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+            size = os.path.getsize(part_path)
+            if expected is not None and size != expected:
+                raise IncompleteDownload(f"{url}: got {size} of {expected} bytes", response=response)
+
+            content = self._store(url, response, part_path)
+        if os.path.isfile(validator_path):
+            os.remove(validator_path)
+        changed = not meta or meta['sha1'] != hashlib.sha1(content).hexdigest()
+        return CachedPage(content, response.status_code, changed, _full_headers(response, len(content)))
+
+_default_cache: Optional[HttpCache] = None
+
+def default_cache() -> HttpCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = HttpCache()
+    return _default_cache
+
+def cached_get(session: requests.Session, url: str, timeout: int = 20) -> bytes:
+    """Body of the url, served from the shared cache when the server answers 304; retried under the fetch policy."""
+    return default_policy().call(url, default_cache().get, session, url, timeout).content
@@ -5,11 +5,22 @@ Uses functional programming paradigms with pure functions where possible.
 """
 
 import requests
-from bs4 import BeautifulSoup
-import chardet, re, html, os
+from bs4 import BeautifulSoup, Tag
+import chardet, re, html, os, sys
+from functools import partial
 from urllib.parse import urljoin
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Union
 from cobraprint import col
+from http_cache import cached_get
+from charset_sniffer import decode_html
+from rate_limiter import mount_rate_limiter
+from download_engine import is_saved, save_page
+from download_manifest import Manifest
+from chapter_pool import builder_options, JOBS
+from build_graph import memo_chapters
+from chapter_normalizer import join_parts, normalize_part
+from footnotes import find_notes, render_notes, Note
+import fast_extract, sutta_ir
 from tqdm import tqdm
 from ebooklib import epub
 from time import time
@@ -29,19 +40,17 @@ def create_session() -> requests.Session:
     """Create configured requests session."""
     session = requests.Session()
     session.headers.update({'User-Agent': USER_AGENT})
-    return session
+    return mount_rate_limiter(session)
 
 
 def fetch_page_content(session: requests.Session, url: str) -> str:
     """Fetch and decode page content with proper encoding."""
     try:
-        response = session.get(url, timeout=20)
-        response.raise_for_status()
-        
-        # Decode with windows-1251
-        content = response.content.decode(ENCODING)
+        # Conditional GET, served from the local copy when unchanged
+        content = decode_html(cached_get(session, url), ENCODING)
         return content
-    except Exception as e:
+    # Retried under the fetch policy first; the url is on the dead-letter list by now
+    except requests.exceptions.RequestException as e:
         print(f"Error fetching {url}: {e}")
         return ""
     
@@ -98,8 +107,11 @@ def clean_text_for_html(text: str) -> str:
     
     return text
 
-def extract_sutta_content(soup: BeautifulSoup) -> str:
-    """Extract and format sutta content as clean HTML."""
+def sutta_content_parts(soup: BeautifulSoup) -> List[Union[Tag, str]]:
+    """
+    Content of the sutta as a list of parts: tags of the page, or markup strings.
+    chapter_normalizer writes them out as the chapter.
+    """
 
     # Adding the root url to all hrefs refering to other subpages
     refs = soup.find_all('a')
@@ -112,7 +124,7 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
     # Find the main content table
     content_td = soup.find('td', {'style': 'text-align: justify', 'valign': 'top'})
     if not content_td:
-        return "<p>Content not found</p>"
+        return ["<p>Content not found</p>"]
     
     # Start building clean HTML
     html_parts = []
@@ -124,20 +136,20 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
         fnt = first_subheading.font
         if fnt:
             fnt['size'] = '3'
-            html_parts.append(str(first_subheading))
+            html_parts.append(first_subheading)
         else:
             fnt = first_subheading.parent
             fnt['size'] = '3'
-            html_parts.append(str(fnt))
+            html_parts.append(fnt)
         for font in content_td.find_all('font')[1:]:
             if font['size'] == '5' or font['size'] == '6':
                 break
             elif font.parent.name == 'a':
                 font.name = 'p'
-                html_parts.append(str(font.parent))
+                html_parts.append(font.parent)
             else:
                 font.name = 'p'
-                html_parts.append(str(font))
+                html_parts.append(font)
 
     # Listing of all class 'a' paragraphs
     divs_a = content_td.find_all('div', class_='a')
@@ -149,7 +161,7 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
     if rest_par.div:
         wrong_div = rest_par.div.extract()
     first_par = "<p>" + str(first_letter) + str(rest_par) + "</p>"
-    html_parts.append(str(first_par))
+    html_parts.append(first_par)
 
 
     # Process each div with class 'a' (indented paragraphs)
@@ -173,42 +185,11 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
         else:
             # Regular paragraph
             div.name = 'p'
-        html_parts.append(str(div))
+        html_parts.append(div)
     
 
     # Adding the back notes
-    table_cells = soup.find_all('td')
-    # Determining where notes start and end
-    for i, cell in enumerate(table_cells):
-        if cell.get('style') == 'text-align: justify' and cell.get('valign') == "top":
-            note_start = i+1
-        if '<td class="bottom" colspan="4" height="2">' in str(cell):
-            note_end = i
-    
-    all_notes = table_cells[note_start:note_end]
-    for i, note in enumerate(all_notes):
-        if i%3 == 0:
-            return_link = note.a['href']
-            continue
-        elif i%3 == 1:
-            note_no = note.get_text()
-            continue
-        elif i%3 == 2:
-            note.name = 'p'
-            return_tag = soup.new_tag('a')
-            return_tag['href'] = return_link
-            return_tag['style'] = "color: #996600; font-size: 2; font-family: Times New Roman, Times, serif"
-
-            return_tag.string = note_no
-            font_tag = note.find('font', color="#999966")
-            first_text = font_tag.find(string=True, recursive=False)
-            if first_text:
-                first_text.insert_before(return_tag)
-            try:
-                return_tag.insert_after(' ')
-            except:
-                continue
-            html_parts.append(str(note))
+    html_parts.extend(render_notes(soup, find_notes(soup)))
 
     # If no structured content found, extract all text
     if not html_parts:
@@ -217,7 +198,11 @@ def extract_sutta_content(soup: BeautifulSoup) -> str:
         html_parts = [f"<p>{html.escape(p)}</p>" for p in paragraphs[:10]]  # Limit paragraphs
     
 
-    return '\n'.join(html_parts)
+    return html_parts
+
+def extract_sutta_content(soup: BeautifulSoup) -> str:
+    """Extract and format sutta content as clean HTML."""
+    return '\n'.join(str(part) for part in sutta_content_parts(soup))
 
 def process_sutta(session: requests.Session, href: str) -> Optional[Dict[str, str]]:
     """Process a single sutta page and return structured data."""
@@ -315,9 +300,35 @@ def sutta_title_html(pali_title, russ_title, sutta_number) -> str:
     <br>
     """
 
-def create_epub(hrefs: List[str], output_filename: str = "majjhima_nikaya.epub") -> None:
+def extract_page(subpage_path: str, fast: bool = False) -> Tuple[Dict[str, str], List[Union[Tag, str]], List[Note]]:
+    """
+    (sutta info, content parts, footnotes) of a saved sutta page, for sutta_ir.
+    With fast the page is extracted with lxml (fast_extract) instead of BeautifulSoup.
+    """
+    with open(subpage_path, 'r', encoding='utf-8') as f:
+        page = f.read()
+    if fast:
+        root = fast_extract.parse_page(page)
+        notes = fast_extract.find_notes(root)
+        parts = fast_extract.majjhima_content_parts(root)
+        sutta_info = fast_extract.extract_sutta_info(root, number_label='МН')
+    else:
+        soup = BeautifulSoup(page, 'lxml')
+        notes = find_notes(soup)
+        parts = sutta_content_parts(soup)
+        sutta_info = extract_sutta_info(soup)
+    return sutta_info, parts, notes
+
+def build_chapter(subpage_path: str, fast: bool = False) -> Tuple[str, str]:
+    """(pali title, chapter html) of a saved sutta page, made from its IR; runs in the process pool of create_epub."""
+    sutta = sutta_ir.load(subpage_path, partial(extract_page, fast=fast))
+    title_html = sutta_title_html(sutta.pali_title, sutta.russ_title, sutta.sutta_number)
+    return sutta.pali_title, join_parts([normalize_part(title_html)] + sutta.chapter_parts())
+
+def create_epub(hrefs: List[str], output_filename: str = "majjhima_nikaya.epub", jobs: int = JOBS, fast: bool = False) -> None:
     directory = 'Маджхима Никая с ударениями'
     os.makedirs(directory, exist_ok=True)
+    manifest = Manifest()
 
     start_time = time()
     book = epub.EpubBook()
@@ -382,56 +393,40 @@ def create_epub(hrefs: List[str], output_filename: str = "majjhima_nikaya.epub")
         52: [10, 10, 10, 12, 10]
     }
 
+    # Missing pages are downloaded first, then the chapters are built in parallel
+    print(col.SEP)
+    subpage_paths = []
+    for num in tqdm(range(1, big_sections[-1][2] + 1), desc="Fetching suttas:", ascii=True, colour="green"):
+        if num != 155:
+            url = hrefs[num - 1]
+            subpage_name = re.search('mn.+?htm$', url).group()
+            subpage_path = f'{directory}/{subpage_name}l'
+            if not is_saved(url, subpage_path, manifest):
+                save_page(url, subpage_path, manifest)
+        else:
+            subpage_path = "Russ_suttas/mn140-dhatu-vibhanga-sutta-sv.html"
+        subpage_paths.append(subpage_path)
+    built = memo_chapters(partial(build_chapter, fast=fast), subpage_paths, lambda path: [path], jobs,
+                          version=sutta_ir.version(partial(extract_page, fast=fast)), params=f'fast={fast}')
+
     chapters = []
     toc = []
 
-    print(col.SEP)
     for big_name, start, end in big_sections:
-
-        print(f"\nProcessing the section: {col.RED}{big_name}{col.END}\n")
         num_suttas = end - start + 1
         sizes = subgroup_sizes.get(num_suttas, [10] * (num_suttas // 10))
         big_toc_entries = []
         current_num = start
-        for n, size in enumerate(sizes):
-            print(f"{col.GREY}Working on subsection: {col.YELLOW}{n+1}{col.END}")
+        for size in sizes:
             sub_toc_entries = []
             sub_name = f"Сутты {current_num}-{current_num + size - 1}"
-            for num in tqdm(range(current_num, current_num + size), desc="Fetching suttas:", ascii=True, colour="green"):
-                if num != 155:
-                    url = hrefs[num - 1]
-                    subpage_name = re.search('mn.+?htm$', url).group()
-                    if f"{subpage_name}l" not in os.listdir(directory):
-                        resp = requests.get(url, headers=headers, stream=True)
-                        resp.encoding = 'windows-1251'
-                        with open(f'{directory}/{subpage_name}l', 'w', encoding='utf-8') as f:
-                            f.write(resp.text)
-                        soup = BeautifulSoup(resp.text, 'lxml')
-                    else:
-                        with open(f'{directory}/{subpage_name}l', 'r', encoding='utf-8') as f:
-                            cont = f.read()
-                        soup = BeautifulSoup(cont, 'lxml')
-                else:
-                    with open("Russ_suttas/mn140-dhatu-vibhanga-sutta-sv.html", 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    soup = BeautifulSoup(content, 'lxml')
-                    
-                pre_html = extract_sutta_content(soup)
-                sutta_info = extract_sutta_info(soup)
-                pali_title = sutta_info['pali_title']
-                russian_title = sutta_info['russ_title']
-                sutta_number = sutta_info['sutta_number']
-                intermed_html = sutta_title_html(pali_title, russian_title, sutta_number) + pre_html
-                almost_html = clean_text_content(intermed_html)
-                main_html = clean_text_for_html(almost_html)
-
-
-                sub_soup = BeautifulSoup(main_html, 'lxml')
+            for num in range(current_num, current_num + size):
+                pali_title, content = built[num - 1]
                 toc_title = f"{num}. {pali_title}"
 
                 # Create chapter
                 chapter = epub.EpubHtml(title=toc_title, file_name=f'sutta_{num}.xhtml', lang='ru')
-                chapter.content = str(sub_soup)
+                chapter.content = content
                 chapter.add_item(style_css)
                 book.add_item(chapter)
                 chapters.append(chapter)
@@ -534,6 +529,10 @@ if __name__ == "__main__":
     dir = 'Маджхима Никая с ударениями'
     
     
-    helpout(dir)
-    # sutta_links  = sutta_list(nikaya_name)
-    # create_epub(sutta_links, output_filename)
+    # python3 majjhima_main.py --build [--jobs N] [--fast] fetches the index and builds the book
+    if sys.argv[1:2] == ['--build']:
+        options = builder_options('Build the Majjhima Nikaya EPUB.', sys.argv[2:])
+        sutta_links  = sutta_list(nikaya_name)
+        create_epub(sutta_links, output_filename, options.jobs, options.fast)
+    else:
+        helpout(dir)
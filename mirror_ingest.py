@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Bulk ingestion of a local site mirror, for build hosts without network access.
+A wget tree, a tarball or a zip of theravada.ru pages is scanned for the sutta pages
+(the url patterns list_maker follows), the pages are loaded straight into the page store
+in parallel and catalogued; the download stages then restore them from the store.
+
+    python3 mirror_ingest.py <mirror dir | .tar[.gz|.bz2|.xz] | .zip> [--base URL] [--replace] [--workers N]
+"""
+
+import argparse, os, os.path, re, tarfile, time, zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from urllib.parse import urljoin, urlsplit
+from typing import Callable, Deque, Dict, Iterator, List, Tuple
+from cobraprint import col
+from crawl_frontier import normalize_link, AN_LINK_PATTERN, SN_LINK_PATTERN, BASE_URL
+from download_engine import MAX_WORKERS
+from page_store import PageStore, STORE_FILE
+from sources import source_for
+from sutta_catalog import Catalog, CATALOG_FILE
+from tqdm import tqdm
+
+# Configuration
+# Pages of a mirror without a host directory (a plain archive of the Texts directory) are taken to live here
+MIRROR_BASE = BASE_URL + 'Texts/'
+PAGE_PATTERNS = [AN_LINK_PATTERN, SN_LINK_PATTERN, r'dn[0-9]+', r'mn[0-9]+']
+BATCH_SIZE = 100
+
+PAGE_NAME = re.compile('|'.join(f'(?:{pattern})' for pattern in PAGE_PATTERNS))
+
+# (path inside the mirror, reader of the page bytes, modification time)
+Member = Tuple[str, Callable[[], bytes], float]
+
+
+def is_page(name: str) -> bool:
+    name = name.rsplit('/', 1)[-1]
+    return name.endswith('.htm') and PAGE_NAME.search(name) is not None
+
+def mirror_url(name: str, base: str = MIRROR_BASE) -> str:
+    """
+    Url of a page of the mirror. wget trees start with the host directory
+    ('theravada.ru/Teaching/...'), possibly below other directories. Other paths are placed under
+    the last of their directories that is one of base's ('Texts/an1_1-10-sv.htm' -> base + 'an1_1-10-sv.htm'),
+    or else relative to base.
+    """
+    parts = [part for part in name.replace(os.sep, '/').split('/') if part not in ('', '.')]
+    for i, part in enumerate(parts[:-1]):
+        if '.' in part:
+            return normalize_link('https://' + '/'.join(parts[i:]))
+    base_parts = urlsplit(base).path.strip('/').split('/')
+    for i in range(len(parts) - 2, -1, -1):
+        if parts[i] in base_parts:
+            anchor = len(base_parts) - 1 - base_parts[::-1].index(parts[i])
+            return normalize_link(urljoin(base, '/' + '/'.join(base_parts[:anchor] + parts[i:])))
+    return normalize_link(urljoin(base, '/'.join(parts)))
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+def mirror_members(path: str) -> Iterator[Member]:
+    """The sutta pages of a mirror directory, zip or tar archive."""
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in files:
+                full_path = os.path.join(root, name)
+                if is_page(name):
+                    yield os.path.relpath(full_path, path), partial(_read_file, full_path), os.path.getmtime(full_path)
+    elif zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        for info in archive.infolist():
+            if not info.is_dir() and is_page(info.filename):
+                yield info.filename, partial(archive.read, info), time.mktime(info.date_time + (0, 0, -1))
+    elif tarfile.is_tarfile(path):
+        # A compressed tarball is only readable front to back, so the pages are read here, in order,
+        # as the caller asks for them
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and is_page(member.name):
+                    data = archive.extractfile(member).read()
+                    yield member.name, partial(bytes, data), float(member.mtime)
+    else:
+        raise ValueError(f"Not a mirror directory, zip or tar archive: {path}")
+
+def _store_batch(store: PageStore, batch: List[Tuple[str, Member]]) -> int:
+    return store.put_many(
+        (url, read(), {'Content-Type': f'text/html; charset={source_for(url).encoding}'},
+         datetime.fromtimestamp(mtime, timezone.utc).isoformat(timespec='seconds'))
+        for url, (_, read, mtime) in batch)
+
+def ingest(path: str, store_file: str = STORE_FILE, catalog_file: str = CATALOG_FILE, base: str = MIRROR_BASE,
+           replace: bool = False, workers: int = MAX_WORKERS) -> List[str]:
+    """
+    Load the sutta pages of a mirror into the page store and the catalog, a batch at a time as the mirror is scanned.
+    Pages already in the store are kept unless replace is set. Returns the urls of the mirror's pages.
+    """
+    start = time.perf_counter()
+    pages: Dict[str, None] = {}
+    stored_now = 0
+    with PageStore(store_file) as store:
+        stored = set() if replace else set(store.urls())
+        with ThreadPoolExecutor(max_workers=workers) as pool, \
+                tqdm(desc="Ingesting mirror:", ascii=True, colour='green') as bar:
+            in_flight: Deque[Future] = deque()
+            batch: List[Tuple[str, Member]] = []
+            for member in mirror_members(path):
+                url = mirror_url(member[0], base)
+                if url in pages:
+                    continue
+                pages[url] = None
+                if url in stored:
+                    continue
+                batch.append((url, member))
+                if len(batch) == BATCH_SIZE:
+                    in_flight.append(pool.submit(_store_batch, store, batch))
+                    batch = []
+                # Only a few batches are held at once: the pages of a tarball are read while it is scanned
+                while len(in_flight) > 2 * workers or (in_flight and in_flight[0].done()):
+                    count = in_flight.popleft().result()
+                    stored_now += count
+                    bar.update(count)
+            if batch:
+                in_flight.append(pool.submit(_store_batch, store, batch))
+            while in_flight:
+                count = in_flight.popleft().result()
+                stored_now += count
+                bar.update(count)
+
+    with Catalog(catalog_file) as catalog:
+        catalogued = catalog.add_links(pages)
+
+    elapsed = time.perf_counter() - start
+    print(f'{col.SEP}{col.GREEN}{stored_now}{col.END} pages of {col.GREEN}{path}{col.END} stored in {col.GREEN}{store_file}{col.END}, '
+          f'{col.GREY}{len(pages) - stored_now} already there{col.END}; {col.GREEN}{catalogued}{col.END} suttas catalogued '
+          f'in {elapsed:.1f}s.{col.SEP}')
+    return list(pages)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load a local mirror of the sutta pages into the page store.')
+    parser.add_argument('mirror', help='wget tree, tarball or zip')
+    parser.add_argument('--base', default=MIRROR_BASE, help='url of the pages of a mirror without host directory')
+    parser.add_argument('--replace', action='store_true', help='replace pages already in the store')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    ingest(args.mirror, base=args.base, replace=args.replace, workers=args.workers)
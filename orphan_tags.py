@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Linear-time removal of orphan (never closed) start tags.
+The builders used to drop the stray <p> tags at the start of the pages with
+    <p(?:\\s+[^>]*)?>(?!(?:(?!<p|</p>).)*</p>)      (re.DOTALL)
+whose lookahead scans the rest of the page again for every <p, which is quadratic on the
+big grouped files. strip_unclosed gives the same output from one forward pass over the
+tag tokens: a start tag is an orphan when the next '<p' or '</p>' after it is not its end tag.
+
+    python3 orphan_tags.py [directory ...]    # compare with the regex on the grouped AN and SN files
+"""
+
+import os, os.path, re, time
+from typing import List
+from cobraprint import col
+
+# Configuration
+BENCH_DIRS = ['Ангуттара Никая grouped', 'Саньютта Никая grouped']
+
+UNCLOSED_P = re.compile(r'<p(?:\s+[^>]*)?>(?!(?:(?!<p|</p>).)*</p>)', re.DOTALL)
+
+
+def strip_unclosed(html: str, tag: str = 'p') -> str:
+    """
+    html without the start tags of tag that are not followed by their end tag
+    before the next '<tag' (any tag name starting so, as in the regex) or the end of the page.
+    """
+    opening, closing = '<' + tag, f'</{tag}>'
+    tokens = re.compile(re.escape(closing) + '|' + re.escape(opening))
+    positions = [(m.start(), m.group() == closing) for m in tokens.finditer(html)]
+
+    out: List[str] = []
+    copied = 0              # html[:copied] is dealt with
+    following = 0           # index of the first token at or after the end of the current tag
+    gt = -1                 # the last '>' found, reused by the start tags inside the same tag
+    for start, is_end in positions:
+        if is_end or start < copied:
+            continue
+        name_end = start + len(opening)
+        if name_end >= len(html):
+            break
+        # <tag> or <tag followed by whitespace and attributes
+        if html[name_end] != '>' and not html[name_end].isspace():
+            continue
+        if gt < name_end:
+            gt = html.find('>', name_end)
+            if gt < 0:
+                break
+        end = gt + 1
+        while following < len(positions) and positions[following][0] < end:
+            following += 1
+        if following == len(positions) or not positions[following][1]:
+            out.append(html[copied:start])
+            copied = end
+    out.append(html[copied:])
+    return ''.join(out)
+
+def benchmark(*directories: str) -> None:
+    """Time of the regex and of strip_unclosed on every page of the directories, and whether the outputs agree."""
+    for directory in directories or BENCH_DIRS:
+        if not os.path.isdir(directory):
+            print(f'{col.RED}No directory {directory}{col.END}')
+            continue
+        regex_time = linear_time = 0.0
+        same = slowest = 0
+        slowest_name = ''
+        files = sorted(name for name in os.listdir(directory) if name.endswith('.html'))
+        for name in files:
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                page = f.read()
+            start = time.perf_counter()
+            old = UNCLOSED_P.sub('', page)
+            elapsed = time.perf_counter() - start
+            regex_time += elapsed
+            if elapsed > slowest:
+                slowest, slowest_name = elapsed, name
+            start = time.perf_counter()
+            new = strip_unclosed(page)
+            linear_time += time.perf_counter() - start
+            same += old == new
+            if old != new:
+                print(f'{col.RED}Output differs for {name}{col.END}')
+
+        print(f'{col.SEP}{col.GREY}{len(files)} files of {col.GREEN}{directory}{col.END}')
+        print(f'  regex:          {col.RED}{regex_time * 1000:.1f} ms{col.END} (slowest {slowest_name}: {slowest * 1000:.2f} ms)')
+        print(f'  strip_unclosed: {col.GREEN}{linear_time * 1000:.1f} ms{col.END} ({regex_time / (linear_time or 1e-9):.1f}x)')
+        print(f'  same output:    {col.GREEN}{same}{col.END}/{len(files)}{col.SEP}')
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*sys.argv[1:])
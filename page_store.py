@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Raw page store.
+Keeps the original response bytes of every downloaded page, zlib-compressed, together
+with the response headers, in one SQLite file. Text is decoded only when a stage asks
+for it, so a change in decoding or cleaning is redone from the store without any network traffic.
+
+    python3 page_store.py                            # pages and sizes per host
+    python3 page_store.py export <save_dir> [prefix]  # rewrite the html files of the stored pages
+"""
+
+import sqlite3, json, threading, zlib
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+from cobraprint import col
+from charset_sniffer import decode_html, declare_utf8, canonical, DEFAULT_ENCODING
+
+# Configuration
+STORE_FILE = 'page_store.sqlite'
+COMPRESSION_LEVEL = 6
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url         TEXT PRIMARY KEY,
+    status      INTEGER NOT NULL,
+    headers     TEXT NOT NULL,
+    body        BLOB NOT NULL,
+    size        INTEGER NOT NULL,
+    fetched_at  TEXT NOT NULL
+);
+"""
+
+
+class StoredPage:
+    """A stored page; the body is decompressed and decoded only on first use."""
+
+    def __init__(self, url: str, status: int, headers: Dict[str, str], compressed: bytes, fetched_at: str):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.fetched_at = fetched_at
+        self._compressed = compressed
+        self._content = None
+        self._text = None
+
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            self._content = zlib.decompress(self._compressed)
+        return self._content
+
+    @property
+    def fallback_encoding(self) -> str:
+        """Charset of the Content-Type header, used for pages the sniffer cannot tell."""
+        content_type = self.headers.get('Content-Type', '')
+        if 'charset=' in content_type:
+            return canonical(content_type.split('charset=')[-1].strip(' "\'')) or DEFAULT_ENCODING
+        return DEFAULT_ENCODING
+
+    def decode(self, fallback: Optional[str] = None) -> str:
+        """Page text; fallback replaces the Content-Type charset for pages the sniffer cannot tell."""
+        if self._text is None:
+            self._text = decode_html(self.content, fallback or self.fallback_encoding)
+        return self._text
+
+    text = property(decode)
+
+    def utf8_html(self, fallback: Optional[str] = None) -> bytes:
+        """The page as it is saved in the collection directories."""
+        return declare_utf8(self.decode(fallback)).encode('utf-8')
+
+class PageStore:
+    """Thread-safe; one connection shared under a lock."""
+
+    def __init__(self, path: str = STORE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _row(url: str, content: bytes, headers: Mapping[str, str], status: int, fetched_at: Optional[str]) -> tuple:
+        return (url, status, json.dumps(dict(headers), ensure_ascii=False),
+                zlib.compress(content, COMPRESSION_LEVEL), len(content),
+                fetched_at or datetime.now(timezone.utc).isoformat(timespec='seconds'))
+
+    def put(self, url: str, content: bytes, headers: Mapping[str, str], status: int = 200) -> None:
+        """Store the raw bytes of a response, replacing an earlier copy."""
+        row = self._row(url, content, headers, status, None)
+        with self._lock, self.conn:
+            self.conn.execute(
+                """INSERT OR REPLACE INTO pages (url, status, headers, body, size, fetched_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""", row)
+
+    def put_many(self, pages: Iterable[Tuple[str, bytes, Mapping[str, str], Optional[str]]], status: int = 200) -> int:
+        """
+        Store (url, content, headers, fetched_at) pages in one transaction; returns their number.
+        The pages are compressed before the lock is taken, so several threads can fill the store at once.
+        """
+        rows = [self._row(url, content, headers, status, fetched_at) for url, content, headers, fetched_at in pages]
+        with self._lock, self.conn:
+            self.conn.executemany(
+                """INSERT OR REPLACE INTO pages (url, status, headers, body, size, fetched_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""", rows)
+        return len(rows)
+
+    def get(self, url: str) -> Optional[StoredPage]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT url, status, headers, body, fetched_at FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, fetched_at = row
+        return StoredPage(url, status, json.loads(headers), body, fetched_at)
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM pages WHERE url = ?", (url,)).fetchone() is not None
+
+    def urls(self, prefix: str = '') -> List[str]:
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT url FROM pages WHERE url LIKE ? ORDER BY url", (prefix + '%',))]
+
+    def stats(self) -> Dict[str, tuple]:
+        """host -> (pages, raw bytes, stored bytes)"""
+        stats: Dict[str, list] = {}
+        with self._lock:
+            for url, size, stored in self.conn.execute("SELECT url, size, length(body) FROM pages"):
+                entry = stats.setdefault(urlparse(url).hostname or '', [0, 0, 0])
+                entry[0] += 1
+                entry[1] += size
+                entry[2] += stored
+        return {host: tuple(entry) for host, entry in stats.items()}
+
+_default_store: Optional[PageStore] = None
+_default_store_lock = threading.Lock()
+
+def default_store() -> PageStore:
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PageStore()
+    return _default_store
+
+if __name__ == '__main__':
+    import sys
+    with PageStore() as store:
+        if len(sys.argv) > 2 and sys.argv[1] == 'export':
+            from download_engine import rebuild_pages
+            prefix = sys.argv[3] if len(sys.argv) > 3 else ''
+            written = rebuild_pages(store.urls(prefix), sys.argv[2], store)
+            print(f'{col.SEP}{col.GREEN}{written}{col.END} pages written to {col.GREEN}{sys.argv[2]}{col.END} from the store, no network used.{col.SEP}')
+        else:
+            for host, (pages, raw, stored) in sorted(store.stats().items()):
+                print(f'{col.GREEN}{host}{col.END}: {pages} pages, {raw / 1e6:.1f} MB raw, {col.GREY}{stored / 1e6:.1f} MB stored{col.END}')
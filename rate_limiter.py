@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Polite per-host rate limiting shared by every network stage.
+Each host gets a token bucket whose state lives in a lock file, so all threads
+and all processes running at the same time draw from the same bucket.
+Live metrics (requests per second, queue depth, throttled time) are kept per host.
+
+    python3 rate_limiter.py     # show the shared state of all buckets
+"""
+
+import json, os, os.path, threading, time
+from collections import deque
+from urllib.parse import urlparse
+from typing import Deque, Dict, Tuple
+from requests.adapters import HTTPAdapter
+from cobraprint import col
+import replay
+
+try:
+    import fcntl
+except ImportError:     # Windows: the buckets are only shared between the threads of one process
+    fcntl = None
+
+# Configuration
+STATE_DIR = '.rate_limits'
+# host -> (requests per second, burst)
+DEFAULT_RATE = (2.0, 4)
+HOST_RATES = {
+    'theravada.ru': (2.0, 4),
+    'tipitaka.theravada.su': (2.0, 4),
+    'probud.narod.ru': (1.0, 2),
+    'russiangram.com': (0.2, 1),
+}
+METRICS_WINDOW = 10.0
+
+
+class HostMetrics:
+    def __init__(self):
+        self.stamps: Deque[float] = deque()    # times of the requests in the last METRICS_WINDOW seconds
+        self.waiting = 0
+        self.throttled = 0.0
+        self.requests = 0
+
+    def rate(self, now: float) -> float:
+        while self.stamps and now - self.stamps[0] > METRICS_WINDOW:
+            self.stamps.popleft()
+        return len(self.stamps) / METRICS_WINDOW
+
+class TokenBucket:
+    """
+    Token bucket of one host kept in '<state_dir>/<host>.json'.
+    The file is locked (flock) while the bucket is refilled and a token taken,
+    which makes the bucket safe to share between processes.
+    """
+
+    def __init__(self, host: str, rate: float, burst: int, state_dir: str = STATE_DIR):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, host.replace(':', '_') + '.json')
+        self.metrics = HostMetrics()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token if there is one; otherwise return the seconds until the next one."""
+        with self._lock, open(self.path, 'a+', encoding='utf-8') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            now = time.time()
+            tokens = min(self.burst, state.get('tokens', self.burst) + (now - state.get('updated', now)) * self.rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+                state['requests'] = state.get('requests', 0) + 1
+            state.update(tokens=tokens, updated=now)
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+            # closing the file releases the flock
+        return wait
+
+    def acquire(self) -> float:
+        """Block until a request may be sent; returns the seconds spent waiting."""
+        metrics = self.metrics
+        with self._lock:
+            metrics.waiting += 1
+        waited = 0.0
+        try:
+            while True:
+                wait = self._take()
+                if not wait:
+                    break
+                time.sleep(wait)
+                waited += wait
+        finally:
+            with self._lock:
+                metrics.waiting -= 1
+                metrics.throttled += waited
+                metrics.requests += 1
+                metrics.stamps.append(time.time())
+        return waited
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def host_of(url: str) -> str:
+    host = urlparse(url).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+def bucket(host: str) -> TokenBucket:
+    with _buckets_lock:
+        limiter = _buckets.get(host)
+        if limiter is None:
+            rate, burst = HOST_RATES.get(host, DEFAULT_RATE)
+            limiter = _buckets[host] = TokenBucket(host, rate, burst)
+        return limiter
+
+def throttle(url: str) -> float:
+    """Wait for the turn of the url's host; returns the seconds spent waiting."""
+    return bucket(host_of(url)).acquire()
+
+def metrics() -> Dict[str, Dict[str, float]]:
+    """Live metrics of this process per host: requests/s, queue depth, throttled seconds, requests."""
+    now = time.time()
+    with _buckets_lock:
+        buckets = list(_buckets.values())
+    return {b.host: {'rate': b.metrics.rate(now), 'queue': b.metrics.waiting,
+                     'throttled': b.metrics.throttled, 'requests': b.metrics.requests}
+            for b in buckets}
+
+def metrics_line(url: str) -> str:
+    """Short metrics summary of the url's host, for a tqdm postfix."""
+    m = metrics().get(host_of(url))
+    if not m:
+        return ''
+    return f"{m['rate']:.1f} req/s, queue {m['queue']}, throttled {m['throttled']:.0f}s"
+
+class ThrottledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter waiting for the host's rate limit before every request it sends.
+    With SUTTAS_STANDIN set the request goes to the local stand-in server instead, unthrottled;
+    with SUTTAS_RECORD set the response is recorded (see replay.py).
+    """
+
+    def send(self, request, **kwargs):
+        standin = replay.standin_url()
+        if standin:
+            replay.redirect(request, standin)
+            return super().send(request, **kwargs)
+        throttle(request.url)
+        response = super().send(request, **kwargs)
+        replay.record(request, response)
+        return response
+
+def mount_rate_limiter(session, pool_size: int = 10):
+    """Route all requests of the session through the rate limiter."""
+    adapter = ThrottledAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def shared_state(state_dir: str = STATE_DIR) -> Dict[str, Tuple[float, int]]:
+    """Tokens left and total requests of every bucket, as seen by all processes."""
+    state = {}
+    if not os.path.isdir(state_dir):
+        return state
+    for name in sorted(os.listdir(state_dir)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(state_dir, name), 'r', encoding='utf-8') as f:
+            try:
+                entry = json.loads(f.read() or '{}')
+            except ValueError:
+                continue
+        host = name[:-5]
+        rate, burst = HOST_RATES.get(host, DEFAULT_RATE)
+        tokens = min(burst, entry.get('tokens', burst) + (time.time() - entry.get('updated', 0)) * rate)
+        state[host] = (tokens, entry.get('requests', 0))
+    return state
+
+if __name__ == '__main__':
+    for host, (tokens, requests) in shared_state().items():
+        rate, burst = HOST_RATES.get(host, DEFAULT_RATE)
+        print(f'{col.GREEN}{host}{col.END}: {rate} req/s, {col.GREY}tokens {tokens:.1f}/{burst}{col.END}, {col.RED}{requests}{col.END} requests sent')
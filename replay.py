@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Record / replay of the HTTP traffic for offline pipeline runs.
+Responses are kept in a cassette (an SQLite file); a local stand-in server serves
+them back with configurable latency and errors. All sessions of the project send
+their requests through the adapter of rate_limiter, which follows two variables:
+
+    SUTTAS_RECORD=cassette.sqlite       record every response into the cassette
+    SUTTAS_STANDIN=http://127.0.0.1:8800 send every request to the stand-in server instead
+
+    python3 replay.py import [cassette]                     # fill a cassette from the HTTP cache and the page store
+    python3 replay.py serve [cassette] --latency 0.05 --error-rate 0.02
+    python3 replay.py bench [cassette] --workers 8          # network-free download throughput
+"""
+
+import requests
+import argparse, hashlib, json, os, os.path, random, re, sqlite3, subprocess, sys, tempfile, threading, time, zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from typing import Dict, List, Optional, Tuple
+from cobraprint import col
+
+# Configuration
+CASSETTE_FILE = 'cassette.sqlite'
+STANDIN_PORT = 8800
+RECORD_VAR = 'SUTTAS_RECORD'
+STANDIN_VAR = 'SUTTAS_STANDIN'
+# Form fields that change with every page view and do not select anything
+VOLATILE_FIELDS = {'form_build_id'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    method      TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    body_key    TEXT NOT NULL,
+    status      INTEGER NOT NULL,
+    headers     TEXT NOT NULL,
+    body        BLOB NOT NULL,
+    PRIMARY KEY (method, key, body_key)
+);
+"""
+# Run by benchmark() in a scratch directory, so the caches and the manifest start empty
+BENCH_SCRIPT = """
+import json, sys, time
+from download_engine import download_pages
+with open('urls.json', 'r', encoding='utf-8') as f:
+    urls = json.load(f)
+start = time.perf_counter()
+saved = download_pages(urls, 'pages', workers=int(sys.argv[1]), progress=lambda *args: None)
+print(json.dumps({'saved': len(saved), 'elapsed': time.perf_counter() - start}))
+"""
+# Headers describing the recorded transfer rather than the page
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-encoding', 'content-length'}
+
+
+def url_key(url: str) -> str:
+    """'https://theravada.ru/a/b.htm?x=1' -> 'theravada.ru/a/b.htm?x=1', host and path encoded as they are sent."""
+    prepared = requests.models.PreparedRequest()
+    prepared.prepare_url(url, None)
+    parts = urlsplit(prepared.url)
+    return parts.netloc + parts.path + ('?' + parts.query if parts.query else '')
+
+def body_key(body) -> str:
+    """Hash of a request body, form tokens left out so that a replayed form post matches the recorded one."""
+    if not body:
+        return ''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    try:
+        fields = parse_qsl(body.decode('ascii'), keep_blank_values=True, strict_parsing=True)
+        body = urlencode(sorted(field for field in fields if field[0] not in VOLATILE_FIELDS)).encode('ascii')
+    except (UnicodeDecodeError, ValueError):
+        pass
+    return hashlib.sha1(body).hexdigest()
+
+class Cassette:
+    """Recorded responses; thread-safe, one connection shared under a lock."""
+
+    def __init__(self, path: str = CASSETTE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def put(self, method: str, url: str, status: int, headers: Dict[str, str], body: bytes,
+            request_body=None) -> None:
+        headers = {name: value for name, value in headers.items() if name.lower() not in HOP_HEADERS}
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (method, url_key(url), body_key(request_body), status,
+                 json.dumps(headers, ensure_ascii=False), zlib.compress(body)))
+
+    def get(self, method: str, key: str, request_body=None) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        """Recorded (status, headers, body) of a request; HEAD falls back to the recorded GET."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT status, headers, body FROM responses WHERE method = ? AND key = ? AND body_key = ?",
+                (method, key, body_key(request_body))).fetchone()
+        if row is None:
+            return self.get('GET', key) if method == 'HEAD' else None
+        status, headers, body = row
+        return status, json.loads(headers), zlib.decompress(body)
+
+    def urls(self) -> List[str]:
+        """Recorded GET requests that succeeded, as https urls."""
+        with self._lock:
+            return ['https://' + row[0] for row in self.conn.execute(
+                "SELECT key FROM responses WHERE method = 'GET' AND status = 200 ORDER BY key")]
+
+    def import_http_cache(self, cache_dir: str) -> int:
+        """Record the bodies left in the HTTP cache by its earlier versions (the others are in the page store); returns their number."""
+        count = 0
+        if not os.path.isdir(cache_dir):
+            return count
+        for name in os.listdir(cache_dir):
+            if not name.endswith('.json') or name.endswith('.part.json'):
+                continue
+            body_path = os.path.join(cache_dir, name[:-len('.json')] + '.body')
+            if not os.path.isfile(body_path):
+                continue
+            with open(os.path.join(cache_dir, name), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+            headers = meta.get('headers') or {'Content-Type': meta.get('content_type') or 'text/html'}
+            self.put('GET', meta['url'], 200, headers, body)
+            count += 1
+        return count
+
+    def import_page_store(self, store) -> int:
+        """Record the pages of a PageStore; returns their number."""
+        urls = store.urls()
+        for url in urls:
+            page = store.get(url)
+            self.put('GET', url, page.status, page.headers, page.content)
+        return len(urls)
+
+_recorder: Optional[Cassette] = None
+_recorder_lock = threading.Lock()
+
+def recorder() -> Optional[Cassette]:
+    """Cassette named by SUTTAS_RECORD, None when not recording."""
+    global _recorder
+    path = os.environ.get(RECORD_VAR)
+    if not path:
+        return None
+    with _recorder_lock:
+        if _recorder is None or _recorder.path != path:
+            _recorder = Cassette(path)
+    return _recorder
+
+def standin_url() -> Optional[str]:
+    return os.environ.get(STANDIN_VAR) or None
+
+def redirect(request: requests.PreparedRequest, standin: str) -> None:
+    """Point a prepared request at the stand-in server; the original host becomes the first path segment."""
+    request.url = standin.rstrip('/') + '/' + url_key(request.url)
+
+def record(request: requests.PreparedRequest, response: requests.Response) -> None:
+    """Keep a response in the SUTTAS_RECORD cassette; revalidations (304) and partial bodies (206) are skipped."""
+    cassette = recorder()
+    if cassette is None or response.status_code in (304, 206):
+        return
+    cassette.put(request.method, request.url, response.status_code, dict(response.headers),
+                 response.content, request.body)
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Serves a cassette at http://127.0.0.1:<port>/<host>/<path>.
+    latency: seconds added to every response (a (min, max) pair draws uniformly);
+    error_rate: share of requests answered with error_status;
+    truncate_rate: share of bodies cut off halfway, to exercise the resume path.
+    Range requests are answered with 206. The random choices are seeded, so runs repeat.
+    """
+    daemon_threads = True
+
+    def __init__(self, cassette: Cassette, port: int = STANDIN_PORT, latency=0.0, error_rate: float = 0.0,
+                 error_status: int = 503, truncate_rate: float = 0.0, seed: int = 0):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.cassette = cassette
+        self.latency = latency if isinstance(latency, (tuple, list)) else (latency, latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.truncate_rate = truncate_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.served = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def draw(self) -> Tuple[float, float]:
+        with self.random_lock:
+            self.served += 1
+            return self.random.uniform(*self.latency), self.random.random()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _answer(self, method: str) -> None:
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        request_body = self.rfile.read(length) if length else None
+        delay, dice = server.draw()
+        if delay:
+            time.sleep(delay)
+        if dice < server.error_rate:
+            self.send_response(server.error_status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        recorded = server.cassette.get(method, self.path.lstrip('/'), request_body)
+        if recorded is None:
+            self.send_error(404, 'Not in the cassette')
+            return
+        status, headers, body = recorded
+
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match and status == 200 and int(match.group(1)) < len(body):
+            start = int(match.group(1))
+            status = 206
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        if method == 'HEAD':
+            return
+        if dice < server.error_rate + server.truncate_rate:
+            self.wfile.write(body[start:start + (len(body) - start) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def do_GET(self):
+        self._answer('GET')
+
+    def do_HEAD(self):
+        self._answer('HEAD')
+
+    def do_POST(self):
+        self._answer('POST')
+
+def benchmark(cassette: Cassette, workers: int, **server_options) -> None:
+    """Download every recorded page through the stand-in server into a scratch directory and time it."""
+    urls = cassette.urls()
+    server = StandInServer(cassette, port=0, **server_options)
+    server.start()
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    env[STANDIN_VAR] = server.url
+    env.pop(RECORD_VAR, None)
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            with open(os.path.join(scratch, 'urls.json'), 'w', encoding='utf-8') as f:
+                json.dump(urls, f)
+            run = subprocess.run([sys.executable, '-c', BENCH_SCRIPT, str(workers)], cwd=scratch, env=env,
+                                 capture_output=True, text=True, check=True)
+    finally:
+        server.shutdown()
+    result = json.loads(run.stdout.strip().splitlines()[-1])
+    saved, elapsed = result['saved'], result['elapsed']
+    print(f'{col.SEP}{col.GREEN}{saved}{col.END}/{len(urls)} pages in {elapsed:.2f}s with {workers} workers: '
+          f'{col.GREEN}{saved / elapsed:.1f}{col.END} pages/s, {server.served} requests served.{col.SEP}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record / replay of the HTTP traffic')
+    parser.add_argument('command', choices=['import', 'serve', 'bench'])
+    parser.add_argument('cassette', nargs='?', default=CASSETTE_FILE)
+    parser.add_argument('--port', type=int, default=STANDIN_PORT)
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.0], help='seconds, or a min and max')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--truncate-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    with Cassette(args.cassette) as cassette:
+        options = dict(latency=tuple(args.latency) if len(args.latency) > 1 else args.latency[0],
+                       error_rate=args.error_rate, error_status=args.error_status,
+                       truncate_rate=args.truncate_rate, seed=args.seed)
+        if args.command == 'import':
+            from http_cache import CACHE_DIR
+            from page_store import PageStore, STORE_FILE
+            count = cassette.import_http_cache(CACHE_DIR)
+            if os.path.isfile(STORE_FILE):
+                with PageStore(STORE_FILE) as store:
+                    count += cassette.import_page_store(store)
+            print(f'{col.SEP}{col.GREEN}{count}{col.END} responses recorded in {col.GREEN}{args.cassette}{col.END}.{col.SEP}')
+        elif args.command == 'serve':
+            server = StandInServer(cassette, args.port, **options)
+            print(f'{col.SEP}Serving {col.GREEN}{args.cassette}{col.END} at {col.GREEN}{server.url}{col.END}; '
+                  f'run the scripts with {STANDIN_VAR}={server.url}{col.SEP}')
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        else:
+            benchmark(cassette, args.workers, **options)
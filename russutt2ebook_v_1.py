@@ -13,6 +13,7 @@ from pathlib import Path
 from typing import List, Dict, Tuple, Optional
 from functools import partial
 from tqdm import tqdm
+from charset_sniffer import decode_html
 import uuid
 import html
 
@@ -42,8 +43,7 @@ def fetch_page_content(session: requests.Session, url: str) -> str:
         response = session.get(url, timeout=10)
         response.raise_for_status()
         
-        # Decode with windows-1251
-        content = response.content.decode(ENCODING)
+        content = decode_html(response.content, ENCODING)
         return content
     except Exception as e:
         print(f"Error fetching {url}: {e}")
@@ -8,8 +8,16 @@ import requests
 from bs4 import BeautifulSoup
 import chardet, re, html, os, os.path
 from urllib.parse import urljoin, urlparse
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from cobraprint import col
+from http_cache import cached_get
+from charset_sniffer import decode_html
+from rate_limiter import mount_rate_limiter
+from download_engine import download_pages, tqdm_progress
+from download_manifest import Manifest
+from crawl_frontier import crawl, page_links, SN_LINK_PATTERN
+from sutta_catalog import catalog_grand_list
+from tree_normalizer import flatten_wrappers
 from tqdm import tqdm
 from ebooklib import epub
 from time import time
@@ -90,19 +98,17 @@ def create_session() -> requests.Session:
     """Create configured requests session."""
     session = requests.Session()
     session.headers.update({'User-Agent': USER_AGENT})
-    return session
+    return mount_rate_limiter(session)
 
 
 def fetch_page_content(session: requests.Session, url: str) -> str:
     """Fetch and decode page content with proper encoding."""
     try:
-        response = session.get(url, timeout=20)
-        response.raise_for_status()
-        
-        # Decode with windows-1251
-        content = response.content.decode(ENCODING)
+        # Conditional GET, served from the local copy when unchanged
+        content = decode_html(cached_get(session, url), ENCODING)
         return content
-    except Exception as e:
+    # Retried under the fetch policy first; the url is on the dead-letter list by now
+    except requests.exceptions.RequestException as e:
         print(f"Error fetching {url}: {e}")
         return ""
 
@@ -121,58 +127,20 @@ def check_url(session, url):
 
 # Fetching the list of links to sutta subpages
 def list_maker(url):
-    session = create_session()
-    page_cont = fetch_page_content(session, url)
-
-    soup = BeautifulSoup(page_cont, 'lxml')
-    links = soup.find_all('a')
-    hrefs = [urljoin(BASE_URL, link.get('href')) for link in links if link.get('href') and link.get('href').endswith('.htm') and re.search(r'(samyutta-|an)[0-9]+', link.get('href'))]
-    result = [re.sub(r'/Canon/Texts/', '/Canon/Suttanta/Texts/', item) for item in hrefs]
-
-    return result
+    return page_links(url, SN_LINK_PATTERN, BASE_URL)
 
 def samyutta_list(url):
     sn_list_fname = 'samyutta_grand_list.txt'
 
-    if os.path.isfile(sn_list_fname):
-
-        with open(sn_list_fname, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        samyutta_grand_list = []
-        content = content[2:-2].split('], [')
-        for substr in content:
-            samyutta_grand_list.append(substr[1:-1].split("', '"))
-
-    else:
-        hrefs = list_maker(url)
-        samyutta_grand_list = []
-        for an in tqdm(hrefs, desc="Processing links:", ascii=True, colour='cyan'):
-            samyutta_grand_list.append(list_maker(an))
-
-        with open('samyutta_grand_list.txt', 'w', encoding='utf-8') as f:
-            f.write(str(samyutta_grand_list))
-    
-    
+    # The catalog is filled once, from the old grand-list file if present or else by crawling
+    samyutta_grand_list = catalog_grand_list('SN', lambda: crawl(url, SN_LINK_PATTERN, BASE_URL), sn_list_fname)
 
     return samyutta_grand_list
 
 def subpage_download(samyutta_grand_list, skip=True):
     dir = 'Саньютта Никая'
-    os.makedirs( dir, exist_ok=True)
-
-    for subls in tqdm(samyutta_grand_list, desc="Downloading chapter No.:", ascii=True, colour='blue'):
-        for link in tqdm(subls, desc="Downloading suttas:", ascii=True, colour='green'):
-        
-            parsed_link = urlparse(link)
-            link_path = parsed_link.path
-            subpage_name = os.path.basename(link_path) + 'l'
-            if skip and subpage_name in os.listdir(dir): continue
-            resp = requests.get(link, headers=headers, stream=True)
-            resp.encoding = 'windows-1251'
-            with open(f'{dir}/{subpage_name}', 'w', encoding='utf-8') as f:
-                content = resp.text.replace('windows-1251', 'utf-8')
-                f.write(content)
+    links = [link for subls in samyutta_grand_list for link in subls]
+    download_pages(links, dir, skip, progress=tqdm_progress("Downloading suttas:", 'green'))
 
     print(f'{col.SEP}Sutta pages succesfully downloaded and saved at {col.GREEN}{dir}.{col.SEP}')
 
@@ -220,45 +188,60 @@ def single_sutta_title_html(pali_title, russ_title, sutta_number) -> str:
     <br>
     """
 
-def grouping_maker(dir):
-    save_dir = dir + ' grouped'
-    os.makedirs(save_dir, exist_ok=True)
-    files = os.listdir(dir)
+def sutta_files(dir):
+    # Truncated or damaged downloads are left out
+    files = Manifest().intact_files(dir)
     files.sort(key=lambda x: (int(re.search(r'(?<=sn)[0-9]+(?=_[0-9])', x).group()), int(re.search(r'(?<=[0-9]_)[0-9]+(?=-)', x).group())))
+    return files
 
+def group_plan(files: List[str]) -> List[Tuple[str, List[str]]]:
+    """The groups of the sorted sutta files, in order: [(group file name, [sutta files])]."""
+    plan = []
     start_digit = 1
-    group_content = []
-    new_files = []
+    group_files = []
     initial_num = ''
-    removed_divs = 0
-    removed_spans = 0
-    removed_fonts = 0
 
-    for i, file in tqdm(enumerate(files), desc="File_processing:", ascii=True, colour="cyan"):
+    for i, file in enumerate(files):
         samyutta_num = re.search(r'(?<=sn)[0-9]+(?=_)', file).group()
         sut_num = re.search(r'(?<=[0-9]_)[0-9]+(|-[0-9]+)(?=-[a-z])', file).group()
         upper_num = re.sub(r'^[0-9]+-', '', sut_num)
         if not initial_num: initial_num = re.sub(r'-[0-9]+$', '', sut_num)
+        group_files.append(file)
+
+        if (int(upper_num) + 1)%10 == start_digit or file == files[-1] or ('-' in sut_num and '-' not in re.search(r'(?<=[0-9]_)[0-9]+(|-[0-9]+)(?=-[a-z])', files[i+1]).group() and int(upper_num)-int(initial_num) > 9) or re.search(r'(?<=sn)[0-9]+(?=_)', files[i+1]).group() != samyutta_num:
+            plan.append(('sn' + samyutta_num + '_' + initial_num + '-' + upper_num + '.html', group_files))
+            initial_num = ''
+            group_files = []
+            if file != files[-1]:
+                next_sut_no = re.search(r'(?<=[0-9]_)[0-9]+(|-[0-9]+)(?=-[a-z])', files[i+1]).group()
+                start_digit = (int(re.sub(r'^[0-9]+-', '', next_sut_no)))%10
+
+    return plan
+
+def build_group(dir, save_dir, save_name, group_files):
+    """
+    Join the sutta pages of one group into the group file save_dir/save_name.
+    Returns the numbers of removed superfluous <div>, <span> and <font> tags, or None if a page has no content.
+    """
+    samyutta_num, initial_num, upper_num = re.search(r'^sn([0-9]+)_([0-9]+)-([0-9]+)\.html$', save_name).groups()
+    group_content = []
+    removed_divs = 0
+    removed_spans = 0
+    removed_fonts = 0
+
+    for file in group_files:
+        sut_num = re.search(r'(?<=[0-9]_)[0-9]+(|-[0-9]+)(?=-[a-z])', file).group()
         file_path = os.path.join(dir, file)
 
         with open(file_path, 'r', encoding='utf-8') as f:
             cont = f.read()
         soup = BeautifulSoup(cont, 'lxml')
 
-        # Removing crazy multiple nested identical tags
-        span_tags = soup.find_all('span')
-        font_tags = soup.find_all('font')
-
-        for span in span_tags:
-            while span and span.span and span.span.span:
-                span.unwrap()
-                removed_spans += 1
-        # for font in font_tags:
-        #     while font and font.font and font.font.font:
-        #         font.font.font.unwrap()
-        #         removed_fonts += 1
-
-
+        # Removing crazy multiple nested identical tags, empty <div> and <o:p> tags
+        removed = flatten_wrappers(soup)
+        removed_divs += removed['div']
+        removed_spans += removed['span']
+        removed_fonts += removed['font']
 
         sut_info = extract_sutta_info(soup)
         sut_title = single_sutta_title_html(sut_info['pali_title'], sut_info['russ_title'], sut_info['sutta_number'])
@@ -266,57 +249,58 @@ def grouping_maker(dir):
         sut_td_tags = soup.find_all('td', {'style': 'text-align: justify', 'valign': 'top'})
         if not sut_td_tags: 
             print(file)
-            return ""
+            return None
         else: sut_td_tag = sut_td_tags[-1]
 
-        # Removing superfluous div tags
-        all_divs = sut_td_tag.find_all('div')
-        for div in all_divs:
-            if div.div: 
-                div.unwrap()
-                removed_divs += 1
-            p_tags = div.find_all('p')
-            if len(p_tags) > 1:
-                div.unwrap
-                removed_divs += 1
-
-
         sut_cont = sut_td_tag.contents
         # sut_cont = extract_sutta_content(soup)
         for tag in sut_cont:
             group_content.append(str(tag))
 
-        if (int(re.sub(r'^[0-9]+-', '', sut_num)) + 1)%10 == start_digit or file == files[-1] or ('-' in sut_num and '-' not in re.search(r'(?<=[0-9]_)[0-9]+(|-[0-9]+)(?=-[a-z])', files[i+1]).group() and int(upper_num)-int(initial_num) > 9) or re.search(r'(?<=sn)[0-9]+(?=_)', files[i+1]).group() != samyutta_num:
-            final_cont = "\n".join(group_content)
-            # print(final_cont[:1000])
-            save_name = 'sn' + samyutta_num + '_' + initial_num + '-' + re.sub(r'^[0-9]+-', '', sut_num) + '.html'
-            new_files.append(save_name)
-            save_as = os.path.join(save_dir, save_name)
-            sut_td_tag.clear()
-
-            # Setting the title for the whole group:
-            title_tag = soup.find('font', size="5")
-            suttas_numbers = title_tag.font
-            br = title_tag.br
-            title_tag.string = samyuttas[samyutta_num]
-
-            # suttas_numbers = title_tag.find_next('font', size='3')
-            if suttas_numbers:
-                suttas_numbers.string = f"Cутты {initial_num}-{re.sub(r'^[0-9]+-', '', sut_num)}"
-                title_tag.append(br)
-                title_tag.append(suttas_numbers)
-            else:
-                print(sut_num, str(title_tag), '\n')
-
-            # The following needs to be corrected:
-            sut_td_tag.append(BeautifulSoup(final_cont, 'lxml'))
-            with open(save_as, 'w', encoding='utf-8') as f:
-                f.write(str(soup))
-            initial_num = ''
-            group_content = []
-            if file != files[-1]:
-                next_sut_no = re.search(r'(?<=[0-9]_)[0-9]+(|-[0-9]+)(?=-[a-z])', files[i+1]).group()
-                start_digit = (int(re.sub(r'^[0-9]+-', '', next_sut_no)))%10
+    final_cont = "\n".join(group_content)
+    # print(final_cont[:1000])
+    save_as = os.path.join(save_dir, save_name)
+    sut_td_tag.clear()
+
+    # Setting the title for the whole group:
+    title_tag = soup.find('font', size="5")
+    suttas_numbers = title_tag.font
+    br = title_tag.br
+    title_tag.string = samyuttas[samyutta_num]
+
+    # suttas_numbers = title_tag.find_next('font', size='3')
+    if suttas_numbers:
+        suttas_numbers.string = f"Cутты {initial_num}-{upper_num}"
+        title_tag.append(br)
+        title_tag.append(suttas_numbers)
+    else:
+        print(sut_num, str(title_tag), '\n')
+
+    # The following needs to be corrected:
+    sut_td_tag.append(BeautifulSoup(final_cont, 'lxml'))
+    with open(save_as, 'w', encoding='utf-8') as f:
+        f.write(str(soup))
+
+    return removed_divs, removed_spans, removed_fonts
+
+def grouping_maker(dir):
+    save_dir = dir + ' grouped'
+    os.makedirs(save_dir, exist_ok=True)
+    files = sutta_files(dir)
+
+    new_files = []
+    removed_divs = 0
+    removed_spans = 0
+    removed_fonts = 0
+
+    for save_name, group_files in tqdm(group_plan(files), desc="File_processing:", ascii=True, colour="cyan"):
+        removed = build_group(dir, save_dir, save_name, group_files)
+        if removed is None:
+            return ""
+        removed_divs += removed[0]
+        removed_spans += removed[1]
+        removed_fonts += removed[2]
+        new_files.append(save_name)
 
     print(f"{col.SEP}The files in the given directory has been processed and the resulting aggregated files saved at {col.GREEN}{save_dir}{col.END} directory. Number of removed superfluous: <div> tags: {col.RED}{removed_divs}{col.END}; <span> tags: {col.RED}{removed_spans}{col.END}; <font> tags: {col.RED}{removed_fonts}{col.SEP}")
 
@@ -344,29 +328,10 @@ def html_unwrapper(filepath):
     with open(filepath, 'r', encoding='utf-8') as f:
         content = f.read()
     soup = BeautifulSoup(content, 'lxml')
-    span_tags = soup.find_all('span')
-    font_tags = soup.find_all('font')
-    removed_divs = 0
-    removed_spans = 0
-    removed_fonts = 0
-
-    for span in span_tags:
-        while span and span.span and span.span.span:
-            span.unwrap()
-            removed_spans += 1
-    for font in font_tags:
-        while font and font.font and font.font.font:
-            font.font.font.unwrap()
-            removed_fonts += 1
-
-    all_divs = soup.find_all('div')
-    for div in all_divs:
-        if div.div: 
-            div.unwrap()
-            removed_divs += 1
-        p_tags = div.find_all('p')
-        if len(p_tags) > 1:
-            div.unwrap
+    removed = flatten_wrappers(soup)
+    removed_divs = removed['div']
+    removed_spans = removed['span']
+    removed_fonts = removed['font']
 
     directory, filename = os.path.split(filepath)
     new_filename = filename
@@ -10,6 +10,12 @@ import chardet, re, html, os, os.path
 from urllib.parse import urljoin, urlparse
 from typing import List, Dict, Optional
 from cobraprint import col
+from http_cache import cached_get
+from charset_sniffer import decode_html
+from rate_limiter import mount_rate_limiter
+from download_engine import download_pages, tqdm_progress
+from crawl_frontier import crawl, page_links, SN_LINK_PATTERN
+from sutta_catalog import catalog_grand_list
 from tqdm import tqdm
 from ebooklib import epub
 from time import time
@@ -30,19 +36,17 @@ def create_session() -> requests.Session:
     """Create configured requests session."""
     session = requests.Session()
     session.headers.update({'User-Agent': USER_AGENT})
-    return session
+    return mount_rate_limiter(session)
 
 
 def fetch_page_content(session: requests.Session, url: str) -> str:
     """Fetch and decode page content with proper encoding."""
     try:
-        response = session.get(url, timeout=20)
-        response.raise_for_status()
-        
-        # Decode with windows-1251
-        content = response.content.decode(ENCODING)
+        # Conditional GET, served from the local copy when unchanged
+        content = decode_html(cached_get(session, url), ENCODING)
         return content
-    except Exception as e:
+    # Retried under the fetch policy first; the url is on the dead-letter list by now
+    except requests.exceptions.RequestException as e:
         print(f"Error fetching {url}: {e}")
         return ""
 
@@ -61,43 +65,15 @@ def check_url(session, url):
 
 # Fetching the list of links to sutta subpages
 def list_maker(url):
-    session = create_session()
-    page_cont = fetch_page_content(session, url)
-
-    soup = BeautifulSoup(page_cont, 'lxml')
-    links = soup.find_all('a')
-    hrefs = [urljoin(BASE_URL, link.get('href')) for link in links if link.get('href') and link.get('href').endswith('.htm') and re.search(r'(samyutta-|sn)[0-9]+', link.get('href'))]
-
-    return hrefs
-
-def samyutta_list():
-    with open('samyutta_grand_list.txt', 'r', encoding='utf-8') as f:
-        content = f.read()
-    content = re.sub(r'/Canon/Texts/', '/Canon/Suttanta/Texts/', content)
-    
-    samyutta_grand_list = []
-    content = content[2:-2].split('], [')
-    for substr in content:
-        samyutta_grand_list.append(substr[1:-1].split("', '"))
+    return page_links(url, SN_LINK_PATTERN, BASE_URL)
 
-    return samyutta_grand_list
+def samyutta_list(url="https://theravada.ru/Teaching/Canon/Suttanta/samyutta.htm"):
+    return catalog_grand_list('SN', lambda: crawl(url, SN_LINK_PATTERN, BASE_URL), 'samyutta_grand_list.txt')
 
 def subpage_download(samyutta_grand_list, skip=True):
     dir = 'Саньютта Никая'
-    os.makedirs( dir, exist_ok=True)
-
-    for subls in tqdm(samyutta_grand_list, desc="Downloading samyutta No.:", ascii=True, colour='blue'):
-        for link in tqdm(subls, desc="Downloading suttas:", ascii=True, colour='green'):
-        
-            parsed_link = urlparse(link)
-            link_path = parsed_link.path
-            subpage_name = os.path.basename(link_path) + 'l'
-            if skip and subpage_name in os.listdir(dir): continue
-            resp = requests.get(link, headers=headers, stream=True)
-            resp.encoding = 'windows-1251'
-            with open(f'{dir}/{subpage_name}', 'w', encoding='utf-8') as f:
-                content = resp.text.replace('windows-1251', 'utf-8')
-                f.write(content)
+    links = [link for subls in samyutta_grand_list for link in subls]
+    download_pages(links, dir, skip, progress=tqdm_progress("Downloading suttas:", 'green'))
 
     print(f'{col.SEP}Sutta pages succesfully downloaded and saved at {col.GREEN}{dir}.{col.SEP}')
 
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Source adapters for the sites the suttas are scraped from.
+Every site gets its own adapter (hosts, encoding, concurrency budget) behind one
+async fetch interface, so a build mixing several sites fetches from all of them at once.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from typing import Dict, Iterable, Optional
+from download_engine import thread_session
+from http_cache import cached_get
+from charset_sniffer import decode_html
+
+
+class Source:
+    """A site with its hosts, page encoding and the number of requests it may get at once."""
+
+    def __init__(self, name: str, hosts: Iterable[str], encoding: str, budget: int):
+        self.name = name
+        self.hosts = set(hosts)
+        self.encoding = encoding
+        self.budget = budget
+
+    def __repr__(self):
+        return f'Source({self.name!r})'
+
+    def decode(self, content: bytes) -> str:
+        """Sniffed encoding; the source's own encoding is the fallback."""
+        return decode_html(content, self.encoding)
+
+    def fetch_bytes(self, url: str) -> bytes:
+        """Blocking fetch through the calling thread's pooled session and the shared HTTP cache."""
+        return cached_get(thread_session(), url)
+
+SOURCES = [
+    Source('theravada.ru', ['theravada.ru', 'www.theravada.ru'], 'windows-1251', 4),
+    Source('тхеравада.рф', ['тхеравада.рф', 'тхеравада.рф'.encode('idna').decode('ascii')], 'utf-8', 4),
+    Source('theravada.su', ['tipitaka.theravada.su'], 'utf-8', 4),
+    Source('probud.narod.ru', ['probud.narod.ru'], 'utf-8', 2),
+]
+DEFAULT_SOURCE = Source('other', [], 'utf-8', 2)
+
+
+def source_for(url: str) -> Source:
+    host = urlparse(url).hostname or ''
+    for source in SOURCES:
+        if host in source.hosts:
+            return source
+    return DEFAULT_SOURCE
+
+class Federation:
+    """Async fetching across all sources; each source is limited to its own budget."""
+
+    def __init__(self):
+        self._limits: Dict[str, asyncio.Semaphore] = {}
+        workers = sum(source.budget for source in SOURCES) + DEFAULT_SOURCE.budget
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def close(self) -> None:
+        self._pool.shutdown()
+
+    def _limit(self, source: Source) -> asyncio.Semaphore:
+        limit = self._limits.get(source.name)
+        if limit is None:
+            limit = self._limits[source.name] = asyncio.Semaphore(source.budget)
+        return limit
+
+    async def fetch(self, url: str) -> str:
+        """Decoded text of the page."""
+        source = source_for(url)
+        async with self._limit(source):
+            loop = asyncio.get_running_loop()
+            content = await loop.run_in_executor(self._pool, source.fetch_bytes, url)
+        return source.decode(content)
+
+    async def fetch_all(self, urls: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Texts of all urls fetched concurrently; pages that fail are reported and mapped to None."""
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        texts = {}
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                print(f"Error fetching {url}: {result}")
+                result = None
+            texts[url] = result
+        return texts
+
+def fetch_all(urls: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Blocking entry point for the scripts: fetch pages from any mix of sources at once."""
+    federation = Federation()
+    try:
+        return asyncio.run(federation.fetch_all(urls))
+    finally:
+        federation.close()
+
+def fetch_text(url: str) -> str:
+    """Single page decoded with the encoding of its source."""
+    source = source_for(url)
+    return source.decode(source.fetch_bytes(url))
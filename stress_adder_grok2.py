@@ -15,6 +15,7 @@ from selenium.webdriver.chrome.options import Options
 from tqdm import tqdm
 from bs4 import BeautifulSoup
 from cobraprint import col
+from rate_limiter import throttle
 
 # Configure logging
 logging.basicConfig(
@@ -92,6 +93,7 @@ def stress_adder(file_path):
             for attempt in range(retry_attempts):
                 try:
                     # Navigate to website
+                    throttle("https://russiangram.com/")
                     driver.get("https://russiangram.com/")
                     input_field = WebDriverWait(driver, 30).until(
                         EC.presence_of_element_located((By.ID, "MainContent_UserSentenceTextbox"))
@@ -149,6 +151,7 @@ def stress_adder(file_path):
                     logging.error(f"Attempt {attempt + 1} failed for section: {section_to_upload[:100]}... Error: {str(e)}")
                     if attempt < retry_attempts - 1:
                         time.sleep(retry_delay)
+                        throttle("https://russiangram.com/")
                         driver.get("https://russiangram.com/")
                     else:
                         print(f"{col.RED}All retries failed for section. Adding to failed sections.{col.END}")
@@ -174,6 +177,7 @@ def stress_adder(file_path):
         for attempt in range(retry_attempts):
             try:
                 driver = webdriver.Chrome(options=options)
+                throttle("https://russiangram.com/")
                 driver.get("https://russiangram.com/")
                 input_field = WebDriverWait(driver, 30).until(
                     EC.presence_of_element_located((By.ID, "MainContent_UserSentenceTextbox"))
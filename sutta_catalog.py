@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+SQLite catalog of the sutta pages, indexed by canonical sutta ID ("SN 12.1", "AN 1.1-10", "DN 1").
+Replaces the str(list) grand-list text files; single suttas and ranges such as
+"SN 12.1-10" are looked up through the index without reading the whole catalog.
+"""
+
+import sqlite3, os, os.path, re
+from typing import Dict, Iterable, List, Optional
+from cobraprint import col
+from download_engine import page_file_name
+from crawl_frontier import normalize_link
+
+CATALOG_FILE = 'sutta_catalog.sqlite'
+
+# Collection code -> directory the pages are downloaded to
+COLLECTION_DIRS = {
+    'DN': 'Дигха Никая',
+    'MN': 'Маджхима Никая',
+    'SN': 'Саньютта Никая',
+    'AN': 'Ангуттара Никая',
+}
+
+# sn12_1-..., an1_1-10-..., an5_303-1152-...
+GROUPED_NAME = re.compile(r'^(sn|an)(\d+)_(\d+)(?:-(\d+))?-[a-z]')
+# dn1-brahmajala-sutta-01-sirkin, mn10-satipatthana-sutta-sv
+SINGLE_NAME = re.compile(r'^(dn|mn)(\d+)-[a-z][a-z-]*?(?:-(\d\d)-[a-z]+)?$')
+QUERY = re.compile(r'^\s*(DN|MN|SN|AN)\s*(\d+)(?:\.(\d+))?(?:\s*[-–]\s*(\d+))?\s*$', re.IGNORECASE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS suttas (
+    url         TEXT PRIMARY KEY,
+    sutta_id    TEXT NOT NULL,
+    part        INTEGER NOT NULL DEFAULT 1,
+    collection  TEXT NOT NULL,
+    group_no    INTEGER NOT NULL,
+    first_no    INTEGER NOT NULL,
+    last_no     INTEGER NOT NULL,
+    title       TEXT,
+    local_path  TEXT
+);
+CREATE INDEX IF NOT EXISTS suttas_id ON suttas (sutta_id, part);
+CREATE INDEX IF NOT EXISTS suttas_range ON suttas (collection, group_no, first_no, last_no);
+CREATE TABLE IF NOT EXISTS index_links (
+    index_url   TEXT NOT NULL,
+    position    INTEGER NOT NULL,
+    url         TEXT NOT NULL,
+    PRIMARY KEY (index_url, position)
+);
+"""
+
+
+def parse_sutta_url(url: str) -> Optional[Dict[str, object]]:
+    """Catalog fields derived from the page name of a sutta url, None for index pages."""
+    name = os.path.basename(url).rsplit('.', 1)[0]
+    match = GROUPED_NAME.match(name)
+    if match:
+        prefix, group_no, first_no, last_no = match.groups()
+        collection = prefix.upper()
+        first_no = int(first_no)
+        last_no = int(last_no) if last_no else first_no
+        number = f'{first_no}' if first_no == last_no else f'{first_no}-{last_no}'
+        return {
+            'sutta_id': f'{collection} {int(group_no)}.{number}',
+            'part': 1,
+            'collection': collection,
+            'group_no': int(group_no),
+            'first_no': first_no,
+            'last_no': last_no,
+        }
+    match = SINGLE_NAME.match(name)
+    if match:
+        prefix, sutta_no, part = match.groups()
+        collection = prefix.upper()
+        return {
+            'sutta_id': f'{collection} {int(sutta_no)}',
+            'part': int(part) if part else 1,
+            'collection': collection,
+            'group_no': int(sutta_no),
+            'first_no': int(sutta_no),
+            'last_no': int(sutta_no),
+        }
+    return None
+
+class Catalog:
+    def __init__(self, path: str = CATALOG_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_links(self, links: Iterable[str], save_dir: Optional[str] = None) -> int:
+        """Insert or update the suttas behind the links; returns the number of catalogued links."""
+        rows = []
+        for url in links:
+            fields = parse_sutta_url(url)
+            if not fields:
+                continue
+            directory = save_dir or COLLECTION_DIRS[fields['collection']]
+            fields['url'] = url
+            fields['local_path'] = os.path.join(directory, page_file_name(url))
+            rows.append(fields)
+        with self.conn:
+            self.conn.executemany(
+                """INSERT INTO suttas (sutta_id, part, collection, group_no, first_no, last_no, url, local_path)
+                   VALUES (:sutta_id, :part, :collection, :group_no, :first_no, :last_no, :url, :local_path)
+                   ON CONFLICT (url) DO UPDATE SET local_path = excluded.local_path""",
+                rows)
+        return len(rows)
+
+    def set_title(self, sutta_id: str, title: str) -> None:
+        with self.conn:
+            self.conn.execute("UPDATE suttas SET title = ? WHERE sutta_id = ?", (title, sutta_id))
+
+    def get(self, sutta_id: str) -> List[sqlite3.Row]:
+        """All pages of one sutta (parts and alternative translations), e.g. catalog.get('SN 12.1')."""
+        return self.conn.execute(
+            "SELECT * FROM suttas WHERE sutta_id = ? ORDER BY part", (sutta_id,)).fetchall()
+
+    def by_url(self, url: str) -> Optional[sqlite3.Row]:
+        return self.conn.execute("SELECT * FROM suttas WHERE url = ?", (url,)).fetchone()
+
+    def range(self, collection: str, group_no: int, first_no: int = 0, last_no: Optional[int] = None) -> List[sqlite3.Row]:
+        """Pages of a group overlapping the given sutta numbers (whole group if none are given)."""
+        if last_no is None:
+            last_no = first_no if first_no else 1 << 30
+        return self.conn.execute(
+            """SELECT * FROM suttas WHERE collection = ? AND group_no = ? AND first_no <= ? AND last_no >= ?
+               ORDER BY first_no, part""",
+            (collection.upper(), group_no, last_no, first_no)).fetchall()
+
+    def query(self, text: str) -> List[sqlite3.Row]:
+        """'SN 12.1-10', 'SN 12.5', 'SN 12', 'DN 1-13' or 'MN 10'."""
+        match = QUERY.match(text)
+        if not match:
+            raise ValueError(f"Invalid sutta reference: {text}")
+        collection, number, sub_no, upper = match.groups()
+        collection = collection.upper()
+        number = int(number)
+        if collection in ('DN', 'MN'):
+            last_no = int(upper) if upper else number
+            return self.conn.execute(
+                """SELECT * FROM suttas WHERE collection = ? AND group_no BETWEEN ? AND ?
+                   ORDER BY group_no, part""", (collection, number, last_no)).fetchall()
+        if sub_no is None:
+            return self.range(collection, number)
+        sub_no = int(sub_no)
+        return self.range(collection, number, sub_no, int(upper) if upper else sub_no)
+
+    def grand_list(self, collection: str) -> List[List[str]]:
+        """Sutta urls of the collection, one sublist per samyutta / nipata."""
+        grouped: Dict[int, List[str]] = {}
+        for row in self.conn.execute(
+                "SELECT group_no, url FROM suttas WHERE collection = ? ORDER BY group_no, first_no, part",
+                (collection.upper(),)):
+            grouped.setdefault(row['group_no'], []).append(row['url'])
+        return list(grouped.values())
+
+    def index_links(self, index_url: str) -> Optional[List[str]]:
+        """Links of an index page as they were last seen, None if the page has no recorded links."""
+        rows = self.conn.execute(
+            "SELECT url FROM index_links WHERE index_url = ? ORDER BY position", (index_url,)).fetchall()
+        return [row['url'] for row in rows] or None
+
+    def set_index_links(self, index_url: str, links: List[str]) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM index_links WHERE index_url = ?", (index_url,))
+            self.conn.executemany("INSERT INTO index_links (index_url, position, url) VALUES (?, ?, ?)",
+                                  [(index_url, i, url) for i, url in enumerate(links)])
+
+    def count(self, collection: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM suttas WHERE collection = ?", (collection.upper(),)).fetchone()[0]
+
+def read_legacy_grand_list(fname: str) -> List[List[str]]:
+    """Parse a grand-list text file written with str(list) by the earlier versions."""
+    with open(fname, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    grand_list = []
+    content = content[2:-2].split('], [')
+    for substr in content:
+        grand_list.append(substr[1:-1].split("', '"))
+    return grand_list
+
+def catalog_grand_list(collection: str, crawl_fn, legacy_fname: Optional[str] = None,
+                       catalog_file: str = CATALOG_FILE) -> List[List[str]]:
+    """
+    Grand list of a collection from the catalog.
+    An empty catalog is filled from the legacy text file if there is one, otherwise from crawl_fn().
+    """
+    with Catalog(catalog_file) as catalog:
+        if not catalog.count(collection):
+            if legacy_fname and os.path.isfile(legacy_fname):
+                grand_list = read_legacy_grand_list(legacy_fname)
+            else:
+                grand_list = crawl_fn()
+            links = [normalize_link(link) for subls in grand_list for link in subls]
+            added = catalog.add_links(links)
+            print(f'{col.SEP}{col.GREEN}{added}{col.END} {collection} pages added to the catalog {col.GREEN}{catalog_file}{col.END}; {col.RED}{len(links) - added}{col.END} index links skipped.{col.SEP}')
+        return catalog.grand_list(collection)
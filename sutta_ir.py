@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Cached intermediate representation (IR) of the sutta pages.
+A page is extracted once into a Sutta: titles, table of contents, headings, paragraphs
+and notes, each block with its text and its chapter markup as chapter_normalizer writes it.
+The IR is pickled (zlib-compressed) under the sha256 of the page and the version of the extraction code,
+so a page is only parsed again when it, or the code extracting it, changes; the EPUB
+builders make their chapters from it.
+
+    python3 sutta_ir.py [MN DN AN] [--fast]    # bring the IR of the collections' pages up to date
+"""
+
+import hashlib, os, os.path, pickle, re, time, zlib
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import Comment
+from lxml import etree
+from cobraprint import col
+from build_graph import code_version, file_hash
+from chapter_normalizer import normalize_part, Part
+import footnotes
+
+# Configuration
+IR_DIR = '.build/ir'
+IR_FORMAT = 2       # bump when the classes below change
+PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL
+COMPRESSION = 1        # zlib level: the markup shrinks about 6x at little cost
+NUMBERING = re.compile(r'(\d+(\.\d+)*)')
+
+# (sutta info, content parts, footnotes) of a page, as the builders extract them;
+# the parts end with the rendered notes, one per footnote
+PageExtractor = Callable[[str], Tuple[Dict[str, str], List[Part], List[footnotes.Note]]]
+
+
+@dataclass(slots=True)
+class TocEntry:
+    level: int          # 1 for "1", 2 for "1.1", ...
+    text: str
+    href: str           # anchor in the page
+
+@dataclass(slots=True)
+class Heading:
+    level: int          # of the <hN> the builder made
+    text: str
+    html: str           # chapter markup
+
+@dataclass(slots=True)
+class Paragraph:
+    text: str
+    html: str
+
+@dataclass(slots=True)
+class NoteBlock:
+    number: str
+    back_link: str
+    text: str
+    html: str
+
+Block = Union[Heading, Paragraph]
+
+@dataclass(slots=True)
+class Sutta:
+    source: str         # file name of the page
+    digest: str         # sha256 of the page
+    pali_title: str
+    russ_title: str
+    sutta_number: str
+    translator: Optional[str] = None
+    toc: List[TocEntry] = field(default_factory=list)
+    blocks: List[Block] = field(default_factory=list)
+    notes: List[NoteBlock] = field(default_factory=list)
+
+    def chapter_parts(self) -> List[str]:
+        """Chapter markup of the blocks and the notes, for chapter_normalizer.join_parts."""
+        return [block.html for block in self.blocks] + [note.html for note in self.notes]
+
+
+def _name(part: Part) -> Optional[str]:
+    if isinstance(part, Tag):
+        return part.name
+    if isinstance(part, etree._Element) and isinstance(part.tag, str):
+        return part.tag
+    return None
+
+def _text(part: Part) -> str:
+    if isinstance(part, Tag):
+        text = part.get_text()
+    elif isinstance(part, etree._Element):
+        text = ''.join(part.itertext()) if isinstance(part.tag, str) else ''
+    elif isinstance(part, Comment):
+        text = ''
+    elif isinstance(part, NavigableString):
+        text = str(part)
+    else:
+        text = BeautifulSoup(part, 'html.parser').get_text()
+    return re.sub(r'\s+', ' ', text).strip()
+
+def _links(part: Part) -> List[Tuple[str, str]]:
+    """(href, text) of the links in the part."""
+    if isinstance(part, Tag):
+        links = part.find_all('a', href=True)
+        if part.name == 'a' and part.has_attr('href'):
+            links.insert(0, part)
+        return [(link['href'], _text(link)) for link in links]
+    if isinstance(part, etree._Element) and isinstance(part.tag, str):
+        return [(link.get('href'), _text(link)) for link in part.iter('a') if link.get('href') is not None]
+    return []
+
+def toc_entries(part: Part, text: str) -> List[TocEntry]:
+    """The entries of a part made of links into the page only (a table of contents, or a line of one)."""
+    links = [(href, link_text) for href, link_text in _links(part) if link_text]
+    if not links or not all(href.startswith('#') for href, _ in links):
+        return []
+    # Nothing but the links (the entries of a table of contents are not always separated by whitespace)
+    if ''.join(link_text for _, link_text in links).replace(' ', '') != text.replace(' ', ''):
+        return []
+    entries = []
+    for href, link_text in links:
+        match = NUMBERING.match(link_text)
+        entries.append(TocEntry(len(match.group(0).split('.')) if match else 1, link_text, href))
+    return entries
+
+def from_parts(source: str, digest: str, info: Dict[str, str], parts: Sequence[Part],
+               notes: Sequence[footnotes.Note]) -> Sutta:
+    """The IR of a page from what the builder extracted; the last len(notes) parts are the notes."""
+    sutta = Sutta(source, digest, info['pali_title'], info['russ_title'], info['sutta_number'], info.get('translator'))
+    body = len(parts) - len(notes)
+    for part in parts[:body]:
+        text = _text(part)
+        name = _name(part)
+        if name and re.fullmatch(r'h[1-6]', name):
+            sutta.blocks.append(Heading(int(name[1]), text, normalize_part(part)))
+        else:
+            sutta.toc.extend(toc_entries(part, text))
+            sutta.blocks.append(Paragraph(text, normalize_part(part)))
+    for note, part in zip(notes, parts[body:]):
+        sutta.notes.append(NoteBlock(note.number.strip(), note.back_link, _text(part), normalize_part(part)))
+    return sutta
+
+def extract(path: str, extract_page: PageExtractor) -> Sutta:
+    """The IR of the page at path, extracted anew."""
+    info, parts, notes = extract_page(path)
+    return from_parts(os.path.basename(path), file_hash(path), info, parts, notes)
+
+def _ir_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], key + '.pickle.z')
+
+def version(extract_page: PageExtractor) -> str:
+    """
+    Version of the IR made by extract_page: the format, the code of extract_page and of this module
+    with all they import, and the arguments bound to extract_page (fast). The builders key their
+    chapter memo on it too, so that the two caches go stale together.
+    """
+    bound = sorted(getattr(extract_page, 'keywords', {}).items())
+    return f"{IR_FORMAT}-{code_version(extract_page, 'sutta_ir')}-{bound}"
+
+def load(path: str, extract_page: PageExtractor, cache_dir: str = IR_DIR) -> Sutta:
+    """
+    The IR of the page at path, from the cache if the page and the extraction code are unchanged.
+    The key is made of the page's sha256 and of the version of the IR.
+    """
+    key = hashlib.sha256(f'{version(extract_page)}\0{file_hash(path)}'.encode()).hexdigest()
+    ir_path = _ir_path(key, cache_dir)
+    if os.path.isfile(ir_path):
+        with open(ir_path, 'rb') as f:
+            sutta = pickle.loads(zlib.decompress(f.read()))
+        # The same page under another name
+        sutta.source = os.path.basename(path)
+        return sutta
+
+    sutta = extract(path, extract_page)
+    os.makedirs(os.path.dirname(ir_path), exist_ok=True)
+    with open(ir_path + '.tmp', 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(sutta, protocol=PICKLE_PROTOCOL), COMPRESSION))
+    os.replace(ir_path + '.tmp', ir_path)
+    return sutta
+
+if __name__ == '__main__':
+    import argparse, importlib
+    from functools import partial
+    from fast_extract import COLLECTIONS
+    from tqdm import tqdm
+
+    parser = argparse.ArgumentParser(description='Bring the IR of the sutta pages up to date.')
+    parser.add_argument('collections', nargs='*', help=f"{', '.join(COLLECTIONS)} (all by default)")
+    parser.add_argument('--fast', action='store_true', help='extract the pages with lxml (fast_extract)')
+    args = parser.parse_args()
+    for collection in args.collections:
+        if collection not in COLLECTIONS:
+            parser.error(f'unknown collection {collection}')
+
+    for collection in args.collections or list(COLLECTIONS):
+        module_name, directory = COLLECTIONS[collection]
+        extract_page = partial(importlib.import_module(module_name).extract_page, fast=args.fast)
+        start = time.perf_counter()
+        suttas = [load(os.path.join(directory, name), extract_page)
+                  for name in tqdm(sorted(name for name in os.listdir(directory) if name.endswith('.html')),
+                                   desc=f"{collection}:", ascii=True, colour='green')]
+        elapsed = time.perf_counter() - start
+        print(f'{col.SEP}{col.GREEN}{len(suttas)}{col.END} pages of {col.GREEN}{directory}{col.END} in {elapsed:.1f}s: '
+              f'{col.GREY}{sum(len(sutta.blocks) for sutta in suttas)} blocks, {sum(len(sutta.notes) for sutta in suttas)} notes, '
+              f'{sum(len(sutta.toc) for sutta in suttas)} table of contents entries{col.END}{col.SEP}')
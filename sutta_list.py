@@ -3,6 +3,12 @@ from bs4 import BeautifulSoup
 import re, os
 from urllib.parse import urljoin
 from cobraprint import col
+from http_cache import cached_get
+from charset_sniffer import decode_html
+from rate_limiter import mount_rate_limiter
+from download_engine import fetch_page
+from url_prober import probe_availability, url_exists, AVAILABILITY_TTL
+from sources import fetch_all, fetch_text
 from tqdm import tqdm
 
 headers = {
@@ -21,23 +27,20 @@ def create_session() -> requests.Session:
     """Create configured requests session."""
     session = requests.Session()
     session.headers.update({'User-Agent': USER_AGENT})
-    return session
+    return mount_rate_limiter(session)
 
 
 def fetch_page_content(session: requests.Session, url: str) -> str:
     """Fetch and decode page content with proper encoding."""
     try:
-        response = session.get(url, timeout=20)
-        response.raise_for_status()
-        
-        # Decode with windows-1251
-        content = response.content.decode(ENCODING)
+        # Conditional GET, served from the local copy when unchanged
+        content = decode_html(cached_get(session, url), ENCODING)
         return content
     except Exception as e:
         # print(f"Error fetching {url}: {e}")
         return None
 
-def sutta_list(nikaya_name: str):
+def nikaya_index_url(nikaya_name: str) -> str:
     suttanta_url = 'https://тхеравада.рф/palicanon/суттанта/'
     if nikaya_name == 'theravada.su':
         nikaya_url = "https://tipitaka.theravada.su/toc/translations/1098"
@@ -46,87 +49,91 @@ def sutta_list(nikaya_name: str):
 
     else:
         nikaya_url = suttanta_url + nikaya_name
-    raw_html = os.path.join('Russ_suttas', f'{nikaya_name}.html')
-
-    # Send a GET request to the URL
-    response = requests.get(nikaya_url, headers=headers, stream=True)
-    if nikaya_name == 'digha':
-        response.encoding = 'windows-1251'
-
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Get the content of the page as a Unicode string
-
-        page_content = response.text
-            
-        # with open(raw_html, 'w', encoding='utf-8') as file:
-        #     file.write(page_content)
-
-        soup = BeautifulSoup(page_content, features='lxml')
-        links = soup.find_all('a')
-
-        if nikaya_name == 'мадджхима-hикая':
-            hrefs = [link.get('href') for link in links if re.search(r'mn\d+', link.get('href')) and not re.search(r'dhamma.ru', link.get('href'))]
-            final_links = [hrefs[0]]
-
-            i = 0
-            for link in hrefs[1:]:
-                i += 1
-                sutta_no = re.search(r'mn[0-9]+', link).group()[2:]
-                if sutta_no in hrefs[i-1]:
-                    continue
-                final_links.append(link)
-            # Supplying a misleading link manually
-            final_links.insert(139, "https://theravada.ru/Teaching/Canon/Suttanta/Texts/mn140-dhatuvibhanga-sutta-sv.htm")
-            final_links.insert(144, "https://theravada.ru/Teaching/Canon/Suttanta/Texts/mn145-punnovada-sutta-sv.htm")
-
-        elif nikaya_name == 'дигха-hикая':
-            final_links = [link.get('href') for link in links if link.get('href') and (re.search(r'dn[0-9]+', link.get('href'), re.IGNORECASE) or "тхеравада.рф/palicanon/суттанта/дигха-hикая" in link.get('href') or "node/translation" in link.get('href'))]
-
-        elif nikaya_name == 'theravada.su':
-            pre_links = ["https://tipitaka.theravada.su" + link.get('href') for link in links if link.get('href') and ("node/translation" in link.get('href') or "node/table" in link.get('href'))]
-            final_links = [link.replace('translation', 'table') for link in pre_links]
-
-        elif nikaya_name == 'digha':
-            pre_links = ['https://www.theravada.ru/Teaching/Canon/Suttanta/' + link.get('href') for link in links if link.get('href') and 'Texts/dn' in link.get('href')]
-            final_links = pre_links
-
-        return final_links
-    else:
-        # logger.info(f"Failed to retrieve the page. Status code: {response.status_code}")
-        print(f"Failed to retrieve the page. Status code: {response.status_code}")
+    return nikaya_url
+
+def sutta_list(nikaya_name: str):
+    nikaya_url = nikaya_index_url(nikaya_name)
+
+    # The page is decoded with the encoding of its site (windows-1251 for theravada.ru)
+    try:
+        page_content = fetch_text(nikaya_url)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to retrieve the page: {e}")
+        return None
+
+    return parse_sutta_links(nikaya_name, page_content)
+
+def sutta_lists(*nikaya_names: str):
+    """Link lists of several nikayas, their index pages fetched from all sites at once."""
+    urls = {name: nikaya_index_url(name) for name in nikaya_names}
+    pages = fetch_all(urls.values())
+    return {name: parse_sutta_links(name, pages[url]) if pages[url] else None for name, url in urls.items()}
 
-def probudnarod_list():
+def parse_sutta_links(nikaya_name: str, page_content: str):
+    soup = BeautifulSoup(page_content, features='lxml')
+    links = soup.find_all('a')
+
+    if nikaya_name == 'мадджхима-hикая':
+        hrefs = [link.get('href') for link in links if re.search(r'mn\d+', link.get('href')) and not re.search(r'dhamma.ru', link.get('href'))]
+        final_links = [hrefs[0]]
+
+        i = 0
+        for link in hrefs[1:]:
+            i += 1
+            sutta_no = re.search(r'mn[0-9]+', link).group()[2:]
+            if sutta_no in hrefs[i-1]:
+                continue
+            final_links.append(link)
+        # Supplying a misleading link manually
+        final_links.insert(139, "https://theravada.ru/Teaching/Canon/Suttanta/Texts/mn140-dhatuvibhanga-sutta-sv.htm")
+        final_links.insert(144, "https://theravada.ru/Teaching/Canon/Suttanta/Texts/mn145-punnovada-sutta-sv.htm")
+
+    elif nikaya_name == 'дигха-hикая':
+        final_links = [link.get('href') for link in links if link.get('href') and (re.search(r'dn[0-9]+', link.get('href'), re.IGNORECASE) or "тхеравада.рф/palicanon/суттанта/дигха-hикая" in link.get('href') or "node/translation" in link.get('href'))]
+
+    elif nikaya_name == 'theravada.su':
+        pre_links = ["https://tipitaka.theravada.su" + link.get('href') for link in links if link.get('href') and ("node/translation" in link.get('href') or "node/table" in link.get('href'))]
+        final_links = [link.replace('translation', 'table') for link in pre_links]
+
+    elif nikaya_name == 'digha':
+        pre_links = ['https://www.theravada.ru/Teaching/Canon/Suttanta/' + link.get('href') for link in links if link.get('href') and 'Texts/dn' in link.get('href')]
+        final_links = pre_links
+
+    return final_links
+
+def probudnarod_list(ttl: float = AVAILABILITY_TTL):
     base_url = 'https://probud.narod.ru/sutra/'
     save_dir = 'probud_narod'
     os.makedirs(save_dir, exist_ok=True)
+    state_file = os.path.join(save_dir, 'availability.json')
     sutta_list = []
 
-    def url_loop(nikaya: str, sesion):
+    def fetch_and_save(url: str) -> bool:
+        # Most of the numbers are missing: a HEAD tells them apart without a failed download apiece
+        if not url_exists(url):
+            return False
+        try:
+            content = fetch_page(url, ENCODING)
+        except requests.exceptions.RequestException:
+            return False
+        with open(os.path.join(save_dir, os.path.basename(url)), 'w', encoding='utf-8') as f:
+            f.write(content)
+        return True
+
+    def url_loop(nikaya: str):
         nikaya_url = base_url + nikaya
-        partial_list = []
         if nikaya == 'DN':
             limit = 35
         elif nikaya == 'MN':
             limit = 153
 
-        for n in tqdm(range(1, limit), desc='Testing the addresses:', ascii=True, colour='green'):
-            current_url = nikaya_url + str(n) + '.html'
-            content = fetch_page_content(session, current_url)
-            if content:
-
-                if nikaya == 'DN':
-                    save_as = re.search('DN[0-9]+[.]html$', current_url).group()
-                elif nikaya == 'MN':
-                    save_as = re.search('MN[0-9]+[.]html$', current_url).group()
-                with open(f'{save_dir}/{save_as}', 'w', encoding='utf-8')as f:
-                    f.write(content)
-                partial_list.append(current_url)
-        return partial_list
-    
-    session = create_session()
-    sutta_list.append(url_loop('DN', session))
-    sutta_list.append(url_loop('MN', session))
+        urls = [nikaya_url + str(n) + '.html' for n in range(1, limit)]
+        # Pages found earlier are probed again only once they are older than ttl
+        available = probe_availability(nikaya, urls, fetch_and_save, ttl, state_file=state_file)
+        return [url for url, ok in zip(urls, available) if ok]
+
+    sutta_list.append(url_loop('DN'))
+    sutta_list.append(url_loop('MN'))
 
     return sutta_list
 
@@ -1,6 +1,6 @@
 import requests
 from bs4 import BeautifulSoup
-import chardet
+from charset_sniffer import sniff_encoding
 from urllib.parse import urljoin
 
 class RussianTextFetcher:
@@ -16,47 +16,10 @@ class RussianTextFetcher:
             response = self.session.get(url, timeout=10)
             response.raise_for_status()
             
-            # Method 1: Use chardet to detect encoding
-            detected = chardet.detect(response.content)
-            detected_encoding = detected['encoding']
-            confidence = detected['confidence']
-            
-            print(f"Detected encoding: {detected_encoding} (confidence: {confidence:.2f})")
-            
-            # Method 2: Try apparent encoding from requests
-            apparent_encoding = response.apparent_encoding
-            print(f"Apparent encoding: {apparent_encoding}")
-            
-            # Method 3: Check server-declared encoding
-            server_encoding = response.encoding
-            print(f"Server declared encoding: {server_encoding}")
-            
-            # Try encodings in order of preference
-            encodings_to_try = [
-                detected_encoding,
-                apparent_encoding, 
-                server_encoding,
-                'utf-8',
-                'windows-1251',
-                'koi8-r',
-                'iso-8859-5'
-            ]
-            
-            # Remove None values and duplicates while preserving order
-            seen = set()
-            encodings_to_try = [x for x in encodings_to_try 
-                              if x is not None and not (x in seen or seen.add(x))]
-            
-            for encoding in encodings_to_try:
-                try:
-                    text = response.content.decode(encoding)
-                    print(f"✓ Successfully decoded with: {encoding}")
-                    return text, encoding
-                except (UnicodeDecodeError, UnicodeError, LookupError) as e:
-                    print(f"✗ Failed with {encoding}: {e}")
-                    continue
-            
-            raise ValueError("Could not decode content with any encoding")
+            # BOM / meta charset / byte frequencies of the first few KB
+            encoding = sniff_encoding(response.content)
+            print(f"Detected encoding: {encoding}")
+            return response.content.decode(encoding, errors='replace'), encoding
             
         except requests.RequestException as e:
             raise Exception(f"Failed to fetch URL: {e}")
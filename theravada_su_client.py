@@ -0,0 +1,180 @@
+"""
+Client for the parallel-translation tables of tipitaka.theravada.su.
+Every sutta needs a GET (to read the form tokens) followed by a POST of the
+selected columns; the client runs these GET -> POST pairs for many suttas at
+once over pooled keep-alive connections.
+"""
+
+import requests
+import re, threading
+from bs4 import BeautifulSoup, Tag
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from download_engine import create_pooled_session
+from charset_sniffer import decode_html
+from fetch_policy import default_policy, RETRY_STATUSES
+from tqdm import tqdm
+
+SITE_URL = 'https://tipitaka.theravada.su'
+MAX_WORKERS = 4
+
+RUSSIAN_LABEL = "Сыркин А.Я., 2020 - русский"
+PREF_ENG_LABEL = "Морис Уолш - english"
+FALL_ENG_LABEL = "Thanissaro bhikkhu - english"
+
+FORM_TAG = re.compile(r'<form\b[^>]*\baction=', re.IGNORECASE)
+
+
+class FormDetails:
+    def __init__(self, columns: Dict[str, str], form_build_id: str, form_id: str, action: str):
+        self.columns = columns              # column label -> checkbox name
+        self.form_build_id = form_build_id
+        self.form_id = form_id
+        self.action = action
+
+class TheravadaSuClient:
+    def __init__(self, workers: int = MAX_WORKERS):
+        self.workers = workers
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = create_pooled_session(self.workers)
+        return session
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Request under the fetch policy; statuses worth retrying raise so that the policy retries them."""
+        def attempt() -> requests.Response:
+            response = self.session.request(method, url, timeout=20, **kwargs)
+            if response.status_code in RETRY_STATUSES:
+                response.raise_for_status()
+            return response
+
+        return default_policy().call(url, attempt)
+
+    def form_details(self, url: str) -> FormDetails:
+        """
+        Fetch the page and read the form tokens and the available columns.
+        Only the form with the columns is parsed, not the whole page; its action, inputs and
+        column labels all come from that one element.
+        """
+        response = self._request('GET', url)
+        if response.status_code != 200:
+            raise ValueError(f"Failed to fetch {url}: HTTP {response.status_code}")
+        page = decode_html(response.content, 'utf-8')
+
+        form = self._column_form(page)
+        if form is None:
+            raise ValueError(f"No form found on {url}")
+
+        values = {inp.get('name'): inp.get('value') for inp in form.find_all('input')}
+        if not values.get('form_build_id'):
+            raise ValueError(f"No input with name 'form_build_id' found on {url}")
+        if not values.get('form_id'):
+            raise ValueError(f"No input with name 'form_id' found on {url}")
+
+        action = form['action']
+        if action.startswith('/'):
+            action = SITE_URL + action
+        return FormDetails(self._column_labels(form), values['form_build_id'], values['form_id'], action)
+
+    @staticmethod
+    def _column_form(page: str) -> Optional[Tag]:
+        """The form of the page with column checkboxes (or else the first form with an action), parsed alone."""
+        forms = []
+        for form_match in FORM_TAG.finditer(page):
+            form_end = page.find('</form>', form_match.start())
+            form_html = page[form_match.start():form_end + len('</form>') if form_end != -1 else len(page)]
+            forms.append(BeautifulSoup(form_html, 'html.parser').find('form'))
+            if forms[-1].find('input', attrs={'type': 'checkbox', 'name': lambda n: n and n.startswith('col_')}):
+                return forms[-1]
+        return forms[0] if forms else None
+
+    @staticmethod
+    def _column_labels(form: Tag) -> Dict[str, str]:
+        """Column label -> name of its checkbox, for the column checkboxes of the form."""
+        columns = {}
+        for inp in form.find_all('input', attrs={'type': 'checkbox', 'name': lambda n: n and n.startswith('col_')}):
+            label_elem = inp.find_next_sibling('label')
+            if label_elem:
+                columns[label_elem.text.strip()] = inp['name']
+        return columns
+
+    def fetch_sutta(self, url: str, russian_label: str = RUSSIAN_LABEL, pref_eng_label: str = PREF_ENG_LABEL,
+                    fall_eng_label: str = FALL_ENG_LABEL) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Submit the form with the Russian and an English column selected.
+        Returns the chapter title and the interleaved Russian-English paragraphs, or (None, None).
+        """
+        form = self.form_details(url)
+
+        if russian_label not in form.columns:
+            print(f"Warning: Russian translation '{russian_label}' not available on {url}")
+            return None, None
+        selected = [form.columns[russian_label]]
+        if pref_eng_label in form.columns:
+            selected.append(form.columns[pref_eng_label])
+        elif fall_eng_label in form.columns:
+            selected.append(form.columns[fall_eng_label])
+
+        post_data = {col: 'on' for col in selected}
+        post_data['form_build_id'] = form.form_build_id
+        post_data['form_id'] = form.form_id
+        post_data['op'] = 'Обновить'
+
+        response = self._request('POST', form.action, data=post_data)
+        if response.status_code != 200:
+            print(f"Warning: Failed to post form for {url}: HTTP {response.status_code}")
+            return None, None
+
+        return self.parse_table(url, decode_html(response.content, 'utf-8'))
+
+    @staticmethod
+    def parse_table(url: str, page: str) -> Tuple[Optional[str], Optional[str]]:
+        soup = BeautifulSoup(page, 'html.parser')
+
+        chapter_p = soup.find('p', class_='chapter')
+        if not chapter_p:
+            print(f"Warning: No chapter title found on {url}")
+            return None, None
+        full_title = chapter_p.text.strip()
+
+        table = soup.find('table', class_='table table-striped')
+        if not table:
+            print(f"Warning: No content table found on {url}")
+            return None, None
+
+        parts = []
+        tbody = table.find('tbody')
+        if tbody:
+            for tr in tbody.find_all('tr'):
+                tds = tr.find_all('td')
+                if not tds:
+                    continue
+                # Subheadings span the whole row
+                if len(tds) == 1 and tds[0].has_attr('colspan'):
+                    parts.append(f'<h2>{tds[0].text.strip()}</h2>')
+                    continue
+                # First td is Russian, the second (if present) English
+                rus_text = tds[0].text.strip()
+                eng_text = tds[1].text.strip() if len(tds) > 1 else ''
+                if rus_text:
+                    parts.append(f'<p>{rus_text}</p>')
+                if eng_text:
+                    parts.append(f'<p>{eng_text}</p>')
+
+        return full_title, ''.join(parts)
+
+    def fetch_suttas(self, urls: List[str], **labels) -> List[Tuple[Optional[str], Optional[str]]]:
+        """fetch_sutta for all urls, several GET -> POST pairs in flight at once; results keep the url order."""
+        def fetch(url):
+            try:
+                return self.fetch_sutta(url, **labels)
+            except (ValueError, requests.exceptions.RequestException) as e:
+                print(f"Error processing {url}: {e}")
+                return None, None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(tqdm(pool.map(fetch, urls), total=len(urls), desc="Fetching suttas:", ascii=True, colour='green'))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Single bottom-up normalization pass over a parsed page.
+The pages nest the same wrapper many times over (<font face=.. size=2> inside <font face=.. size=2>,
+<span style=..> inside the same <span style=..>), and carry empty <div> and Word's empty <o:p> tags.
+The helpers used to collapse them with while span.span.span: span.unwrap() loops over every
+find_all('span') result, which rescans the same subtrees again and again (and unwrapped the outer
+tag whatever its attributes). flatten_wrappers visits every tag once, children before parents:
+    - a wrapper whose only child (whitespace aside) is the same tag with the same attributes is unwrapped;
+    - an empty <div> or <o:p> (nothing but whitespace in it) is removed;
+    - a <div> without attributes holding nothing but paragraphs is unwrapped.
+
+    python3 tree_normalizer.py [directory ...]    # compare with the old unwrapping loops
+"""
+
+import os, os.path, re, time
+from collections import Counter
+from typing import Union
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import Comment
+from cobraprint import col
+
+# Configuration
+BENCH_DIRS = ['Маджхима Никая', 'Ангуттара Никая grouped', 'Саньютта Никая grouped']
+# tags whose identical nesting renders as one (not <blockquote>, <li>, <small>...: they add up)
+MERGED_TAGS = {'span', 'font', 'div', 'b', 'i', 'u', 'strong', 'em', 'center'}
+EMPTY_DROPPED_TAGS = {'div', 'o:p'}
+RELATIVE_SIZE = re.compile(r'\d\s*(%|em\b|rem\b)|larger|smaller')      # nested, these add up too
+WHITESPACE = ' \t\n\r\f'        # ASCII only: a &nbsp; is content
+
+
+def _is_blank(node) -> bool:
+    return isinstance(node, NavigableString) and not isinstance(node, Comment) and not node.strip(WHITESPACE)
+
+def _only_child(tag: Tag) -> Union[Tag, NavigableString, None]:
+    """The one child of tag that is not whitespace (None if there are none or several)."""
+    only = None
+    for child in tag.contents:
+        if _is_blank(child):
+            continue
+        if only is not None:
+            return None
+        only = child
+    return only
+
+def _is_redundant_wrapper(tag: Tag) -> bool:
+    if tag.name not in MERGED_TAGS or RELATIVE_SIZE.search(tag.get('style', '')):
+        return False
+    child = _only_child(tag)
+    return isinstance(child, Tag) and child.name == tag.name and child.attrs == tag.attrs
+
+def _is_paragraph_div(tag: Tag) -> bool:
+    if tag.name != 'div' or tag.attrs:
+        return False
+    paragraphs = 0
+    for child in tag.contents:
+        if isinstance(child, Tag) and child.name == 'p':
+            paragraphs += 1
+        elif not _is_blank(child):
+            return False
+    return paragraphs > 1
+
+def flatten_wrappers(root: Tag) -> Counter:
+    """
+    Normalize the tree under root in place, in one pass over its tags.
+    Returns the number of tags removed, by tag name.
+    """
+    removed: Counter = Counter()
+    # Reversed document order puts every tag after all of its descendants; a tag removed
+    # takes nothing but itself (and whitespace) out of the tree, so the list stays valid
+    for tag in reversed([node for node in root.descendants if isinstance(node, Tag)]):
+        name = tag.name
+        if name in EMPTY_DROPPED_TAGS and all(_is_blank(child) for child in tag.contents):
+            tag.decompose()
+        elif _is_redundant_wrapper(tag) or _is_paragraph_div(tag):
+            tag.unwrap()
+        else:
+            continue
+        removed[name] += 1
+    return removed
+
+def node_count(root: Tag) -> int:
+    return sum(1 for _ in root.descendants)
+
+def _old_unwrap(soup: BeautifulSoup) -> None:
+    """The loops of html_unwrapper and build_group, for the benchmark."""
+    for span in soup.find_all('span'):
+        while span and span.span and span.span.span:
+            span.unwrap()
+    for font in soup.find_all('font'):
+        while font and font.font and font.font.font:
+            font.font.font.unwrap()
+    for div in soup.find_all('div'):
+        if div.div:
+            div.unwrap()
+
+def benchmark(*directories: str) -> None:
+    """Time of the old loops and of flatten_wrappers on the pages of the directories, and the size of the trees."""
+    for directory in directories or BENCH_DIRS:
+        if not os.path.isdir(directory):
+            print(f'{col.RED}No directory {directory}{col.END}')
+            continue
+        old_time = new_time = 0.0
+        nodes = old_nodes = new_nodes = same_text = 0
+        removed: Counter = Counter()
+        files = sorted(name for name in os.listdir(directory) if name.endswith('.html'))
+        for name in files:
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                page = f.read()
+            soup = BeautifulSoup(page, 'lxml')
+            nodes += node_count(soup)
+            text = ' '.join(soup.get_text().split())
+            start = time.perf_counter()
+            _old_unwrap(soup)
+            old_time += time.perf_counter() - start
+            old_nodes += node_count(soup)
+
+            soup = BeautifulSoup(page, 'lxml')
+            start = time.perf_counter()
+            removed += flatten_wrappers(soup)
+            new_time += time.perf_counter() - start
+            new_nodes += node_count(soup)
+            same_text += text == ' '.join(soup.get_text().split())
+
+        print(f'{col.SEP}{col.GREY}{len(files)} files of {col.GREEN}{directory}{col.END}, {nodes} nodes')
+        print(f'  old loops:        {col.RED}{old_time * 1000:.1f} ms{col.END}, {nodes - old_nodes} nodes removed')
+        print(f'  flatten_wrappers: {col.GREEN}{new_time * 1000:.1f} ms{col.END}, {nodes - new_nodes} nodes removed '
+              f'({(nodes - new_nodes) / (nodes or 1):.1%}): {col.GREY}{dict(removed.most_common())}{col.END}')
+        print(f'  same text:        {col.GREEN}{same_text}{col.END}/{len(files)}{col.SEP}')
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*sys.argv[1:])
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Existence probing of sutta pages.
+Used to discover how many '-01-', '-02-', ... parts a multipart sutta has
+without downloading any of them, and which numbered pages a site offers.
+"""
+
+import requests
+import json, os, os.path
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+from download_engine import host_slot, thread_session, MAX_WORKERS
+from fetch_policy import default_policy, RETRY_STATUSES
+from cobraprint import col
+from tqdm import tqdm
+
+PART_COUNTS_FILE = 'part_counts.json'
+AVAILABILITY_FILE = 'availability.json'
+AVAILABILITY_TTL = 30 * 24 * 3600
+
+
+def probe(url: str) -> requests.Response:
+    """HEAD the url; servers refusing HEAD are asked with a GET instead. Retryable statuses raise."""
+    with host_slot(url):
+        response = thread_session().head(url, timeout=10, allow_redirects=True)
+        if response.status_code in (405, 501):
+            response = thread_session().get(url, timeout=10)
+    if response.status_code in RETRY_STATUSES:
+        response.raise_for_status()
+    return response
+
+def page_exists(url: str) -> bool:
+    """
+    True if the url answers 200; a server that is only briefly unavailable is asked again,
+    and the RequestException is raised if it stays unavailable.
+    """
+    return default_policy().call(url, probe, url).status_code == 200
+
+def url_exists(url: str) -> bool:
+    """As page_exists, with an unreachable url taken as missing (for answers that are asked again later)."""
+    try:
+        return page_exists(url)
+    except requests.exceptions.RequestException:
+        return False
+
+def part_url(first_part_url: str, n: int) -> str:
+    """'...-01-sirkin.htm', 3 -> '...-03-sirkin.htm'"""
+    return first_part_url.replace('-01-', f'-{n:02d}-')
+
+def count_parts(first_part_url: str, exists: Callable[[str], bool] = page_exists) -> int:
+    """
+    Number of consecutive parts of a sutta whose first part is known to exist.
+    The upper bound is found by doubling (2, 4, 8, ...) and then narrowed down by bisection,
+    so a sutta with n parts costs about 2*log2(n) probes. A probe failing for good raises.
+    """
+    low, high = 1, 2
+    while exists(part_url(first_part_url, high)):
+        low, high = high, high * 2
+    # part `low` exists, part `high` does not
+    while high - low > 1:
+        mid = (low + high) // 2
+        if exists(part_url(first_part_url, mid)):
+            low = mid
+        else:
+            high = mid
+    return low
+
+def load_part_counts(cache_file: str = PART_COUNTS_FILE) -> Dict[str, int]:
+    if not os.path.isfile(cache_file):
+        return {}
+    with open(cache_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def probe_part_counts(first_part_urls: Iterable[str], refresh: bool = False, workers: int = MAX_WORKERS,
+                      cache_file: str = PART_COUNTS_FILE) -> Dict[str, int]:
+    """
+    Part counts of all the given suttas, probed concurrently and cached in cache_file.
+    A sutta whose probes failed is reported and counted as its first part only, without caching
+    the count, so that it is probed again on the next run.
+    """
+    counts = {} if refresh else load_part_counts(cache_file)
+    first_part_urls = list(dict.fromkeys(first_part_urls))
+    pending = [url for url in first_part_urls if url not in counts]
+
+    def try_count_parts(url: str) -> Optional[int]:
+        try:
+            return count_parts(url)
+        except requests.exceptions.RequestException:
+            return None
+
+    failed = []
+    if pending:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            found = list(tqdm(pool.map(try_count_parts, pending), total=len(pending),
+                              desc='Finding links:', ascii=True, colour='yellow'))
+        counts.update((url, count) for url, count in zip(pending, found) if count is not None)
+        failed = [url for url, count in zip(pending, found) if count is None]
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(counts, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, cache_file)
+
+    if failed:
+        print(f"{col.SEP}{col.RED}The parts of {len(failed)} suttas could not be counted:{col.END}\n" + '\n'.join(failed) + col.SEP)
+    return {url: counts.get(url, 1) for url in first_part_urls}
+
+def further_parts(first_part_urls: Iterable[str], refresh: bool = False) -> List[str]:
+    """Urls of the 2nd, 3rd, ... parts of the given multipart suttas."""
+    counts = probe_part_counts(first_part_urls, refresh)
+    return [part_url(url, n) for url, count in counts.items() for n in range(2, count + 1)]
+
+def load_availability(state_file: str = AVAILABILITY_FILE) -> Dict[str, dict]:
+    if not os.path.isfile(state_file):
+        return {}
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def probe_availability(collection: str, urls: List[str], probe: Callable[[str], bool] = url_exists,
+                       ttl: float = AVAILABILITY_TTL, workers: int = MAX_WORKERS,
+                       state_file: str = AVAILABILITY_FILE) -> List[bool]:
+    """
+    Availability of the numbered pages of a collection (urls[i] is entry i).
+    The result is kept in state_file as a bitmap per collection plus the time each entry was
+    checked; only entries missing last time or checked longer than ttl seconds ago are probed again.
+    """
+    state = load_availability(state_file)
+    entry = state.get(collection, {'bitmap': '0', 'checked': []})
+    bitmap = int(entry['bitmap'], 16)
+    checked = entry['checked'] + [0] * (len(urls) - len(entry['checked']))
+    now = int(time())
+
+    pending = [i for i in range(len(urls)) if not bitmap >> i & 1 or now - checked[i] > ttl]
+    if pending:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            found = list(tqdm(pool.map(probe, [urls[i] for i in pending]), total=len(pending),
+                              desc='Testing the addresses:', ascii=True, colour='green'))
+        for i, available in zip(pending, found):
+            if available:
+                bitmap |= 1 << i
+            else:
+                bitmap &= ~(1 << i)
+            checked[i] = now
+
+        state[collection] = {'bitmap': format(bitmap, 'x'), 'checked': checked}
+        tmp_file = state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, state_file)
+
+    return [bool(bitmap >> i & 1) for i in range(len(urls))]
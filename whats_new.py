@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+"What's new" check of the nikaya index pages.
+Only the index pages are fetched (a conditional GET each, so an unchanged page costs a 304);
+their sutta links are diffed against the link sets recorded in the catalog and the
+new suttas are put on the update queue instead of recrawling a whole collection.
+The first time an index page is seen its links are only recorded, as the baseline of later checks.
+
+    python3 whats_new.py              # check the index pages and enqueue what is new
+    python3 whats_new.py --download   # download the queued pages
+"""
+
+import requests
+import json, os, os.path
+from urllib.parse import unquote, urlparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+from cobraprint import col
+from charset_sniffer import decode_html
+from crawl_frontier import extract_links, AN_LINK_PATTERN, SN_LINK_PATTERN
+from download_engine import fetch_raw, download_pages, is_saved, tqdm_progress, page_file_name, MAX_WORKERS
+from download_manifest import Manifest
+from sources import source_for
+from sutta_catalog import Catalog, parse_sutta_url, COLLECTION_DIRS, CATALOG_FILE
+from sutta_list import nikaya_index_url, parse_sutta_links
+from tqdm import tqdm
+
+# Configuration
+QUEUE_FILE = 'update_queue.json'
+# Two-level collections: the root page links to nipata / samyutta index pages listing the suttas
+ROOT_INDEXES = [
+    ('https://theravada.ru/Teaching/Canon/Suttanta/anguttara.htm', AN_LINK_PATTERN),
+    ('https://theravada.ru/Teaching/Canon/Suttanta/samyutta.htm', SN_LINK_PATTERN),
+]
+# Single index pages read by sutta_list
+NIKAYA_PAGES = ['digha', 'мадджхима-hикая', 'дигха-hикая']
+# тхеравада.рф pages carry no sutta number, only the nikaya in their path
+RF_COLLECTIONS = {'дигха-hикая': 'DN', 'мадджхима-hикая': 'MN'}
+
+Parser = Callable[[str], List[str]]
+
+
+def load_queue(queue_file: str = QUEUE_FILE) -> Dict[str, dict]:
+    if not os.path.isfile(queue_file):
+        return {}
+    with open(queue_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_queue(queue: Dict[str, dict], queue_file: str = QUEUE_FILE) -> None:
+    tmp_file = queue_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(queue, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_file, queue_file)
+
+def queue_dir(link: str) -> Optional[str]:
+    """Directory of the collection a queued page is downloaded into; None for pages of the other sites."""
+    source = source_for(link).name
+    if source == 'theravada.ru':
+        fields = parse_sutta_url(link)
+        return COLLECTION_DIRS[fields['collection']] if fields else None
+    if source == 'тхеравада.рф':
+        for part in unquote(urlparse(link).path).split('/'):
+            if part in RF_COLLECTIONS:
+                return COLLECTION_DIRS[RF_COLLECTIONS[part]]
+    return None
+
+def index_links(url: str, parse: Parser, stored: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Current links of an index page; the stored links are reused when the page is unchanged.
+    None if the page is unreachable.
+    """
+    try:
+        page = fetch_raw(url)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        return None
+    if stored is not None and not page.changed:
+        return stored
+    return parse(decode_html(page.content, source_for(url).encoding))
+
+def fetch_indexes(catalog: Catalog, indexes: List[Tuple[str, Parser]]) -> Dict[str, Optional[List[str]]]:
+    """Links of all the index pages, fetched concurrently."""
+    stored = {url: catalog.index_links(url) for url, _ in indexes}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        results = list(tqdm(pool.map(lambda index: index_links(index[0], index[1], stored[index[0]]), indexes),
+                            total=len(indexes), desc="Checking index pages:", ascii=True, colour='cyan'))
+    return dict(zip((url for url, _ in indexes), results))
+
+def whats_new(catalog_file: str = CATALOG_FILE, queue_file: str = QUEUE_FILE) -> Dict[str, List[str]]:
+    """
+    Check all the index pages and enqueue the sutta links not seen before.
+    An index page without recorded links gets its links recorded and none queued; pages that have
+    no collection directory (see queue_dir) are not queued. Returns {index url: [new links]} for the pages that have any.
+    """
+    new_links: Dict[str, List[str]] = {}
+    found_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+    with Catalog(catalog_file) as catalog:
+        queue = load_queue(queue_file)
+        roots = fetch_indexes(catalog, [(url, partial(extract_links, pattern=pattern)) for url, pattern in ROOT_INDEXES])
+        indexes = []
+        index_pages = set(roots)
+        for (root_url, pattern), sub_indexes in zip(ROOT_INDEXES, roots.values()):
+            if sub_indexes is None:
+                continue
+            catalog.set_index_links(root_url, sub_indexes)
+            index_pages.update(sub_indexes)
+            indexes += [(url, partial(extract_links, pattern=pattern)) for url in sub_indexes]
+        indexes += [(nikaya_index_url(name), partial(parse_sutta_links, name)) for name in NIKAYA_PAGES]
+
+        for index_url, links in fetch_indexes(catalog, indexes).items():
+            if links is None:
+                continue
+            # Index pages link to each other; only the sutta links count
+            links = [link for link in dict.fromkeys(links) if link not in index_pages]
+            stored = catalog.index_links(index_url)
+            catalog.set_index_links(index_url, links)
+            if stored is None:
+                # Everything listed would count as new: the first fetch is the baseline
+                print(f'{col.GREY}{index_url}{col.END}: {col.GREEN}{len(links)}{col.END} links recorded as the baseline')
+                continue
+            known = set(stored)
+            fresh = [link for link in links if link not in known and link not in queue
+                     and queue_dir(link) and not catalog.by_url(link)]
+            removed = known - set(links)
+            if fresh:
+                new_links[index_url] = fresh
+                for link in fresh:
+                    queue[link] = {'index': index_url, 'found_at': found_at}
+            if removed:
+                print(f'{col.GREY}{index_url}{col.END}: {col.RED}{len(removed)}{col.END} links no longer listed')
+
+    save_queue(queue, queue_file)
+    total = sum(len(links) for links in new_links.values())
+    print(f'{col.SEP}{col.GREEN}{total}{col.END} new sutta pages found on {len(new_links)} index pages; '
+          f'{col.RED}{len(queue)}{col.END} pages queued in {col.GREEN}{queue_file}{col.END}.{col.SEP}')
+    return new_links
+
+def download_updates(catalog_file: str = CATALOG_FILE, queue_file: str = QUEUE_FILE) -> List[str]:
+    """
+    Download the queued pages into the directories of their collections and catalog them.
+    Pages that fail stay in the queue; those that have no collection directory are dropped.
+    """
+    queue = load_queue(queue_file)
+    by_dir: Dict[str, List[str]] = {}
+    done = []
+    manifest = Manifest()
+    with Catalog(catalog_file) as catalog:
+        for link in list(queue):
+            save_dir = queue_dir(link)
+            if save_dir is None:
+                del queue[link]
+            else:
+                by_dir.setdefault(save_dir, []).append(link)
+        for save_dir, links in by_dir.items():
+            download_pages(links, save_dir, manifest=manifest, progress=tqdm_progress(f"Updating {save_dir}:", 'green'))
+            links = [link for link in links if is_saved(link, os.path.join(save_dir, page_file_name(link)), manifest)]
+            catalog.add_links(links, save_dir)
+            done += links
+    for link in done:
+        del queue[link]
+    save_queue(queue, queue_file)
+
+    print(f'{col.SEP}{col.GREEN}{len(done)}{col.END} queued pages downloaded, {col.RED}{len(queue)}{col.END} left in the queue.{col.SEP}')
+    return done
+
+if __name__ == '__main__':
+    import sys
+    if '--download' in sys.argv[1:]:
+        download_updates()
+    else:
+        whats_new()